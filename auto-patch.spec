@@ -57,16 +57,24 @@ python3 setup.py test
 
 
 %pre
-%service_add_pre %{name}.timer
+%service_add_pre %{name}.timer %{name}-prefetch.timer %{name}-mail.timer \
+	%{name}-check.timer %{name}-digest.service %{name}-daemon.socket \
+	%{name}-lease.service
 
 %post
-%service_add_post %{name}.timer
+%service_add_post %{name}.timer %{name}-prefetch.timer %{name}-mail.timer \
+	%{name}-check.timer %{name}-digest.service %{name}-daemon.socket \
+	%{name}-lease.service
 
 %preun
-%service_del_preun %{name}.timer
+%service_del_preun %{name}.timer %{name}-prefetch.timer %{name}-mail.timer \
+	%{name}-check.timer %{name}-digest.service %{name}-daemon.socket \
+	%{name}-lease.service
 
 %postun
-%service_del_postun %{name}.timer
+%service_del_postun %{name}.timer %{name}-prefetch.timer %{name}-mail.timer \
+	%{name}-check.timer %{name}-digest.service %{name}-daemon.socket \
+	%{name}-lease.service
 
 
 %files
@@ -74,7 +82,7 @@ python3 setup.py test
 %doc README.rst CHANGES.rst
 %license LICENSE.txt
 %config %{_sysconfdir}/auto-patch.cfg
-%exclude %{python3_sitelib}/*
+%{python3_sitelib}/*
 %{_sbindir}/auto-patch
 %{_unitdir}/*
 
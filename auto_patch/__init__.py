@@ -0,0 +1,7 @@
+"""Call zypper to install security and other system updates.
+
+The auto-patch script is a thin wrapper around auto_patch.main.main().
+Importing this package is kept cheap: modules that are only needed
+in some runs, such as those to send mail or to compare versions, are
+imported when needed and the configuration is read in main().
+"""
@@ -0,0 +1,135 @@
+"""Run a process with asyncio, enforcing a timeout.
+
+Keepalives are sent to the systemd watchdog while the process runs
+with a timeout, as a process that hangs gets terminated once the
+timeout expires.  Without a timeout, only output of the process is
+taken as a sign of life.
+"""
+
+import asyncio
+import codecs
+import logging
+import subprocess
+
+from .watchdog import watchdog
+
+
+log = logging.getLogger(__name__)
+
+
+class _Protocol(asyncio.SubprocessProtocol):
+    """Feed the standard output of the process line by line to
+    handle_line() and write its standard error to errf as it arrives.
+
+    Lines longer than line_limit characters are split.  The future done is
+    set once the process has exited and both pipes are closed.
+    """
+
+    def __init__(self, handle_line, errf, line_limit, done):
+        self.handle_line = handle_line
+        self.errf = errf
+        self.line_limit = line_limit
+        self.done = done
+        self._pending = ""
+        self._out_decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        self._err_decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        self._open = {1, 2}
+        self._exited = False
+        self.keepalive_on_output = True
+
+    def _feed(self, text, final=False):
+        if "\r" in text:
+            text = text.replace("\r\n", "\n")
+        lines = (self._pending + text).split("\n")
+        self._pending = lines.pop()
+        for line in lines:
+            self.handle_line(line + "\n")
+        if self._pending and (final or
+                              len(self._pending) > self.line_limit):
+            self.handle_line(self._pending)
+            self._pending = ""
+
+    def pipe_data_received(self, fd, data):
+        if fd == 1:
+            self._feed(self._out_decoder.decode(data))
+        else:
+            self.errf.write(self._err_decoder.decode(data))
+        if self.keepalive_on_output:
+            watchdog.keepalive()
+
+    def pipe_connection_lost(self, fd, exc):
+        if fd == 1:
+            self._feed(self._out_decoder.decode(b"", final=True), final=True)
+        elif fd == 2:
+            self.errf.write(self._err_decoder.decode(b"", final=True))
+        self._open.discard(fd)
+        self._check_done()
+
+    def process_exited(self):
+        self._exited = True
+        self._check_done()
+
+    def _check_done(self):
+        if self._exited and not self._open and not self.done.done():
+            self.done.set_result(None)
+
+
+async def _keepalive(interval):
+    while True:
+        await asyncio.sleep(interval)
+        watchdog.keepalive()
+
+async def _run(cmd, handle_line, errf, timeout, kill_timeout, line_limit):
+    loop = asyncio.get_event_loop()
+    done = loop.create_future()
+    transport, protocol = await loop.subprocess_exec(
+        lambda: _Protocol(handle_line, errf, line_limit, done), *cmd,
+        stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    pinger = None
+    if watchdog.interval and timeout:
+        protocol.keepalive_on_output = False
+        pinger = loop.create_task(_keepalive(watchdog.interval))
+    try:
+        finished, _ = await asyncio.wait({done}, timeout=(timeout or None))
+        if finished:
+            return transport.get_returncode()
+        log.warning("%s did not finish within %d seconds, "
+                    "sending SIGTERM", cmd[0], timeout)
+        transport.terminate()
+        finished, _ = await asyncio.wait({done}, timeout=kill_timeout)
+        if not finished:
+            if transport.get_returncode() is None:
+                log.warning("%s did not exit after SIGTERM, "
+                            "sending SIGKILL", cmd[0])
+                transport.kill()
+            # The pipes may be held open by other processes started
+            # by the command, so do not wait forever for them to end.
+            await asyncio.wait({done}, timeout=kill_timeout)
+        return transport.get_returncode()
+    finally:
+        if pinger is not None:
+            pinger.cancel()
+        transport.close()
+
+def run_process(cmd, handle_line, errf, timeout=0, kill_timeout=30,
+                line_limit=1048576):
+    """Run cmd, feed its standard output line by line to handle_line()
+    and write its standard error to errf.  Return the exit code.
+
+    If cmd does not finish within timeout seconds, it is terminated
+    with SIGTERM and, if it does not exit within kill_timeout seconds,
+    killed with SIGKILL.  The exit code is then the one cmd ended
+    with, negative if killed by a signal, or None if it did not even
+    exit after SIGKILL.  A timeout of 0 means no timeout.
+    """
+    loop = asyncio.new_event_loop()
+    # Python before 3.8 needs the loop to be set as the current one
+    # for the child watcher to work.
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(_run(cmd, handle_line, errf, timeout,
+                                            kill_timeout, line_limit))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
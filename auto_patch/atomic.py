@@ -0,0 +1,38 @@
+"""Write files atomically.
+"""
+
+from contextlib import contextmanager
+import os
+import tempfile
+
+
+@contextmanager
+def atomic_write(path, mode='wt', perm=None, fsync=False):
+    """Write to path atomically in the body of the with statement.
+
+    A temporary file in the directory of path is opened with mode and
+    returned as the target of the with statement.  At the end of the
+    body, the file gets the permissions perm if given, is synced to
+    disk if fsync is True, and is renamed to path.  Readers thus see
+    either the old or the new content, never a partially written file.
+    On error, the temporary file is removed and path is left alone.
+    """
+    directory, fname = os.path.split(path)
+    f = tempfile.NamedTemporaryFile(mode=mode, dir=(directory or "."),
+                                    prefix=".%s." % fname, suffix=".tmp",
+                                    delete=False)
+    try:
+        with f:
+            yield f
+            f.flush()
+            if perm is not None:
+                os.fchmod(f.fileno(), perm)
+            if fsync:
+                os.fsync(f.fileno())
+        os.replace(f.name, path)
+    except BaseException:
+        try:
+            os.unlink(f.name)
+        except OSError:
+            pass
+        raise
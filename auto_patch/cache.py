@@ -0,0 +1,92 @@
+"""Persistent cache of the results of probing the zypper binary.
+"""
+
+import json
+import logging
+import os
+
+from .atomic import atomic_write
+
+
+log = logging.getLogger(__name__)
+
+
+class ProbeCache:
+    """Cache results of probing a binary across runs.
+
+    The results are stored in a JSON file in directory.  They are
+    keyed on the inode, size, and modification time of the binary, so
+    they are discarded as soon as the binary gets replaced, e.g. by an
+    update.  If the binary can not be found, nothing is cached.
+    Failure to read or to write the cache file is not an error, the
+    probes will then be run each time.
+    """
+
+    fname = "probes.json"
+
+    def __init__(self, directory, binary):
+        self.directory = directory
+        self.binary = binary
+        self.path = os.path.join(directory, self.fname)
+        self._key = None
+        self._probes = None
+
+    def _binary_key(self):
+        try:
+            st = os.stat(self.binary)
+        except OSError:
+            return None
+        return "%d:%d:%d" % (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def _load(self):
+        self._key = self._binary_key()
+        self._probes = {}
+        if self._key is None:
+            return
+        try:
+            with open(self.path, "rt") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        entry = data.get(self.binary) if isinstance(data, dict) else None
+        if isinstance(entry, dict) and entry.get('key') == self._key:
+            self._probes = entry.get('probes', {})
+        else:
+            log.debug("no valid cached probes for %s", self.binary)
+
+    def _save(self):
+        try:
+            with open(self.path, "rt") as f:
+                data = json.load(f)
+            if not isinstance(data, dict):
+                data = {}
+        except (OSError, ValueError):
+            data = {}
+        data[self.binary] = { 'key': self._key, 'probes': self._probes }
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with atomic_write(self.path) as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+                f.write("\n")
+        except OSError as err:
+            log.debug("cannot write probe cache: %s", err)
+
+    def get(self, name, probe):
+        """Return the result of the probe name.
+
+        If there is no valid cached value, call probe() to get it and
+        store it in the cache.  The value must be serializable as JSON.
+        """
+        if self._probes is None:
+            self._load()
+        try:
+            value = self._probes[name]
+            log.debug("cached %s of %s: %s", name, self.binary, value)
+            return value
+        except KeyError:
+            pass
+        value = probe()
+        if self._key is not None:
+            self._probes[name] = value
+            self._save()
+        return value
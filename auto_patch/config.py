@@ -0,0 +1,190 @@
+"""Configuration of auto-patch.
+
+The configuration is not read at import time.  Call read_config() to
+read the configuration files.  The defaults for the hostname and the
+user name require a DNS lookup and a query of the user database
+respectively.  They are only resolved when first needed for the
+interpolation of another option, e.g. when sending the mail report.
+"""
+
+from collections import ChainMap
+from collections.abc import Mapping
+from configparser import BasicInterpolation, ConfigParser
+import getpass
+import os
+import socket
+
+
+class LazyDefaults(Mapping):
+    """A mapping of values that are computed on first access.
+
+    The values are given as functions taking no arguments.
+    """
+
+    def __init__(self, **factories):
+        self._factories = factories
+        self._values = {}
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            value = self._factories[key]()
+            self._values[key] = value
+            return value
+
+    def __iter__(self):
+        return iter(self._factories)
+
+    def __len__(self):
+        return len(self._factories)
+
+class LazyInterpolation(BasicInterpolation):
+    """Basic interpolation with fallback to lazily resolved defaults.
+
+    Values set in the configuration take precedence over the lazy
+    defaults.
+    """
+
+    def __init__(self, defaults):
+        self.lazy_defaults = defaults
+
+    def before_get(self, parser, section, option, value, defaults):
+        defaults = ChainMap(defaults, self.lazy_defaults)
+        return super().before_get(parser, section, option, value, defaults)
+
+
+def get_config_files():
+    try:
+        return os.environ['AUTO_PATCH_CFG'].split(':')
+    except KeyError:
+        return "/etc/auto-patch.cfg"
+
+lazy_defaults = LazyDefaults(
+    hostname=socket.getfqdn,
+    user=getpass.getuser,
+)
+
+config_defaults = {
+    'mailreport': {
+        'report': "on",
+        'mailfrom': "%(user)s@%(hostname)s",
+        'mailto': "root@%(hostname)s",
+        'subject': "auto-patch %(hostname)s",
+        'mailhost': "localhost",
+        'changes_only': "off",
+        'tail_lines': "20",
+        'max_size': "5242880",
+    },
+    'zypper': {
+        'path': "/usr/bin/zypper",
+        'lockfile': "/run/zypp.pid",
+        'cache_dir': "/var/cache/auto-patch",
+        'refresh': "on",
+        'refresh_max_age': "0",
+        'xmlout': "off",
+        'passes': "all",
+        'backend': "asyncio",
+        'timeout': "3600",
+        'timeouts': "patch:14400",
+        'kill_timeout': "30",
+    },
+    'retry': {
+        'max': "30",
+        'wait': "60",
+        'max_wait': "600",
+        'deadline': "1800",
+        'skip_failed_repos': "off",
+    },
+    'restart': {
+        'services': "off",
+        'allow': "",
+        'deny': "dbus*, systemd-*, user@*, getty@*, serial-getty@*, "
+                "auto-patch*",
+        'batch_size': "4",
+        'timeout': "120",
+        'systemctl': "/usr/bin/systemctl",
+    },
+    'window': {
+        'end': "",
+        'duration': "0",
+        'margin': "300",
+    },
+    'splay': {
+        'window': "7200",
+    },
+    'lease': {
+        'directory': "",
+        'service': "",
+        'slots': "4",
+        'ttl': "14400",
+        'wait': "3600",
+        'listen': "unix:/run/auto-patch/lease.sock",
+    },
+    'check': {
+        'refresh_max_age': "3600",
+        'action': "patch",
+    },
+    'daemon': {
+        'socket': "/run/auto-patch/daemon.sock",
+        'idle_timeout': "600",
+    },
+    'digest': {
+        'collector': "",
+        'timeout': "10",
+        'listen': "unix:/run/auto-patch/digest.sock",
+        'interval': "3600",
+    },
+    'roots': {
+        'roots': "",
+        'workers': "4",
+    },
+    'rollout': {
+        'targets': "",
+        'transport': "ssh",
+        'command': "auto-patch",
+        'ssh_options': "-o BatchMode=yes",
+        'timeout': "28800",
+        'canary': "1",
+        'waves': "10, 50, 100",
+        'concurrency': "20",
+        'max_failure_rate': "0.1",
+    },
+    'spool': {
+        'directory': "",
+        'wait': "300",
+        'max_wait': "3600",
+        'expire': "604800",
+        'timeout': "60",
+    },
+    'metrics': {
+        'directory': "",
+    },
+    'history': {
+        'database': "",
+    },
+    'logging': {
+        'journal_level': "INFO",
+        'stderr_level': "DEBUG",
+        'report_level': "WARNING",
+    },
+}
+config = ConfigParser(comment_prefixes=('#', '!'),
+                      interpolation=LazyInterpolation(lazy_defaults))
+for k, v in config_defaults.items():
+    config[k] = v
+
+def read_config(config_files=None):
+    """Read the configuration files.
+
+    If config_files is None, the files are taken from the environment
+    variable AUTO_PATCH_CFG, falling back to /etc/auto-patch.cfg.
+    """
+    if config_files is None:
+        config_files = get_config_files()
+    return config.read(config_files)
+
+def get_hostname():
+    """Return the hostname, either as configured or looked up.
+    """
+    return config['mailreport'].get('hostname') or lazy_defaults['hostname']
@@ -0,0 +1,237 @@
+"""Serve commands on a Unix socket.
+
+In daemon mode, auto-patch keeps the configuration, the logging setup
+and the Zypper object resident and accepts commands on a Unix socket,
+so that frequent checks do not pay for the startup each time.  The
+socket is normally passed by systemd socket activation.  The daemon
+exits after having been idle for some time and gets started again by
+systemd on the next connection.
+
+The protocol is line based: the client sends one command per line and
+gets one line of JSON in return for each command.  If a command
+fails, the reply has the error message in error.  The commands are:
+
+check
+    Call zypper patch-check and report the patches needed, as
+    auto-patch --check would do.
+
+patch
+    Do a full run to install the needed patches, including the mail
+    report, the metrics, and the history, as auto-patch would do.
+
+status
+    Report the state of the daemon and the outcome of the last run.
+"""
+
+import argparse
+import json
+import logging
+import os
+import signal
+import socket
+from time import monotonic, time
+
+from .config import config
+from .exception import (ZypperExitException, ZypperPatchesAvailable,
+                        ZypperSecurityPatchesAvailable)
+from .status import RunStatus
+
+
+log = logging.getLogger(__name__)
+
+# The first file descriptor passed by systemd socket activation.
+listen_fds_start = 3
+
+# Seconds to wait for the client to send a command.
+client_timeout = 60
+
+
+class _Stop(Exception):
+    pass
+
+def get_listen_socket(path):
+    """Return the socket to listen on and whether it has been passed
+    by systemd.
+
+    If no socket has been passed by systemd, a Unix socket bound to
+    path is created.
+    """
+    if (os.environ.get('LISTEN_PID') == str(os.getpid()) and
+        int(os.environ.get('LISTEN_FDS', "0")) >= 1):
+        for var in ('LISTEN_PID', 'LISTEN_FDS', 'LISTEN_FDNAMES'):
+            os.environ.pop(var, None)
+        return socket.socket(fileno=listen_fds_start), True
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    os.chmod(path, 0o600)
+    sock.listen()
+    return sock, False
+
+class Daemon:
+    """Serve commands on a Unix socket until idle for idle_timeout
+    seconds.
+    """
+
+    def __init__(self):
+        cfg = config['daemon']
+        self.path = cfg.get('socket')
+        self.idle_timeout = cfg.getfloat('idle_timeout')
+        self.zypper = None
+        self.started = time()
+        self.requests = 0
+        self.last_run = None
+        self.busy = False
+        self.stopping = False
+        self.commands = {
+            'check': self.check,
+            'patch': self.patch,
+            'status': self.status,
+        }
+
+    def get_zypper(self):
+        """Return the resident Zypper object, reset for a new run.
+        """
+        if self.zypper is None:
+            from .workflow import get_zypper
+            xmlout = config['zypper'].getboolean('xmlout')
+            self.zypper = get_zypper(xmlout=xmlout)
+        else:
+            self.zypper.reset()
+        return self.zypper
+
+    def check(self):
+        from .workflow import check
+        zypper = self.get_zypper()
+        status = RunStatus(mode="check")
+        urgent = check(status=status, zypper=zypper)
+        security = zypper.summary.security_patches or 0
+        if security:
+            exit_code = ZypperSecurityPatchesAvailable.ExitCode
+        elif status.needed:
+            exit_code = ZypperPatchesAvailable.ExitCode
+        else:
+            exit_code = 0
+        return {
+            'exit_code': exit_code,
+            'patches': zypper.summary.patches or 0,
+            'security_patches': security,
+            'urgent_patches': urgent,
+            'categories': status.needed,
+        }
+
+    def patch(self):
+        from .main import run_checked
+        status = RunStatus(mode="patch")
+        args = argparse.Namespace(prefetch=False, check=False)
+        exit_code = run_checked(args, zypper=self.get_zypper(),
+                                status=status)
+        self.last_run = status
+        return {
+            'exit_code': exit_code,
+            'installed': list(status.installed_patches),
+            'outstanding': status.outstanding_patches(),
+            'reboot_required': status.reboot_required,
+        }
+
+    def status(self):
+        result = {
+            'pid': os.getpid(),
+            'uptime': time() - self.started,
+            'requests': self.requests,
+            'zypper_version': (self.zypper.version_string
+                               if self.zypper else None),
+            'last_run': None,
+        }
+        if self.last_run:
+            result['last_run'] = {
+                'start': self.last_run.start_time,
+                'duration': self.last_run.duration,
+                'exit_code': self.last_run.exit_code,
+                'reboot_required': self.last_run.reboot_required,
+            }
+        return result
+
+    def handle_command(self, command):
+        try:
+            func = self.commands[command]
+        except KeyError:
+            return { 'error': "unknown command '%s'" % command }
+        self.requests += 1
+        start = monotonic()
+        try:
+            result = func()
+        except ZypperExitException as err:
+            log.error(err)
+            return { 'exit_code': err.ExitCode, 'error': str(err) }
+        except Exception as err:
+            log.critical("Internal error %s: %s", type(err).__name__, err,
+                         exc_info=err)
+            return { 'error': "%s: %s" % (type(err).__name__, err) }
+        log.debug("command %s done in %.3f seconds",
+                  command, monotonic() - start)
+        return result
+
+    def handle(self, conn):
+        conn.settimeout(client_timeout)
+        with conn.makefile("rwb") as f:
+            for line in f:
+                command = line.decode("utf-8", errors="replace").strip()
+                if not command:
+                    continue
+                self.busy = True
+                try:
+                    result = self.handle_command(command)
+                finally:
+                    self.busy = False
+                f.write(json.dumps(result).encode("utf-8") + b"\n")
+                f.flush()
+                if self.stopping:
+                    break
+
+    def _terminate(self, signum, frame):
+        self.stopping = True
+        if not self.busy:
+            raise _Stop()
+
+    def serve(self):
+        """Serve until idle or terminated, return the exit status.
+        """
+        sock, activated = get_listen_socket(self.path)
+        signal.signal(signal.SIGTERM, self._terminate)
+        if self.idle_timeout > 0:
+            sock.settimeout(self.idle_timeout)
+        log.info("serving commands on %s",
+                 "the socket passed by systemd" if activated else self.path)
+        try:
+            while not self.stopping:
+                try:
+                    conn, _ = sock.accept()
+                except socket.timeout:
+                    log.info("idle for %.0f seconds, exiting",
+                             self.idle_timeout)
+                    break
+                with conn:
+                    try:
+                        self.handle(conn)
+                    except OSError as err:
+                        log.warning("lost connection to client: %s", err)
+                    except _Stop:
+                        raise
+                    except Exception as err:
+                        log.error("failed to serve client: %s", err)
+        except _Stop:
+            log.info("terminated, exiting")
+        finally:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            sock.close()
+            if not activated:
+                try:
+                    os.unlink(self.path)
+                except FileNotFoundError:
+                    pass
+        return 0
@@ -0,0 +1,298 @@
+"""Collect the results from many hosts into one digest mail.
+
+Rather than sending one mail report per host, auto-patch may send
+the result of its run to a collector.  The collector groups the hosts
+having the same patches installed and outstanding and sends a digest
+once per interval.
+
+The protocol is simple: the client connects to the collector, sends
+the result as a JSON object on one line, and waits for the collector
+to acknowledge it with a line "ok".
+"""
+
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import threading
+
+from .config import config, get_hostname
+from .log import log_timing
+from .parser import Patch, format_patches
+
+
+log = logging.getLogger(__name__)
+
+# Maximum size of a result in bytes accepted by the collector.
+max_result_size = 1048576
+
+
+def parse_address(address):
+    """Parse the address of the collector.
+
+    The address is either unix:PATH for a Unix socket or HOST:PORT
+    for a TCP socket.  Return a tuple of the address family and the
+    address suitable for the socket module.
+    """
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[5:]
+    if address.startswith("/"):
+        return socket.AF_UNIX, address
+    host, sep, port = address.rpartition(":")
+    if not sep or not port.isdigit():
+        raise ValueError("invalid collector address '%s'" % address)
+    return socket.AF_INET6 if ":" in host else socket.AF_INET, \
+        (host.strip("[]"), int(port))
+
+
+def patch_dict(p):
+    return { 'name': p.name, 'category': p.category,
+             'severity': p.severity, 'summary': p.summary }
+
+def run_result(status, exit_code, summary):
+    """Return the result of a run to be sent to the collector.
+    """
+    return {
+        'hostname': get_hostname(),
+        'mode': status.mode,
+        'start': status.start_time,
+        'exit_code': exit_code,
+        'reboot_required': status.reboot_required,
+        'installed': [ patch_dict(status.patches.get(n) or Patch(n))
+                       for n in status.installed_patches ],
+        'outstanding': [ patch_dict(status.patches[n])
+                         for n in status.outstanding_patches() ],
+        'summary': summary,
+    }
+
+def send_result(address, result, timeout=10):
+    """Send a result to the collector at address.
+
+    Raise OSError if the collector is not reachable or does not
+    acknowledge the result.
+    """
+    family, addr = parse_address(address)
+    data = json.dumps(result).encode("utf-8") + b"\n"
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(addr)
+        sock.sendall(data)
+        sock.shutdown(socket.SHUT_WR)
+        with sock.makefile("rb") as f:
+            reply = f.readline().strip()
+    if reply != b"ok":
+        raise OSError("result not accepted by the collector: %r" % reply)
+
+
+class DigestCollector:
+    """Accumulate results from many hosts and format them as digest.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.results = []
+
+    def add(self, result):
+        with self._lock:
+            self.results.append(result)
+
+    def take(self):
+        """Return the results collected so far and forget them.
+        """
+        with self._lock:
+            results = self.results
+            self.results = []
+        return results
+
+    def restore(self, results):
+        """Put back results that could not be sent.
+        """
+        with self._lock:
+            self.results[:0] = results
+
+    @staticmethod
+    def group(results):
+        """Group the results by identical sets of patches.
+
+        Return a list of pairs of the list of results and the key,
+        being the names of the installed and the outstanding patches.
+        """
+        groups = {}
+        for r in results:
+            key = (tuple(sorted(p['name'] for p in r['installed'])),
+                   tuple(sorted(p['name'] for p in r['outstanding'])))
+            groups.setdefault(key, []).append(r)
+        return sorted(((g, k) for k, g in groups.items()),
+                      key=lambda t: (-len(t[0]), t[1]))
+
+    @classmethod
+    def format(cls, results):
+        """Format the digest of results.
+        """
+        hosts = sorted({ r['hostname'] for r in results })
+        sections = [ "Results of auto-patch from %d hosts.\n" % len(hosts) ]
+        failed = [ r for r in results if r['exit_code'] ]
+        if failed:
+            lines = [ "Failed runs:\n" ]
+            for r in sorted(failed, key=lambda r: r['hostname']):
+                lines.append("%s: exit code %d\n" % (r['hostname'],
+                                                     r['exit_code']))
+                lines.extend("  %s\n" % l
+                             for l in r['summary'].splitlines())
+            sections.append("".join(lines))
+        for idx, (group, key) in enumerate(cls.group(results), start=1):
+            names = []
+            for r in sorted(group, key=lambda r: r['hostname']):
+                if r['reboot_required']:
+                    names.append("%s (reboot required)" % r['hostname'])
+                else:
+                    names.append(r['hostname'])
+            lines = [ "Group %d, %d hosts:\n  %s\n"
+                      % (idx, len(group), "\n  ".join(names)) ]
+            for title, attr in (("Installed patches", 'installed'),
+                                ("Patches outstanding", 'outstanding')):
+                patches = [ Patch(p['name'], category=p.get('category'),
+                                  severity=p.get('severity'),
+                                  summary=p.get('summary'))
+                            for p in group[0][attr] ]
+                if patches:
+                    lines.append("\n%s:\n\n%s" % (title,
+                                                  format_patches(patches)))
+            sections.append("".join(lines))
+        return "\n".join(sections)
+
+
+class SMTPPool:
+    """Keep a connection to the mail host to be reused for several
+    messages.  A connection that has been dropped by the mail host is
+    reopened once.
+    """
+
+    def __init__(self, connect):
+        self.connect = connect
+        self.smtp = None
+
+    def send_message(self, msg):
+        import smtplib
+        for attempt in (1, 2):
+            if self.smtp is None:
+                self.smtp = self.connect()
+            try:
+                self.smtp.send_message(msg)
+                return
+            except smtplib.SMTPServerDisconnected:
+                self.smtp = None
+                if attempt == 2:
+                    raise
+
+    def close(self):
+        import smtplib
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except (OSError, smtplib.SMTPException):
+                pass
+            self.smtp = None
+
+
+class _ResultHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline(max_result_size)
+        try:
+            result = json.loads(line.decode("utf-8"))
+            if not isinstance(result, dict) or 'hostname' not in result:
+                raise ValueError("not a result")
+        except ValueError as err:
+            log.warning("invalid result received: %s", err)
+            self.wfile.write(b"error\n")
+            return
+        self.server.collector.add(result)
+        self.wfile.write(b"ok\n")
+
+class _UnixServer(socketserver.ThreadingMixIn,
+                  socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def make_server(address, collector, handler=_ResultHandler):
+    """Create a server listening at address, feeding collector.
+
+    The requests are handled by handler, a StreamRequestHandler.
+    """
+    family, addr = parse_address(address)
+    if family == socket.AF_UNIX:
+        try:
+            os.unlink(addr)
+        except FileNotFoundError:
+            pass
+        os.makedirs(os.path.dirname(addr) or ".", exist_ok=True)
+        server = _UnixServer(addr, handler)
+    else:
+        server_cls = _TCPServer
+        if family == socket.AF_INET6:
+            server_cls = type("_TCP6Server", (_TCPServer,),
+                              { 'address_family': socket.AF_INET6 })
+        server = server_cls(addr, handler)
+    server.collector = collector
+    return server
+
+def make_digest(results):
+    """Return the digest mail for results.
+    """
+    from email.message import EmailMessage
+    cfg = config['mailreport']
+    hosts = { r['hostname'] for r in results }
+    msg = EmailMessage()
+    msg.set_content(DigestCollector.format(results))
+    msg['From'] = cfg.get('mailfrom')
+    msg['To'] = cfg.get('mailto')
+    msg['Subject'] = "%s: digest of %d hosts" % (cfg.get('subject'),
+                                                 len(hosts))
+    return msg
+
+def send_digest(collector, pool):
+    """Send a digest of the results collected so far, if any.
+    """
+    import smtplib
+    results = collector.take()
+    if not results:
+        return
+    try:
+        with log_timing("digest", results=len(results)):
+            pool.send_message(make_digest(results))
+    except (OSError, smtplib.SMTPException) as err:
+        log.error("cannot send the digest, will try again: %s", err)
+        pool.close()
+        collector.restore(results)
+
+def run_collector():
+    """Run the collector until terminated.
+    """
+    import smtplib
+    cfg = config['digest']
+    interval = cfg.getfloat('interval')
+    mailhost = config['mailreport'].get('mailhost')
+    collector = DigestCollector()
+    pool = SMTPPool(lambda: smtplib.SMTP(mailhost, timeout=60))
+    server = make_server(cfg.get('listen'), collector)
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    log.info("collecting results at %s", cfg.get('listen'))
+    try:
+        while not stop.wait(interval):
+            send_digest(collector, pool)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        send_digest(collector, pool)
+        pool.close()
@@ -0,0 +1,137 @@
+"""Exceptions representing exit codes from zypper.
+"""
+
+from subprocess import CalledProcessError
+
+
+class ZypperExitException(CalledProcessError):
+    """Represent a particular non-zero exit code from zypper.
+    """
+    ExitCode = 0
+    Message = None
+    _SubClasses = dict()
+
+    @classmethod
+    def check_returncode(cls, proc):
+        """Raise the appropriate exception if the exit code is non-zero."""
+        if proc.returncode:
+            try:
+                ExcClass = cls._SubClasses[proc.returncode]
+            except KeyError:
+                raise CalledProcessError(proc.returncode, proc.args,
+                                         proc.stdout, proc.stderr) from None
+            raise ExcClass(proc.args, proc.stdout, proc.stderr)
+
+    @classmethod
+    def register_exit_code(cls, subcls):
+        """A class decorator to register the exit code for a subclass.
+        """
+        assert issubclass(subcls, cls)
+        assert subcls.ExitCode and subcls.ExitCode not in cls._SubClasses
+        cls._SubClasses[subcls.ExitCode] = subcls
+        return subcls
+
+    def __init__(self, cmd, stdout=None, stderr=None):
+        if not self.ExitCode:
+            # This is an abstract class that may not be instantiated.
+            # Derived classes must override the class variable
+            # ExitCode.
+            raise NotImplementedError
+        super().__init__(self.ExitCode, cmd, stdout, stderr)
+
+    def __str__(self):
+        if not self.Message:
+            # This is an abstract class.  Derived classes must
+            # override the class variable Message.
+            raise NotImplementedError
+        return self.Message
+
+@ZypperExitException.register_exit_code
+class ZypperBugError(ZypperExitException):
+    ExitCode = 1
+    Message = "Unexpected situation, probably a bug in zypper"
+
+@ZypperExitException.register_exit_code
+class ZypperSyntaxError(ZypperExitException):
+    ExitCode = 2
+    Message = "Syntax error in the zypper call"
+
+@ZypperExitException.register_exit_code
+class ZypperInvalidArgsError(ZypperExitException):
+    ExitCode = 3
+    Message = "Invalid arguments in the zypper call"
+
+@ZypperExitException.register_exit_code
+class ZypperLibraryError(ZypperExitException):
+    ExitCode = 4
+    Message = "Problem reported by ZYPP library"
+
+@ZypperExitException.register_exit_code
+class ZypperPrivilegesError(ZypperExitException):
+    ExitCode = 5
+    Message = "Insufficient privileges calling zypper"
+
+@ZypperExitException.register_exit_code
+class ZypperNoReposError(ZypperExitException):
+    ExitCode = 6
+    Message = "No repositories defined in zypper"
+
+@ZypperExitException.register_exit_code
+class ZypperLockedError(ZypperExitException):
+    ExitCode = 7
+    Message = "ZYPP library is locked"
+
+@ZypperExitException.register_exit_code
+class ZypperCommitError(ZypperExitException):
+    ExitCode = 8
+    Message = "Error during installation or removal of packages"
+
+@ZypperExitException.register_exit_code
+class ZypperPatchesAvailable(ZypperExitException):
+    ExitCode = 100
+    Message = "Patches available for installation"
+
+@ZypperExitException.register_exit_code
+class ZypperSecurityPatchesAvailable(ZypperExitException):
+    ExitCode = 101
+    Message = "Security patches available for installation"
+
+@ZypperExitException.register_exit_code
+class ZypperRebootNeeded(ZypperExitException):
+    ExitCode = 102
+    Message = "Installation of a patch requires reboot"
+
+@ZypperExitException.register_exit_code
+class ZypperRestartNeeded(ZypperExitException):
+    ExitCode = 103
+    Message = "Installation of a patch requires restart of package manager"
+
+@ZypperExitException.register_exit_code
+class ZypperCapabilityNotFound(ZypperExitException):
+    ExitCode = 104
+    Message = ("Arguments does not match available or installed "
+               "package names or capabilities")
+
+@ZypperExitException.register_exit_code
+class ZypperSignal(ZypperExitException):
+    ExitCode = 105
+    Message = "Exit of zypper after receiving a SIGINT or SIGTERM"
+
+@ZypperExitException.register_exit_code
+class ZypperReposSkipped(ZypperExitException):
+    ExitCode = 106
+    Message = "Some repo temporarily disabled because of failure to refresh"
+
+@ZypperExitException.register_exit_code
+class ZypperRPMScriptfailed(ZypperExitException):
+    ExitCode = 107
+    Message = "Some packages install script returned an error"
+
+
+class ZypperReposFailed(ZypperReposSkipped):
+    """Some repositories still failed to refresh after retrying.
+
+    This is not registered for the exit code, it is only raised by
+    auto-patch itself when giving up.
+    """
+    Message = "Some repos failed to refresh repeatedly"
@@ -0,0 +1,158 @@
+"""Keep a history of the runs in a SQLite database.
+"""
+
+import logging
+import os
+
+from .parser import Patch, format_patches
+
+
+log = logging.getLogger(__name__)
+
+
+class History:
+    """A SQLite database recording each run, the zypper calls made in
+    the run, and the patches seen and installed.
+
+    Each patch seen in a run is recorded with state installed if it
+    has been installed in that run or outstanding otherwise.  Errors
+    from the database are raised as History.Error.
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS run (
+            id INTEGER PRIMARY KEY,
+            start REAL NOT NULL,
+            duration REAL,
+            mode TEXT NOT NULL,
+            exit_code INTEGER,
+            reboot_required INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS run_start ON run (start);
+        CREATE TABLE IF NOT EXISTS zypper_call (
+            run_id INTEGER NOT NULL REFERENCES run (id),
+            start REAL NOT NULL,
+            command TEXT,
+            returncode INTEGER,
+            duration REAL
+        );
+        CREATE INDEX IF NOT EXISTS zypper_call_run ON zypper_call (run_id);
+        CREATE TABLE IF NOT EXISTS patch (
+            run_id INTEGER NOT NULL REFERENCES run (id),
+            name TEXT NOT NULL,
+            category TEXT,
+            severity TEXT,
+            summary TEXT,
+            state TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS patch_name ON patch (name);
+        CREATE INDEX IF NOT EXISTS patch_run ON patch (run_id);
+    """
+
+    def __init__(self, path):
+        import sqlite3
+        self.Error = sqlite3.Error
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60)
+        with self.conn:
+            self.conn.executescript(self.schema)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def record(self, status):
+        """Record a finished run from its RunStatus.
+        """
+        installed = set(status.installed_patches)
+        with self.conn:
+            cur = self.conn.execute(
+                "INSERT INTO run (start, duration, mode, exit_code, "
+                "reboot_required) VALUES (?, ?, ?, ?, ?)",
+                (status.start_time, status.duration, status.mode,
+                 status.exit_code, int(status.reboot_required)))
+            run_id = cur.lastrowid
+            self.conn.executemany(
+                "INSERT INTO zypper_call (run_id, start, command, "
+                "returncode, duration) VALUES (?, ?, ?, ?, ?)",
+                [ (run_id, c.start, c.command, c.returncode, c.duration)
+                  for c in status.zypper_calls ])
+            names = list(status.patches)
+            names.extend(n for n in status.installed_patches
+                         if n not in status.patches)
+            rows = []
+            for n in names:
+                p = status.patches.get(n)
+                state = "installed" if n in installed else "outstanding"
+                if p is not None:
+                    rows.append((run_id, n, p.category, p.severity,
+                                 p.summary, state))
+                else:
+                    rows.append((run_id, n, None, None, None, state))
+            self.conn.executemany(
+                "INSERT INTO patch (run_id, name, category, severity, "
+                "summary, state) VALUES (?, ?, ?, ?, ?, ?)", rows)
+        return run_id
+
+    def previous_outstanding(self, mode):
+        """Return the names of the patches outstanding after the last
+        successful run in mode.
+        """
+        cur = self.conn.execute(
+            "SELECT name FROM patch WHERE state = 'outstanding' "
+            "AND run_id = (SELECT id FROM run WHERE mode = ? "
+            "AND exit_code = 0 ORDER BY start DESC LIMIT 1)", (mode,))
+        return { r[0] for r in cur }
+
+    def patch_history(self, name):
+        """Return the start time, the mode, and the state of all runs
+        having seen the patch name.
+        """
+        cur = self.conn.execute(
+            "SELECT run.start, run.mode, patch.state FROM patch "
+            "JOIN run ON run.id = patch.run_id "
+            "WHERE patch.name = ? ORDER BY run.start", (name,))
+        return cur.fetchall()
+
+
+def open_history(path):
+    """Open the history database at path.  Return None on error.
+    """
+    import sqlite3
+    try:
+        return History(path)
+    except (OSError, sqlite3.Error) as err:
+        log.error("cannot open history database %s: %s", path, err)
+        return None
+
+def format_changes(status, previous):
+    """Format the patches of a run in comparison to the patches
+    outstanding after the previous run.
+
+    The patches are sorted into those installed, those that are new
+    since the previous run, and those that are still outstanding.
+    """
+    installed = [ status.patches.get(n) or Patch(n)
+                  for n in status.installed_patches ]
+    outstanding = status.outstanding_patches()
+    new = [ status.patches[n] for n in outstanding if n not in previous ]
+    old = [ status.patches[n] for n in outstanding if n in previous ]
+    sections = []
+    for title, patches in (("Installed patches", installed),
+                           ("New patches", new),
+                           ("Patches still outstanding", old)):
+        if patches:
+            sections.append("%s:\n\n%s" % (title, format_patches(patches)))
+    if not sections:
+        sections.append("No changes since the previous run.\n")
+    if status.reboot_required:
+        sections.append("A reboot is required.\n")
+    return "\n".join(sections)
@@ -0,0 +1,336 @@
+"""Spread the load of many hosts on the mirror.
+
+Two measures keep the hosts from all hitting the mirror at the same
+time.  With --splay, the start of the run is delayed by an offset
+within [splay] window that is computed from a hash of the hostname.
+The offsets of the hosts are thus spread evenly over the window, but
+each host starts at the same time each day.
+
+Furthermore, a host may have to take one of a limited number of
+download slots before calling zypper to download packages.  The
+packages are then downloaded with zypper patch --download-only before
+the installation, so that the slot is not held during the installation
+proper.  The slots are either taken from a lease directory on shared
+storage, [lease] directory, or from a lease service, [lease] service,
+run by auto-patch --lease-server on one host.  In the directory, a
+slot is a file created exclusively and removed on release.  Slots left
+behind by hosts that crashed expire after [lease] ttl seconds.  The
+lease service hands out a slot per connection and takes it back when
+the connection is closed, or after [lease] ttl seconds at the latest,
+so that a client that crashed or got cut off does not keep its slot.
+If no slot can be taken within [lease] wait seconds, the host goes on
+without a slot, so that patches do not get stuck.
+"""
+
+from contextlib import contextmanager
+import hashlib
+import logging
+import os
+from time import monotonic, time
+
+from .config import config, get_hostname
+from .watchdog import keepalive_sleep, watchdog
+
+
+log = logging.getLogger(__name__)
+
+# Seconds between two tries to take a slot from the lease directory.
+poll_interval = 5.0
+
+
+def splay_delay(hostname, window):
+    """Return the offset of hostname in seconds within window.
+    """
+    digest = hashlib.sha256(hostname.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64 * window
+
+def wait_splay():
+    """Delay the start of the run by the splay of this host.
+    """
+    delay = splay_delay(get_hostname(), config['splay'].getfloat('window'))
+    if delay > 0:
+        log.info("waiting %.0f seconds before starting", delay)
+        keepalive_sleep(delay)
+
+
+class DirectoryLease:
+    """Take one of slots download slots from a lease directory.
+    """
+
+    def __init__(self, directory, slots, ttl, owner):
+        self.directory = directory
+        self.slots = slots
+        self.ttl = ttl
+        self.owner = owner
+        self.path = None
+
+    def _expire(self, path):
+        """Remove the slot file path if it is stale.
+
+        The file is renamed first, so that only one of several hosts
+        seeing the same stale slot removes it.  The owner written in
+        the file renamed is then compared to the one of the stale
+        slot.  If another host removed the stale slot and a third one
+        took the slot in between, the file of the latter is put back.
+        """
+        def read_slot(path):
+            with open(path, "rt") as f:
+                return os.fstat(f.fileno()).st_mtime, f.read()
+        try:
+            mtime, owner = read_slot(path)
+        except FileNotFoundError:
+            return
+        if time() - mtime <= self.ttl:
+            return
+        tmp = "%s.%s.%d.expired" % (path, self.owner, os.getpid())
+        try:
+            os.rename(path, tmp)
+        except FileNotFoundError:
+            return
+        if read_slot(tmp) == (mtime, owner):
+            log.info("removing expired lease %s", path)
+        else:
+            try:
+                os.link(tmp, path)
+            except FileExistsError:
+                log.warning("cannot put back lease %s", path)
+        os.unlink(tmp)
+
+    def _try(self):
+        for slot in range(self.slots):
+            path = os.path.join(self.directory, "slot-%d" % slot)
+            self._expire(path)
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                             0o644)
+            except FileExistsError:
+                continue
+            with os.fdopen(fd, "wt") as f:
+                f.write("%s %d %d\n" % (self.owner, os.getpid(), time()))
+            self.path = path
+            return slot
+        return None
+
+    def acquire(self, wait):
+        """Take a slot, waiting at most wait seconds.  Return the
+        number of the slot or None if none could be taken.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        deadline = monotonic() + wait
+        while True:
+            slot = self._try()
+            if slot is not None:
+                return slot
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                return None
+            keepalive_sleep(min(poll_interval, remaining))
+
+    def release(self):
+        if self.path:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                log.warning("lease %s has been taken away", self.path)
+            self.path = None
+
+class ServiceLease:
+    """Take a download slot from the lease service at address.
+    """
+
+    def __init__(self, address, owner):
+        self.address = address
+        self.owner = owner
+        self.sock = None
+
+    def acquire(self, wait):
+        """Take a slot, waiting at most wait seconds.  Return the
+        number of the slot or None if none could be taken.
+        """
+        import socket
+        from .digest import parse_address
+        family, addr = parse_address(self.address)
+        deadline = monotonic() + wait
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(max(wait, 1.0))
+            sock.connect(addr)
+            sock.sendall(("acquire %s\n" % self.owner).encode("utf-8"))
+            reply = b""
+            while not reply.endswith(b"\n"):
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                sock.settimeout(min(remaining, watchdog.interval or
+                                    remaining))
+                try:
+                    data = sock.recv(64)
+                except socket.timeout:
+                    watchdog.keepalive()
+                    continue
+                if not data:
+                    raise OSError("lease service closed the connection")
+                reply += data
+            status, _, slot = reply.decode("ascii").strip().partition(" ")
+            if status != "ok":
+                sock.close()
+                return None
+        except BaseException:
+            sock.close()
+            raise
+        self.sock = sock
+        return int(slot)
+
+    def release(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+def get_lease():
+    """Return the lease configured in [lease] or None.
+    """
+    cfg = config['lease']
+    owner = get_hostname()
+    if cfg.get('service'):
+        return ServiceLease(cfg.get('service'), owner)
+    if cfg.get('directory'):
+        return DirectoryLease(cfg.get('directory'), cfg.getint('slots'),
+                              cfg.getfloat('ttl'), owner)
+    return None
+
+@contextmanager
+def download_lease():
+    """Hold a download slot, if configured, in the body of the with
+    statement.
+    """
+    lease = get_lease()
+    slot = None
+    if lease:
+        wait = config['lease'].getfloat('wait')
+        start = monotonic()
+        try:
+            slot = lease.acquire(wait)
+        except OSError as err:
+            log.warning("cannot take a download slot, "
+                        "going on without: %s", err)
+        else:
+            if slot is None:
+                log.warning("no download slot free within %.0f seconds, "
+                            "going on without", wait)
+            else:
+                log.info("took download slot %d after %.1f seconds",
+                         slot, monotonic() - start)
+    try:
+        yield slot
+    finally:
+        if slot is not None:
+            lease.release()
+
+
+class LeaseSlots:
+    """The download slots handed out by the lease service.
+    """
+
+    def __init__(self, slots):
+        import threading
+        self.free = list(range(slots))
+        self.cond = threading.Condition()
+
+    def acquire(self, aborted=None):
+        """Take a free slot, waiting until one is released.  Return the
+        number of the slot or None if the callable aborted returns True
+        while waiting.
+        """
+        with self.cond:
+            while not self.free:
+                if aborted is not None and aborted():
+                    return None
+                self.cond.wait(poll_interval)
+            return self.free.pop(0)
+
+    def release(self, slot):
+        with self.cond:
+            self.free.append(slot)
+            self.free.sort()
+            self.cond.notify()
+
+def make_lease_server(address, slots, ttl=None):
+    """Create a lease service listening at address with slots
+    download slots.  A slot is taken back after ttl seconds at the
+    latest.
+    """
+    import select
+    import socket
+    import socketserver
+    from .digest import make_server
+
+    class _LeaseHandler(socketserver.StreamRequestHandler):
+
+        def setup(self):
+            super().setup()
+            # Detect peers that went away without closing the
+            # connection.
+            try:
+                self.connection.setsockopt(socket.SOL_SOCKET,
+                                           socket.SO_KEEPALIVE, 1)
+            except OSError:
+                pass
+
+        def client_gone(self):
+            """Return True if the client closed the connection.
+            """
+            try:
+                ready, _, _ = select.select([self.connection], [], [], 0)
+                return bool(ready) and not self.connection.recv(
+                    1, socket.MSG_PEEK)
+            except OSError:
+                return True
+
+        def handle(self):
+            line = self.rfile.readline(1024).decode("utf-8", "replace")
+            cmd, _, owner = line.strip().partition(" ")
+            if cmd != "acquire":
+                self.wfile.write(b"error\n")
+                return
+            slot = self.server.slots.acquire(aborted=self.client_gone)
+            if slot is None:
+                log.debug("%s gave up waiting for a slot", owner)
+                return
+            try:
+                log.debug("slot %d taken by %s", slot, owner)
+                self.wfile.write(("ok %d\n" % slot).encode("ascii"))
+                # Hold the slot until the client closes the connection.
+                self.connection.settimeout(self.server.ttl)
+                while self.connection.recv(1024):
+                    pass
+            except socket.timeout:
+                log.warning("slot %d held by %s expired", slot, owner)
+            except OSError:
+                pass
+            finally:
+                log.debug("slot %d released by %s", slot, owner)
+                self.server.slots.release(slot)
+
+    server = make_server(address, None, handler=_LeaseHandler)
+    server.slots = LeaseSlots(slots)
+    server.ttl = ttl
+    return server
+
+def run_lease_server():
+    """Run the lease service until terminated.
+    """
+    import signal
+    cfg = config['lease']
+    server = make_lease_server(cfg.get('listen'), cfg.getint('slots'),
+                               cfg.getfloat('ttl'))
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+    log.info("handing out %d download slots at %s",
+             cfg.getint('slots'), cfg.get('listen'))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,82 @@
+"""Logging setup and helpers.
+"""
+
+from collections import deque
+from contextlib import contextmanager
+import logging
+import os
+import sys
+from time import monotonic
+
+
+def setup_logging(cfg):
+    import systemd.journal
+    root = logging.getLogger()
+    journal_level = cfg.get('journal_level')
+    journal_hdlr = systemd.journal.JournalHandler(level=journal_level)
+    root.addHandler(journal_hdlr)
+    if os.isatty(sys.stderr.fileno()):
+        stderr_hdlr = logging.StreamHandler()
+        stderr_hdlr.setLevel(cfg.get('stderr_level'))
+        fmt = "%(levelname)s: %(message)s"
+        stderr_hdlr.setFormatter(logging.Formatter(fmt=fmt))
+        root.addHandler(stderr_hdlr)
+    root.setLevel(logging.DEBUG)
+
+class MessageCollector(logging.Handler):
+    """Keep the last maxlen messages logged.
+    """
+
+    def __init__(self, level=logging.NOTSET, maxlen=100):
+        super().__init__(level)
+        self.messages = deque(maxlen=maxlen)
+
+    def emit(self, record):
+        self.messages.append(self.format(record))
+
+@contextmanager
+def logging_add_report(cfg, stream):
+    """Log messages to stream for the report.
+
+    Yields a list of the last messages that is kept separately for
+    the summary of the report.
+    """
+    root = logging.getLogger()
+    report_hdlr = logging.StreamHandler(stream=stream)
+    report_hdlr.setLevel(cfg.get('report_level'))
+    fmt = "\n%(levelname)s: %(message)s"
+    report_hdlr.setFormatter(logging.Formatter(fmt=fmt))
+    collector = MessageCollector(level=cfg.get('report_level'))
+    collector.setFormatter(logging.Formatter(fmt="%(levelname)s: %(message)s"))
+    root.addHandler(report_hdlr)
+    root.addHandler(collector)
+    try:
+        yield collector.messages
+    finally:
+        report_hdlr.flush()
+        root.removeHandler(collector)
+        root.removeHandler(report_hdlr)
+        report_hdlr.close()
+
+timing_log = logging.getLogger(__name__).getChild("timing")
+
+@contextmanager
+def log_timing(phase, **fields):
+    """Measure the duration of a phase and log it.
+
+    The duration and the fields, which may also be set in the body
+    of the with statement on the yielded dict, are passed to the
+    journal as structured fields AUTO_PATCH_PHASE,
+    AUTO_PATCH_DURATION_USEC, and AUTO_PATCH_<FIELD> respectively.
+    """
+    start = monotonic()
+    try:
+        yield fields
+    finally:
+        usec = int((monotonic() - start) * 1000000)
+        extra = { "AUTO_PATCH_%s" % k.upper(): v for k, v in fields.items() }
+        extra['AUTO_PATCH_PHASE'] = phase
+        extra['AUTO_PATCH_DURATION_USEC'] = usec
+        timing_log.info("%s took %.3f seconds", phase, usec / 1000000,
+                        extra=extra)
+
@@ -0,0 +1,251 @@
+"""The auto-patch command line program.
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+from .config import config, read_config
+from .exception import (ZypperExitException, ZypperPrivilegesError,
+                        ZypperNoReposError, ZypperLockedError,
+                        ZypperCommitError, ZypperReposSkipped,
+                        ZypperRPMScriptfailed, ZypperSignal)
+from .history import open_history, format_changes
+from .log import setup_logging, logging_add_report, log_timing
+from .report import make_report, deliver_mail
+from .status import RunStatus
+from .workflow import (patch, prefetch, check, read_check_state,
+                       write_check_state)
+
+
+log = logging.getLogger(__name__)
+
+description = "Call zypper to install security and other system updates."
+
+def run(args, zypper=None, status=None):
+    """Run auto-patch and return the exit code.
+
+    Errors from zypper that are not dealt with are raised.  In patch
+    mode, a Zypper object to use may be passed in zypper.  The outcome
+    is recorded in status if given.
+    """
+    if status is None:
+        status = RunStatus(mode=("prefetch" if args.prefetch else "patch"))
+    history = None
+    if config['history'].get('database'):
+        history = open_history(config['history'].get('database'))
+    exit_code = 0
+    try:
+        with log_timing("run", mode=status.mode), \
+             tempfile.TemporaryFile(mode='w+t') as tmpf:
+            with logging_add_report(config['logging'], tmpf) as messages:
+                try:
+                    if args.prefetch:
+                        prefetch(stdout=tmpf, status=status)
+                        have_patches = False
+                    else:
+                        have_patches = patch(stdout=tmpf, status=status,
+                                             zypper=zypper)
+                except (ZypperCommitError, ZypperRPMScriptfailed,
+                        ZypperSignal) as err:
+                    log.error(err)
+                    exit_code = err.ExitCode
+            if exit_code or have_patches:
+                changes = None
+                if (history and not exit_code and
+                    config['mailreport'].getboolean('changes_only')):
+                    try:
+                        previous = history.previous_outstanding(status.mode)
+                        changes = format_changes(status, previous)
+                    except history.Error as err:
+                        log.error("cannot read the history: %s", err)
+                make_report(tmpf, status, exit_code=exit_code,
+                            messages=messages, changes=changes)
+            return exit_code
+    except ZypperExitException as err:
+        exit_code = err.ExitCode
+        raise
+    except Exception:
+        exit_code = -1
+        raise
+    finally:
+        status.finish(exit_code)
+        metrics_dir = config['metrics'].get('directory')
+        if metrics_dir:
+            try:
+                status.write_metrics(metrics_dir)
+            except OSError as err:
+                log.error("cannot write metrics: %s", err)
+        if history:
+            try:
+                history.record(status)
+            except history.Error as err:
+                log.error("cannot record the run in the history: %s", err)
+            finally:
+                history.close()
+
+def run_checked(args, **kwargs):
+    """Run auto-patch, log errors, and return the exit code.
+
+    The keyword arguments are passed to run().
+    """
+    try:
+        if args.check:
+            return run_check()
+        return run(args, **kwargs)
+    except (ZypperPrivilegesError, ZypperNoReposError, ZypperLockedError,
+            ZypperReposSkipped) as err:
+        log.error(err)
+        return err.ExitCode
+    except ZypperExitException as err:
+        log.critical("Internal error %s: %s", type(err).__name__, err,
+                     exc_info=err)
+        return err.ExitCode
+    except Exception as err:
+        log.critical("Internal error %s: %s", type(err).__name__, err,
+                     exc_info=err)
+        return -1
+
+def run_check():
+    """Check for needed security and critical patches.
+
+    If their number has increased since the previous check, take the
+    action configured in [check]: do a full run to install the
+    patches, refresh the repositories and check again, or nothing.
+    Return the exit code.
+
+    The number of patches is only recorded after a full run triggered
+    has succeeded, so that a failed run is triggered again by the
+    next check.
+    """
+    status = RunStatus(mode="check")
+    exit_code = 0
+    action = None
+    try:
+        try:
+            urgent = check(status=status)
+        except ZypperLockedError as err:
+            log.info("skipping the check: %s", err)
+            return 0
+        previous = read_check_state()
+        log.info("%d security or critical patches needed, "
+                 "%s in the previous check",
+                 urgent, "unknown" if previous is None else previous)
+        if urgent > (previous or 0):
+            action = config['check'].get('action')
+        if action == "refresh":
+            urgent = check(status=status, refresh=True)
+        if action != "patch":
+            write_check_state(urgent)
+    except ZypperExitException as err:
+        exit_code = err.ExitCode
+        raise
+    finally:
+        status.finish(exit_code)
+        metrics_dir = config['metrics'].get('directory')
+        if metrics_dir:
+            try:
+                status.write_metrics(metrics_dir)
+            except OSError as err:
+                log.error("cannot write metrics: %s", err)
+    if action == "patch":
+        log.info("new security or critical patches needed, "
+                 "starting a full run")
+        exit_code = run(argparse.Namespace(prefetch=False, check=False))
+        if not exit_code:
+            write_check_state(urgent)
+    return exit_code
+
+def show_patch_history(name):
+    """Print the history of the patch name.
+    """
+    path = config['history'].get('database')
+    if not path:
+        log.error("the history is not enabled in the configuration")
+        return 1
+    history = open_history(path)
+    if not history:
+        return 1
+    with history:
+        for start, mode, state in history.patch_history(name):
+            print("%s  %-8s  %s" % (time.strftime("%Y-%m-%d %H:%M:%S",
+                                                  time.localtime(start)),
+                                    mode, state))
+    return 0
+
+def main(argv=None):
+    """Entry point of the auto-patch script, return the exit status.
+    """
+    argparser = argparse.ArgumentParser(description=description)
+    argparser.add_argument('--prefetch', action='store_true',
+                           help=("only download the needed patches into "
+                                 "the package cache, do not install them"))
+    argparser.add_argument('--check', action='store_true',
+                           help=("only check for needed security and "
+                                 "critical patches and act on changes"))
+    argparser.add_argument('--deliver-mail', action='store_true',
+                           help=("deliver the reports queued in the spool "
+                                 "and exit"))
+    argparser.add_argument('--splay', action='store_true',
+                           help=("wait for the offset of this host in the "
+                                 "splay window before starting"))
+    argparser.add_argument('--lease-server', action='store_true',
+                           help=("run the lease service handing out "
+                                 "download slots to other hosts"))
+    argparser.add_argument('--collect', action='store_true',
+                           help=("run the collector receiving the results "
+                                 "from other hosts and mailing a digest"))
+    argparser.add_argument('--daemon', action='store_true',
+                           help=("serve commands on a Unix socket until "
+                                 "idle for some time"))
+    argparser.add_argument('--root', metavar='PATH', action='append',
+                           help=("install the needed patches into the "
+                                 "system root PATH rather than into the "
+                                 "running system, may be given more "
+                                 "than once"))
+    argparser.add_argument('--roots', action='store_true',
+                           help=("install the needed patches into the "
+                                 "system roots configured"))
+    argparser.add_argument('--rollout', action='store_true',
+                           help=("run auto-patch on the hosts configured "
+                                 "in waves, stopping on failures"))
+    argparser.add_argument('--patch-history', metavar='NAME',
+                           help=("show the runs that have seen the patch "
+                                 "NAME from the history and exit"))
+    args = argparser.parse_args(argv)
+    os.environ['LANG'] = "POSIX"
+    os.environ['LC_CTYPE'] = "en_US.UTF-8"
+    read_config()
+    setup_logging(config['logging'])
+    if args.patch_history:
+        return show_patch_history(args.patch_history)
+    if args.deliver_mail:
+        deliver_mail()
+        return 0
+    if args.daemon:
+        from .daemon import Daemon
+        return Daemon().serve()
+    if args.collect:
+        from .digest import run_collector
+        run_collector()
+        return 0
+    if args.lease_server:
+        from .lease import run_lease_server
+        run_lease_server()
+        return 0
+    if args.splay:
+        from .lease import wait_splay
+        wait_splay()
+    if args.rollout:
+        from .rollout import run_rollout
+        return run_rollout()
+    if args.root or args.roots:
+        from .roots import get_roots, patch_roots
+        roots = get_roots(args.root)
+        if not roots:
+            log.error("no roots to patch")
+            return 1
+        return patch_roots(roots)
+    return run_checked(args)
@@ -0,0 +1,431 @@
+"""Parse the output of zypper.
+"""
+
+import logging
+import re
+
+
+log = logging.getLogger(__name__)
+
+size_units = { 'B': 1, 'KiB': 1 << 10, 'MiB': 1 << 20, 'GiB': 1 << 30,
+               'TiB': 1 << 40 }
+
+
+def parse_size(text):
+    """Return a size as printed by zypper, e.g. 2.2 MiB, in bytes or
+    None if it is not understood.
+    """
+    number, _, unit = text.strip().partition(" ")
+    try:
+        return int(float(number) * size_units[unit])
+    except (ValueError, KeyError):
+        return None
+
+
+class LineParser:
+    """Incrementally parse the output of zypper, one line at a time.
+
+    Derived classes must implement feed() that will be called for
+    each line of output.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forget everything seen so far."""
+        pass
+
+    def feed(self, line):
+        raise NotImplementedError
+
+class PatternParser(LineParser):
+    """Parse lines matching a regular expression.
+
+    Derived classes must override the class variable Pattern with a
+    regular expression and implement handle() that will be called
+    with the match object for each matching line.
+    """
+    Pattern = None
+
+    def __init__(self):
+        if not self.Pattern:
+            # This is an abstract class that may not be instantiated.
+            raise NotImplementedError
+        self._pattern = re.compile(self.Pattern)
+        super().__init__()
+
+    def feed(self, line):
+        m = self._pattern.match(line)
+        if m:
+            self.handle(m)
+
+    def handle(self, match):
+        raise NotImplementedError
+
+class PatchSummaryParser(PatternParser):
+    """Recognize the number of needed patches in the output of
+    patch-check or list-patches.
+    """
+    Pattern = r"^(\d+) patch(?:es)? needed \((\d+) security patch(?:es)?\)$"
+
+    def reset(self):
+        self.summary = None
+        self.patches = None
+        self.security_patches = None
+
+    def handle(self, match):
+        self.summary = match.group(0)
+        self.patches = int(match.group(1))
+        self.security_patches = int(match.group(2))
+
+class PatchCategoryParser(PatternParser):
+    """Recognize the table of needed patches per category in the
+    output of patch-check.
+    """
+    Pattern = r"^\s*([a-z]+)\s+\|(?:.*\|)?\s*(\d+)\s*$"
+
+    def reset(self):
+        self.categories = {}
+
+    def handle(self, match):
+        self.categories[match.group(1)] = int(match.group(2))
+
+class RebootHintParser(PatternParser):
+    """Recognize the hint that packages to be installed require a reboot.
+    """
+    Pattern = r"^The following (?:\d+ )?packages? requires? a system reboot:$"
+
+    def reset(self):
+        self.reboot_needed = False
+
+    def handle(self, match):
+        if not self.reboot_needed:
+            log.info("installed packages require a reboot")
+        self.reboot_needed = True
+
+class DownloadSizeParser(PatternParser):
+    """Recognize the download size and the amount already cached.
+    """
+    Pattern = (r"^Overall download size: (.+?)\. "
+               r"Already cached: (.+?)\. ")
+
+    def reset(self):
+        self.download_size = None
+        self.cached = None
+
+    @property
+    def all_cached(self):
+        return (self.download_size is not None and
+                self.cached == self.download_size)
+
+    @property
+    def to_download(self):
+        """The bytes left to download or None if not known.
+        """
+        if self.download_size is None:
+            return None
+        size = parse_size(self.download_size)
+        cached = parse_size(self.cached)
+        if size is None or cached is None:
+            return None
+        return max(size - cached, 0.0)
+
+    def handle(self, match):
+        self.download_size, self.cached = match.group(1, 2)
+        log.info("download size: %s, already cached: %s",
+                 self.download_size, self.cached)
+
+class PackageCountParser(PatternParser):
+    """Recognize the number of packages going to be upgraded or newly
+    installed.
+    """
+    Pattern = (r"^(\d+) (?:new )?packages? to (?:upgrade|install)"
+               r"(?:, (\d+) new)?")
+
+    def reset(self):
+        self.packages = None
+
+    def handle(self, match):
+        self.packages = int(match.group(1)) + int(match.group(2) or 0)
+
+class SkippedRepoParser(PatternParser):
+    """Recognize the repositories skipped because they failed to
+    refresh.
+    """
+    Pattern = (r"^(?:Warning: )?Skipping repository '(.+)' "
+               r"because of the above error\.$")
+
+    def reset(self):
+        self.repos = []
+
+    def handle(self, match):
+        if match.group(1) not in self.repos:
+            self.repos.append(match.group(1))
+
+class InstallSummaryParser(PatternParser):
+    """Recognize the number and the names of patches going to be
+    installed and whether needed patches have been skipped.
+    """
+    Pattern = (r"^(?:The following (?:(\d+) )?NEW patch(?:es)? "
+               r"(?:is|are) going to be installed:"
+               r"|(Skipped needed patches))")
+
+    def reset(self):
+        self.installed = None
+        self.names = []
+        self.skipped = False
+        self._in_list = False
+
+    def feed(self, line):
+        if self._in_list:
+            if line.strip():
+                self.names.extend(line.split())
+                return
+            self._in_list = False
+        super().feed(line)
+
+    def handle(self, match):
+        if match.group(2):
+            self.skipped = True
+        else:
+            self.installed = int(match.group(1) or 1)
+            self._in_list = True
+
+class PatchTableParser(LineParser):
+    """Parse the table of patches in the output of list-patches into
+    Patch objects.
+
+    The columns are identified by the table header, so that the
+    parser copes with the columns that differ between versions of
+    zypper.  Only patches having status needed are taken.
+    """
+
+    def reset(self):
+        self.items = []
+        self._columns = None
+
+    def feed(self, line):
+        if "|" not in line:
+            # Either the separator line below the header or the end
+            # of the table.
+            if not line.strip():
+                self._columns = None
+            return
+        if self._columns is None:
+            cells = [ c.strip() for c in line.split("|") ]
+            if "Name" in cells and "Category" in cells:
+                self._columns = cells
+            return
+        cells = line.split("|", len(self._columns) - 1)
+        row = dict(zip(self._columns, (c.strip() for c in cells)))
+        if not row.get('Name') or row.get('Status', "needed") != "needed":
+            return
+        flag = row.get('Interactive')
+        self.items.append(Patch(row['Name'], category=row.get('Category'),
+                                severity=row.get('Severity'),
+                                interactive=(flag == "interactive"),
+                                restart=(flag == "restart"),
+                                reboot=(flag == "reboot"),
+                                summary=row.get('Summary')))
+
+class ProcessTableParser(LineParser):
+    """Parse the table of processes using deleted files in the output
+    of ps into Process objects.
+
+    The columns are identified by the table header, so that the
+    parser copes with the short table from ps -s as well as with the
+    full one.  In the latter, the files are listed in rows of their
+    own following the process.
+    """
+
+    def reset(self):
+        self.items = []
+        self._columns = None
+
+    def feed(self, line):
+        if "|" not in line:
+            if not line.strip():
+                self._columns = None
+            return
+        if self._columns is None:
+            cells = [ c.strip() for c in line.split("|") ]
+            if "PID" in cells and "Command" in cells:
+                self._columns = cells
+            return
+        cells = line.split("|", len(self._columns) - 1)
+        row = dict(zip(self._columns, (c.strip() for c in cells)))
+        if not row.get('PID'):
+            if self.items and row.get('Files'):
+                self.items[-1].files.append(row['Files'])
+            return
+        try:
+            pid = int(row['PID'])
+        except ValueError:
+            return
+        files = [row['Files']] if row.get('Files') else []
+        self.items.append(Process(pid, command=row.get('Command'),
+                                  user=row.get('User'),
+                                  service=row.get('Service') or None,
+                                  files=files))
+
+class ErrorParser(PatternParser):
+    """Recognize error and problem messages from zypper.
+    """
+    Pattern = r"^(?:Error|Problem): (.*)$"
+
+    def reset(self):
+        self.messages = []
+
+    def handle(self, match):
+        log.info("zypper: %s", match.group(0))
+        self.messages.append(match.group(1))
+
+
+class Patch:
+    """A patch as listed by zypper.
+    """
+    __slots__ = ('name', 'category', 'severity', 'interactive',
+                 'restart', 'reboot', 'summary', 'packages')
+
+    def __init__(self, name, category=None, severity=None,
+                 interactive=False, restart=False, reboot=False,
+                 summary=None, packages=()):
+        self.name = name
+        self.category = category
+        self.severity = severity
+        self.interactive = interactive
+        self.restart = restart
+        self.reboot = reboot
+        self.summary = summary
+        self.packages = tuple(packages)
+
+    @classmethod
+    def from_element(cls, elem):
+        """Create a Patch from an update element in the XML output
+        of zypper.
+        """
+        def flag(attr):
+            return elem.get(attr) == "true"
+        summary = elem.findtext('summary')
+        if summary is not None:
+            summary = summary.strip()
+        packages = [ p.get('name') for p in elem.iter('package') ]
+        return cls(elem.get('name'), category=elem.get('category'),
+                   severity=elem.get('severity'),
+                   interactive=flag('interactive'),
+                   restart=flag('pkgmanager'), reboot=flag('restart'),
+                   summary=summary, packages=packages)
+
+    def __repr__(self):
+        return "<%s %s (%s)>" % (type(self).__name__,
+                                 self.name, self.category)
+
+class Process:
+    """A process using deleted files as listed by zypper ps.
+    """
+    __slots__ = ('pid', 'command', 'user', 'service', 'files')
+
+    def __init__(self, pid, command=None, user=None, service=None,
+                 files=()):
+        self.pid = pid
+        self.command = command
+        self.user = user
+        self.service = service
+        self.files = list(files)
+
+    def __repr__(self):
+        return "<%s %d (%s)>" % (type(self).__name__,
+                                 self.pid, self.command)
+
+class Repository:
+    """A repository as listed by zypper.
+    """
+    __slots__ = ('alias', 'name', 'enabled', 'autorefresh')
+
+    def __init__(self, alias, name=None, enabled=True, autorefresh=True):
+        self.alias = alias
+        self.name = name
+        self.enabled = enabled
+        self.autorefresh = autorefresh
+
+    @classmethod
+    def from_element(cls, elem):
+        """Create a Repository from a repo element in the XML output
+        of zypper.
+        """
+        return cls(elem.get('alias'), name=elem.get('name'),
+                   enabled=(elem.get('enabled') == "1"),
+                   autorefresh=(elem.get('autorefresh') == "1"))
+
+    def __repr__(self):
+        return "<%s %s>" % (type(self).__name__, self.alias)
+
+class XmlParser(LineParser):
+    """Parse the XML output of zypper into a list of items.
+
+    The output is parsed incrementally.  Derived classes must override
+    the class variable Tag and implement convert() that is called
+    with each complete element having that tag and may return an item
+    or None.  Elements are discarded as soon as they have been
+    converted, so memory usage does not grow with the size of the
+    output beyond the items themselves.
+    """
+    Tag = None
+
+    def reset(self):
+        from xml.etree.ElementTree import XMLPullParser
+        self.items = []
+        self._parser = XMLPullParser(events=('start', 'end'))
+        self._stack = []
+
+    def feed(self, line):
+        self._parser.feed(line)
+        for event, elem in self._parser.read_events():
+            if event == 'start':
+                self._stack.append(elem)
+                continue
+            self._stack.pop()
+            if elem.tag == self.Tag:
+                item = self.convert(elem)
+                if item is not None:
+                    self.items.append(item)
+                if self._stack:
+                    del self._stack[-1][:]
+
+    def convert(self, elem):
+        raise NotImplementedError
+
+class XmlPatchParser(XmlParser):
+    """Parse the XML output of zypper list-patches into Patch objects.
+    """
+    Tag = 'update'
+
+    def convert(self, elem):
+        if elem.get('kind') == 'patch':
+            return Patch.from_element(elem)
+
+class XmlRepoParser(XmlParser):
+    """Parse the XML output of zypper repos into Repository objects.
+    """
+    Tag = 'repo'
+
+    def convert(self, elem):
+        return Repository.from_element(elem)
+
+def format_patches(patches):
+    """Format a list of Patch objects as a table.
+    """
+    header = ("Name", "Category", "Severity", "Interactive", "Summary")
+    rows = [ (p.name, p.category or "", p.severity or "",
+              "yes" if p.interactive else "---", p.summary or "")
+             for p in patches ]
+    widths = [ max(len(r[i]) for r in [header] + rows)
+               for i in range(len(header)) ]
+    def fmt(row):
+        cols = [ c.ljust(w) for c, w in zip(row, widths) ]
+        return " | ".join(cols).rstrip() + "\n"
+    lines = [ fmt(header), "-+-".join("-" * w for w in widths) + "\n" ]
+    lines.extend(fmt(r) for r in rows)
+    return "".join(lines)
+
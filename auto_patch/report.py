@@ -0,0 +1,253 @@
+"""Build and send the mail report.
+
+The full output collected during the run may be large.  It is never
+read into memory as a whole, but streamed into a compressed
+attachment of bounded size and into the journal in bounded chunks.
+The body of the mail only contains a short summary.
+"""
+
+import gzip
+import logging
+import tempfile
+
+from .config import config
+from .log import log_timing
+from .spool import get_spool
+
+
+log = logging.getLogger(__name__)
+
+# Exit codes from zypper that do not indicate a failure of the call.
+ok_exit_codes = {0, 100, 101, 102, 103}
+
+# Maximum number of characters to log to the journal in one message.
+journal_chunk_size = 32768
+
+attachment_name = "auto-patch.log.gz"
+
+
+def failed_calls(status):
+    """Return the records of the failed zypper calls.
+    """
+    return [ c for c in status.zypper_calls
+             if c.returncode not in ok_exit_codes | {None} ]
+
+def format_summary(status, exit_code=0, messages=(), changes=None):
+    """Format the summary for the body of the report.
+
+    If changes is set, it replaces the counts of the patches.
+    """
+    sections = []
+    if changes is not None:
+        sections.append(changes)
+    else:
+        lines = []
+        needed = status.needed or {}
+        if needed:
+            counts = ", ".join("%s: %d" % (c, n)
+                               for c, n in sorted(needed.items()))
+            lines.append("Patches needed: %d (%s)"
+                         % (sum(needed.values()), counts))
+            lines.append("Patches installed: %d"
+                         % sum(status.installed().values()))
+            lines.append("Patches still outstanding: %d"
+                         % sum(status.outstanding.values()))
+        if status.reboot_required:
+            lines.append("A reboot is required.")
+        if lines:
+            sections.append("\n".join(lines) + "\n")
+    if status.restarts:
+        lines = [ "Services restarted:" ]
+        for service, err in status.restarts:
+            lines.append("  %s: %s" % (service, ("failed, %s" % err)
+                                       if err else "ok"))
+        sections.append("\n".join(lines) + "\n")
+    if status.processes:
+        lines = [ "Processes still using deleted files: %d"
+                  % len(status.processes) ]
+        services = sorted({ p.service for p in status.processes
+                            if p.service })
+        if services:
+            lines.append("Their services: %s" % ", ".join(services))
+        sections.append("\n".join(lines) + "\n")
+    if len(status.passes) > 1:
+        lines = [ "Passes:" ]
+        for idx, (name, installed, err) in enumerate(status.passes, 1):
+            if err:
+                result = "failed: %s" % err
+            else:
+                result = "%d patches installed" % installed
+            lines.append("  %d. %s: %s" % (idx, name, result))
+        sections.append("\n".join(lines) + "\n")
+    if status.skipped_repos:
+        lines = [ "Repositories failing to refresh, patches from these "
+                  "may be missing:" ]
+        lines.extend("  " + r for r in status.skipped_repos)
+        sections.append("\n".join(lines) + "\n")
+    if status.deferred:
+        lines = [ "Deferred to the next run, not fitting into the "
+                  "maintenance window:" ]
+        lines.extend("  " + r for r in status.deferred)
+        sections.append("\n".join(lines) + "\n")
+    if exit_code:
+        sections.append("auto-patch failed with exit code %d.\n" % exit_code)
+    if messages:
+        sections.append("Messages:\n\n" + "\n".join(messages) + "\n")
+    for call in failed_calls(status):
+        lines = [ "zypper %s failed with exit code %d, last lines of output:\n"
+                  % (call.command, call.returncode) ]
+        lines.extend("  " + l.rstrip("\n") for l in call.tail or ())
+        sections.append("\n".join(lines) + "\n")
+    calls = status.zypper_calls
+    sections.append("zypper has been called %d times, taking %.1f seconds.\n"
+                    % (len(calls), sum(c.duration or 0.0 for c in calls)))
+    return "\n".join(sections)
+
+def stream_log(logfile, gzfile=None, max_size=0):
+    """Stream the log collected in logfile.
+
+    The log is written to the journal at level DEBUG in chunks of at
+    most journal_chunk_size characters.  If gzfile is given, the log
+    is also written to that gzip.GzipFile until the compressed size
+    exceeds max_size.  Return True if the log has been truncated.
+    """
+    debug = log.isEnabledFor(logging.DEBUG)
+    truncated = False
+    chunk = []
+    chunk_len = 0
+    part = 0
+    def flush_chunk():
+        log.debug("report, part %d:\n%s", part, "".join(chunk))
+    logfile.seek(0)
+    for line in logfile:
+        if gzfile and not truncated:
+            if gzfile.fileobj.tell() < max_size:
+                gzfile.write(line.encode("utf-8", errors="replace"))
+            else:
+                gzfile.write(b"\n[truncated]\n")
+                truncated = True
+        if debug:
+            if chunk_len + len(line) > journal_chunk_size and chunk:
+                part += 1
+                flush_chunk()
+                chunk = []
+                chunk_len = 0
+            chunk.append(line[:journal_chunk_size])
+            chunk_len += len(chunk[-1])
+    if debug and chunk:
+        part += 1
+        flush_chunk()
+    return truncated
+
+def make_report(logfile, status, exit_code=0, messages=(), changes=None):
+    """Send the mail report.
+
+    The body contains a summary of the run from status, the messages
+    logged, and the last lines of output of failed zypper calls.  The
+    full output collected in logfile is attached compressed, unless
+    the [mailreport] max_size is zero.  If a collector is configured
+    in [digest], the result is sent there instead to be included in a
+    digest.  The report is only mailed if the collector is not
+    reachable.
+    """
+    cfg = config['mailreport']
+    body = format_summary(status, exit_code=exit_code, messages=messages,
+                          changes=changes)
+    collector = config['digest'].get('collector')
+    if collector and cfg.getboolean('report'):
+        from .digest import run_result, send_result
+        timeout = config['digest'].getfloat('timeout')
+        try:
+            with log_timing("collector"):
+                send_result(collector, run_result(status, exit_code, body),
+                            timeout=timeout)
+        except OSError as err:
+            log.warning("cannot send the result to the collector, "
+                        "mailing the report instead: %s", err)
+        else:
+            stream_log(logfile)
+            log.debug("report summary:\n%s", body)
+            return
+    max_size = cfg.getint('max_size')
+    if not cfg.getboolean('report') or max_size <= 0:
+        stream_log(logfile)
+        data = None
+    else:
+        data, truncated = compress_log(logfile, max_size)
+        if truncated:
+            body += ("\nThe full log is attached as %s, truncated to "
+                     "about %d bytes.\n" % (attachment_name, max_size))
+        else:
+            body += ("\nThe full log is attached as %s.\n"
+                     % attachment_name)
+    log.debug("report summary:\n%s", body)
+    if cfg.getboolean('report'):
+        attachments = []
+        if data is not None:
+            attachments.append((attachment_name, data))
+        send_report(body, attachments)
+
+def compress_log(logfile, max_size):
+    """Stream the log collected in logfile into a gzip compressed
+    attachment of about max_size bytes at most.  Return the compressed
+    data and whether it has been truncated.
+    """
+    with tempfile.TemporaryFile() as raw:
+        with gzip.GzipFile(filename=attachment_name[:-3], mode='wb',
+                           fileobj=raw) as gzfile:
+            truncated = stream_log(logfile, gzfile, max_size)
+        raw.seek(0)
+        return raw.read(), truncated
+
+def send_report(body, attachments=(), subject=None):
+    """Send a mail report with body and the gzip compressed
+    attachments, given as pairs of file name and data.
+
+    The report is queued in the spool, if configured, or sent right
+    away otherwise.  subject defaults to the one configured.
+    """
+    from email.message import EmailMessage
+    import smtplib
+    cfg = config['mailreport']
+    msg = EmailMessage()
+    msg.set_content(body)
+    for filename, data in attachments:
+        msg.add_attachment(data, maintype='application',
+                           subtype='gzip', filename=filename)
+    msg['From'] = cfg.get('mailfrom')
+    msg['To'] = cfg.get('mailto')
+    msg['Subject'] = subject or cfg.get('subject')
+    spool = get_spool()
+    if spool:
+        try:
+            name = spool.add(msg)
+            log.debug("report queued in the spool as %s", name)
+            return
+        except OSError as err:
+            log.error("cannot queue the report, "
+                      "trying to send it right away: %s", err)
+    mailhost = cfg.get('mailhost')
+    try:
+        with log_timing("mail"):
+            with smtplib.SMTP(mailhost) as smtp:
+                smtp.send_message(msg)
+    except (OSError, smtplib.SMTPException) as err:
+        log.error("cannot send the report: %s", err)
+
+def deliver_mail():
+    """Deliver the reports from the spool.
+    """
+    import smtplib
+    spool = get_spool()
+    if not spool:
+        log.debug("no spool configured, nothing to deliver")
+        return
+    mailhost = config['mailreport'].get('mailhost')
+    timeout = config['spool'].getfloat('timeout')
+    def connect():
+        return smtplib.SMTP(mailhost, timeout=timeout)
+    with log_timing("deliver") as fields:
+        delivered = spool.deliver(connect)
+        fields['delivered'] = delivered
+    if delivered:
+        log.info("%d reports delivered", delivered)
@@ -0,0 +1,116 @@
+"""Restart the services still using deleted files after patching.
+
+After the installation, zypper ps lists the processes still using
+deleted files, such as old versions of updated libraries, and the
+systemd services they belong to.  If [restart] services is on, these
+services are restarted, up to [restart] batch_size at the same time,
+and zypper ps is called again to verify.  Only services matching
+[restart] allow and not matching [restart] deny are restarted.  The
+service running auto-patch itself is never restarted.
+"""
+
+from fnmatch import fnmatchcase
+import logging
+import os
+import subprocess
+
+from .config import config
+
+
+log = logging.getLogger(__name__)
+
+
+def split_patterns(value):
+    return value.replace(",", " ").split()
+
+def unit_name(service):
+    if service.endswith(".service"):
+        return service
+    return service + ".service"
+
+def own_service(processes):
+    """Return the service the running process belongs to, if listed
+    in processes.
+    """
+    pid = os.getpid()
+    for p in processes:
+        if p.pid == pid:
+            return p.service
+    return None
+
+def select_services(processes, allow=(), deny=()):
+    """Return the names of the services of processes to restart.
+
+    A service is taken if it matches any of the glob patterns in
+    allow, or if allow is empty, and none of those in deny.
+    """
+    skip = own_service(processes)
+    services = []
+    for p in processes:
+        s = p.service
+        if not s or s in services or s == skip:
+            continue
+        if allow and not any(fnmatchcase(s, a) for a in allow):
+            log.debug("not restarting %s: not allowed", s)
+            continue
+        if any(fnmatchcase(s, d) for d in deny):
+            log.debug("not restarting %s: denied", s)
+            continue
+        services.append(s)
+    return services
+
+def restart_service(service, systemctl="systemctl", timeout=None):
+    """Restart service, return None on success or the error.
+    """
+    cmd = [systemctl, "restart", unit_name(service)]
+    log.debug("run: %s", " ".join(cmd))
+    try:
+        proc = subprocess.run(cmd, stdin=subprocess.DEVNULL,
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT,
+                              universal_newlines=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return "timed out after %d seconds" % timeout
+    except OSError as err:
+        return str(err)
+    if proc.returncode:
+        msg = proc.stdout.strip().splitlines()
+        return "exit code %d%s" % (proc.returncode,
+                                   (": " + msg[-1]) if msg else "")
+    return None
+
+def restart_services(services, systemctl="systemctl", batch_size=4,
+                     timeout=None):
+    """Restart services in batches of batch_size at the same time.
+
+    Return a list of pairs of the service and the error or None.
+    """
+    import concurrent.futures
+    results = []
+    with concurrent.futures.ThreadPoolExecutor(batch_size) as pool:
+        for idx in range(0, len(services), batch_size):
+            batch = services[idx:idx + batch_size]
+            log.info("restarting %s", ", ".join(batch))
+            errors = pool.map(lambda s: restart_service(s, systemctl,
+                                                        timeout), batch)
+            for service, err in zip(batch, errors):
+                if err:
+                    log.warning("restart of %s failed: %s", service, err)
+                results.append((service, err))
+    return results
+
+def restart_from_config(processes):
+    """Restart the services of processes according to [restart].
+
+    Return a list of pairs of the service and the error or None.
+    """
+    cfg = config['restart']
+    services = select_services(processes,
+                               allow=split_patterns(cfg.get('allow')),
+                               deny=split_patterns(cfg.get('deny')))
+    if not services:
+        log.info("no services to restart")
+        return []
+    return restart_services(services, systemctl=cfg.get('systemctl'),
+                            batch_size=max(cfg.getint('batch_size'), 1),
+                            timeout=(cfg.getfloat('timeout') or None))
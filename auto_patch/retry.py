@@ -0,0 +1,249 @@
+"""Retry zypper calls that failed for temporary reasons.
+"""
+
+import logging
+import os
+import random
+import select
+from time import monotonic
+
+from .config import config
+from .exception import (ZypperLockedError, ZypperReposSkipped,
+                        ZypperReposFailed)
+from .log import log_timing
+from .status import RunStatus
+from .watchdog import keepalive_sleep, watchdog
+
+
+log = logging.getLogger(__name__)
+
+
+class Backoff:
+    """Exponential backoff with jitter and an overall deadline.
+
+    The delay starts at wait seconds and is multiplied by factor for
+    each subsequent try, but never exceeds max_wait.  Each delay is
+    randomly shortened by up to the fraction jitter, so that several
+    clients waiting for the same resource spread out.  next_delay()
+    returns None once the deadline has passed.
+    """
+
+    def __init__(self, wait, max_wait, deadline, factor=2.0, jitter=0.25):
+        self.delay = wait
+        self.max_wait = max_wait
+        self.deadline = monotonic() + deadline
+        self.factor = factor
+        self.jitter = jitter
+
+    def next_delay(self):
+        remaining = self.deadline - monotonic()
+        if remaining <= 0:
+            return None
+        delay = min(self.delay, self.max_wait)
+        delay *= 1.0 - self.jitter * random.random()
+        self.delay *= self.factor
+        return min(delay, remaining)
+
+
+class LockWaiter:
+    """Wait for the ZYPP lock to be released.
+
+    The lock file is watched with inotify, so that wait() returns as
+    soon as the process holding the lock exits.  If no holder is
+    visible, e.g. because the lock file is just being written or the
+    holder runs in another pid namespace, wait() returns as soon as the
+    lock file changes.  Only if inotify is not available, this falls
+    back to sleeping for the full timeout.  Keepalives are sent to the
+    watchdog while waiting.
+    """
+
+    _lockfile = "/run/zypp.pid"
+    poll_interval = 5.0
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    def __init__(self, lockfile=None):
+        if lockfile:
+            self._lockfile = lockfile
+
+    def holder(self):
+        """Return the pid of the process holding the lock or None.
+        """
+        try:
+            with open(self._lockfile, "rt") as f:
+                pid = int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return None
+        except PermissionError:
+            pass
+        return pid
+
+    def _inotify_watch(self):
+        """Return an inotify file descriptor watching the lock file.
+        """
+        import ctypes
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        mask = (self.IN_MODIFY | self.IN_ATTRIB | self.IN_CLOSE_WRITE |
+                self.IN_DELETE_SELF | self.IN_MOVE_SELF)
+        if libc.inotify_add_watch(fd, os.fsencode(self._lockfile), mask) < 0:
+            os.close(fd)
+            return None
+        return fd
+
+    def _select(self, fd, end):
+        """Wait for an event on the inotify file descriptor fd until
+        end, but at most poll_interval seconds.  Return True if there
+        was an event.
+        """
+        remaining = end - monotonic()
+        if remaining <= 0:
+            return False
+        timeout = min(remaining, self.poll_interval,
+                      watchdog.interval or remaining)
+        ready, _, _ = select.select([fd], [], [], timeout)
+        watchdog.keepalive()
+        if ready:
+            os.read(fd, 4096)
+        return bool(ready)
+
+    def wait(self, timeout):
+        """Wait until the lock is released, but at most timeout seconds.
+        """
+        end = monotonic() + timeout
+        fd = self._inotify_watch()
+        try:
+            if fd is None:
+                keepalive_sleep(timeout)
+                return
+            pid = self.holder()
+            if pid is None:
+                # Wait for the holder we cannot see to write or to
+                # remove the lock file.
+                log.debug("waiting for the lock file to change")
+                while monotonic() < end:
+                    if self._select(fd, end):
+                        return
+                return
+            log.debug("waiting for process %d to release the lock", pid)
+            while self.holder() == pid:
+                if monotonic() >= end:
+                    return
+                self._select(fd, end)
+            log.debug("lock has been released")
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+
+def retry(func, status=None, window=None, lockfile=None):
+    """Call func, retry if the ZYPP library is locked or if a
+    repository failed to refresh.
+
+    No further try is made after the end of the maintenance window,
+    if given.  lockfile overrides the lock file of the ZYPP library
+    from the configuration.
+    """
+    if status is None:
+        status = RunStatus()
+    retry_cfg = config['retry']
+    deadline = retry_cfg.getfloat('deadline')
+    if window is not None:
+        deadline = min(deadline, window.remaining())
+    backoff = Backoff(retry_cfg.getfloat('wait'),
+                      retry_cfg.getfloat('max_wait'), deadline)
+    lock_waiter = LockWaiter(lockfile or config['zypper'].get('lockfile'))
+    try_count = 0
+    while True:
+        try_count += 1
+        try:
+            return func()
+        except ZypperReposFailed:
+            # The failed repositories have already been retried.
+            raise
+        except (ZypperLockedError, ZypperReposSkipped) as err:
+            delay = None
+            if try_count < retry_cfg.getint('max'):
+                delay = backoff.next_delay()
+            if delay is not None:
+                log.warning("%s.  Will try again ...", err)
+                status.retries += 1
+                start = monotonic()
+                with log_timing("retry-wait", retry_count=try_count,
+                                retry_reason=type(err).__name__):
+                    if isinstance(err, ZypperLockedError):
+                        lock_waiter.wait(delay)
+                        status.lock_wait += monotonic() - start
+                    else:
+                        keepalive_sleep(delay)
+                continue
+            else:
+                err.Message += (".  Giving up after %d tries." % try_count)
+                raise err
+
+def retry_repos(zypper, err, status=None, window=None):
+    """Retry the refresh of the repositories skipped in the refresh
+    that failed with err.
+
+    Only the repositories that failed are refreshed again, with a
+    backoff of their own.  Return the list of repositories that still
+    fail after the retries if [retry] skip_failed_repos is on, so that
+    the run may go on without them.  Raise ZypperReposFailed
+    otherwise.  If it is not known which repositories failed, err is
+    raised again to retry the run as a whole.
+    """
+    failed = list(zypper.skipped_repos.repos)
+    if not failed:
+        raise err
+    if status is None:
+        status = RunStatus()
+    retry_cfg = config['retry']
+    deadline = retry_cfg.getfloat('deadline')
+    if window is not None:
+        deadline = min(deadline, window.remaining())
+    backoff = Backoff(retry_cfg.getfloat('wait'),
+                      retry_cfg.getfloat('max_wait'), deadline)
+    try_count = 1
+    while True:
+        log.warning("%s: %s", err, ", ".join(failed))
+        delay = None
+        if try_count < retry_cfg.getint('max'):
+            delay = backoff.next_delay()
+        if delay is None:
+            break
+        status.retries += 1
+        with log_timing("retry-wait", retry_count=try_count,
+                        retry_reason=type(err).__name__):
+            keepalive_sleep(delay)
+        try_count += 1
+        try:
+            zypper.refresh(repos=failed)
+            log.info("repositories refreshed: %s", ", ".join(failed))
+            return []
+        except ZypperReposSkipped as e:
+            err = e
+            failed = list(zypper.skipped_repos.repos) or failed
+    if retry_cfg.getboolean('skip_failed_repos'):
+        log.error("going on without the repositories failing to refresh "
+                  "after %d tries: %s", try_count, ", ".join(failed))
+        zypper.no_refresh = True
+        return failed
+    exc = ZypperReposFailed(err.cmd, err.stdout, err.stderr)
+    exc.Message += (": %s.  Giving up after %d tries."
+                    % (", ".join(failed), try_count))
+    raise exc
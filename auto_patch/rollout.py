@@ -0,0 +1,308 @@
+"""Roll out the patches to a fleet of hosts in waves.
+
+auto-patch --rollout runs auto-patch on each of the targets from
+[rollout] by means of a transport, SSH by default.  The targets are
+taken in waves: first the canaries, then growing percentages of the
+remaining targets.  Up to [rollout] concurrency targets are run at the
+same time.  After each wave, the rollout is stopped if the share of
+the targets that failed so far is above [rollout] max_failure_rate,
+so that a bad patch does not reach the whole fleet.
+
+A target fails if auto-patch exits with a nonzero exit code, other
+than those in transient_exit_codes, or if the transport fails.  The
+exit codes of auto-patch are those of the ZypperExitException
+raised, so the report names the exception for each failed target.
+"""
+
+import logging
+import shlex
+import subprocess
+from time import monotonic
+
+from .config import config
+from .exception import ZypperExitException, ZypperLockedError
+from .watchdog import watchdog
+
+
+log = logging.getLogger(__name__)
+
+# Exit codes that neither count as a success nor as a failure: the
+# target has not been patched, but nothing went wrong either.
+transient_exit_codes = {ZypperLockedError.ExitCode}
+
+
+class Transport:
+    """Run a command on a target.
+
+    Derived classes must override args() to return the command line
+    to run locally for a target.
+    """
+
+    def __init__(self, command, timeout=None):
+        self.command = command
+        self.timeout = timeout
+
+    def args(self, target):
+        raise NotImplementedError
+
+    def run(self, target):
+        """Run the command on target, return the exit code and the
+        output.  The exit code is None if the command timed out.
+        """
+        try:
+            proc = subprocess.run(self.args(target),
+                                  stdin=subprocess.DEVNULL,
+                                  stdout=subprocess.PIPE,
+                                  stderr=subprocess.STDOUT,
+                                  timeout=self.timeout)
+        except subprocess.TimeoutExpired as err:
+            return None, err.output or b""
+        return proc.returncode, proc.stdout
+
+class SSHTransport(Transport):
+    """Run the command on the target host with ssh.
+    """
+
+    def __init__(self, command, timeout=None, options=()):
+        super().__init__(command, timeout=timeout)
+        self.options = list(options)
+
+    def args(self, target):
+        return ["ssh"] + self.options + [target, "--"] + self.command
+
+class LocalTransport(Transport):
+    """Run the command locally, with {target} in its arguments
+    replaced by the target.
+
+    This is a stand-in for testing the rollout without touching any
+    hosts.
+    """
+
+    def args(self, target):
+        return [ a.replace("{target}", target) for a in self.command ]
+
+transports = {
+    'ssh': SSHTransport,
+    'local': LocalTransport,
+}
+
+
+def get_transport():
+    """Return the Transport configured in [rollout].
+    """
+    cfg = config['rollout']
+    name = cfg.get('transport')
+    try:
+        cls = transports[name]
+    except KeyError:
+        raise ValueError("invalid transport '%s'" % name) from None
+    kwargs = dict(timeout=(cfg.getfloat('timeout') or None))
+    if cls is SSHTransport:
+        kwargs['options'] = shlex.split(cfg.get('ssh_options'))
+    return cls(shlex.split(cfg.get('command')), **kwargs)
+
+def get_targets():
+    """Return the targets configured in [rollout].
+
+    The targets are separated by commas or whitespace.  An entry
+    @FILE is replaced by the targets listed in FILE, one per line,
+    ignoring empty lines and comments.
+    """
+    targets = []
+    for entry in config['rollout'].get('targets').replace(",", " ").split():
+        if entry.startswith("@"):
+            with open(entry[1:], "rt") as f:
+                for line in f:
+                    line = line.partition("#")[0].strip()
+                    if line:
+                        targets.append(line)
+        else:
+            targets.append(entry)
+    # Drop duplicates, keeping the order.
+    return list(dict.fromkeys(targets))
+
+def plan_waves(targets, canary=1, waves=(100,)):
+    """Split targets into waves.
+
+    The first wave has the canary first targets.  The following waves
+    grow the share of the remaining targets covered to each of the
+    percentages in waves.  The last wave always covers all targets.
+    Empty waves are dropped.
+    """
+    plan = [ targets[:canary] ]
+    rest = targets[canary:]
+    done = 0
+    for pct in list(waves) + [100]:
+        end = min(-(-len(rest) * pct // 100), len(rest))
+        plan.append(rest[done:end])
+        done = max(done, end)
+    return [ w for w in plan if w ]
+
+def parse_waves(spec):
+    """Parse the percentages of the waves, e.g. "10, 50, 100".
+    """
+    waves = []
+    for item in spec.replace(",", " ").split():
+        pct = int(item)
+        if not 0 < pct <= 100:
+            raise ValueError("invalid wave '%s'" % item)
+        waves.append(pct)
+    return waves
+
+def describe_exit_code(exit_code):
+    if exit_code is None:
+        return "timed out"
+    if exit_code == 0:
+        return "ok"
+    try:
+        exc = ZypperExitException._SubClasses[exit_code]
+        return "exit code %d (%s)" % (exit_code, exc.__name__)
+    except KeyError:
+        return "exit code %d" % exit_code
+
+
+class TargetResult:
+    """The outcome of the run on one target.
+    """
+
+    def __init__(self, target, wave, exit_code, output, duration):
+        self.target = target
+        self.wave = wave
+        self.exit_code = exit_code
+        self.output = output
+        self.duration = duration
+
+    @property
+    def failed(self):
+        return self.exit_code != 0 and not self.transient
+
+    @property
+    def transient(self):
+        return self.exit_code in transient_exit_codes
+
+class Rollout:
+    """Run a transport on the targets in waves, with at most
+    concurrency targets at a time, stopping if the share of failed
+    targets goes above max_failure_rate.
+    """
+
+    def __init__(self, transport, concurrency=20, max_failure_rate=0.0):
+        self.transport = transport
+        self.concurrency = concurrency
+        self.max_failure_rate = max_failure_rate
+        self.results = []
+        self.aborted = False
+
+    def _run_target(self, target, wave):
+        start = monotonic()
+        try:
+            exit_code, output = self.transport.run(target)
+        except OSError as err:
+            exit_code, output = -1, str(err).encode("utf-8")
+        result = TargetResult(target, wave, exit_code, output,
+                              monotonic() - start)
+        if result.failed:
+            log.warning("%s: %s", target, describe_exit_code(exit_code))
+        else:
+            log.info("%s: %s", target, describe_exit_code(exit_code))
+        return result
+
+    def failure_rate(self):
+        if not self.results:
+            return 0.0
+        failed = sum(1 for r in self.results if r.failed)
+        return failed / len(self.results)
+
+    def run(self, waves):
+        """Run the waves, a list of lists of targets.
+
+        Return True if all waves have been run, False if the rollout
+        has been stopped.
+        """
+        import concurrent.futures
+        with concurrent.futures.ThreadPoolExecutor(self.concurrency) as pool:
+            for idx, wave in enumerate(waves, start=1):
+                log.info("wave %d: %d targets", idx, len(wave))
+                pending = { pool.submit(self._run_target, t, idx)
+                            for t in wave }
+                while pending:
+                    done, pending = concurrent.futures.wait(
+                        pending, timeout=(watchdog.interval or None))
+                    watchdog.keepalive()
+                    self.results.extend(f.result() for f in done)
+                rate = self.failure_rate()
+                if rate > self.max_failure_rate:
+                    log.error("stopping the rollout after wave %d: "
+                              "failure rate %.0f%% above %.0f%%",
+                              idx, rate * 100, self.max_failure_rate * 100)
+                    self.aborted = True
+                    return False
+        return True
+
+    def format(self, waves, tail_lines=20):
+        """Format the summary of the rollout for the report.
+
+        The last tail_lines lines of output are included for each
+        target that failed.
+        """
+        failed = [ r for r in self.results if r.failed ]
+        transient = [ r for r in self.results if r.transient ]
+        ok = len(self.results) - len(failed) - len(transient)
+        total = sum(len(w) for w in waves)
+        lines = [ "Rollout %s: %d of %d targets run in %d of %d waves."
+                  % ("stopped" if self.aborted else "completed",
+                     len(self.results), total,
+                     len({ r.wave for r in self.results }), len(waves)),
+                  "Succeeded: %d, failed: %d, not patched: %d"
+                  % (ok, len(failed), len(transient)),
+                  "Failure rate: %.0f%%, maximum %.0f%%"
+                  % (self.failure_rate() * 100,
+                     self.max_failure_rate * 100) ]
+        sections = [ "\n".join(lines) + "\n" ]
+        if failed or transient:
+            lines = [ "Targets that failed or have not been patched:" ]
+            for r in failed + transient:
+                lines.append("  %s (wave %d): %s"
+                             % (r.target, r.wave,
+                                describe_exit_code(r.exit_code)))
+            sections.append("\n".join(lines) + "\n")
+        for r in failed:
+            output = r.output.decode("utf-8", errors="replace")
+            tail = output.splitlines()[-tail_lines:] if tail_lines else []
+            lines = [ "%s failed, last lines of output:\n" % r.target ]
+            lines.extend("  " + l for l in tail)
+            sections.append("\n".join(lines) + "\n")
+        seen = { r.target for r in self.results }
+        skipped = [ t for w in waves for t in w if t not in seen ]
+        if skipped:
+            sections.append("Targets not run:\n"
+                            + "".join("  %s\n" % t for t in skipped))
+        return "\n".join(sections)
+
+
+def run_rollout():
+    """Run the rollout configured in [rollout] and mail a report.
+
+    Return 0 if all waves have been run, 1 otherwise.
+    """
+    from .report import send_report
+    cfg = config['rollout']
+    targets = get_targets()
+    if not targets:
+        log.error("no targets to roll out to")
+        return 1
+    waves = plan_waves(targets, canary=cfg.getint('canary'),
+                       waves=parse_waves(cfg.get('waves')))
+    rollout = Rollout(get_transport(),
+                      concurrency=cfg.getint('concurrency'),
+                      max_failure_rate=cfg.getfloat('max_failure_rate'))
+    completed = rollout.run(waves)
+    body = rollout.format(waves,
+                          tail_lines=config['mailreport'].getint('tail_lines'))
+    log.info("rollout summary:\n%s", body)
+    if config['mailreport'].getboolean('report'):
+        subject = "%s: rollout %s" % (config['mailreport'].get('subject'),
+                                      "completed" if completed
+                                      else "stopped")
+        send_report(body, subject=subject)
+    return 0 if completed else 1
@@ -0,0 +1,178 @@
+"""Patch many system roots in parallel.
+
+In multi-root mode, auto-patch installs the needed patches into other
+system roots, such as images or container root file systems, rather
+than into the running system, using zypper --root.  Each root is
+patched in a worker process of its own, up to [roots] workers at the
+same time.  One mail report is sent for all the roots, with a table
+of the outcome, the summary for each root, and the output collected
+for each root attached.
+
+The history, the metrics, and the digest collector are about the
+running system and are not used in multi-root mode.  Each root keeps
+its files, such as the durations of previous runs, in a directory of
+its own below roots in the [zypper] cache_dir.
+"""
+
+import glob
+import logging
+import os
+import tempfile
+
+from .config import config
+from .exception import ZypperExitException
+from .log import logging_add_report
+from .report import compress_log, format_summary, send_report, stream_log
+from .status import RunStatus
+from .watchdog import watchdog
+from .workflow import get_zypper, patch
+
+
+log = logging.getLogger(__name__)
+
+
+def get_roots(roots=None):
+    """Return the roots to patch.
+
+    roots defaults to the [roots] roots configured.  Glob patterns
+    are expanded, only directories are taken.
+    """
+    if roots is None:
+        roots = config['roots'].get('roots').replace(",", " ").split()
+    result = []
+    for pattern in roots:
+        paths = sorted(glob.glob(pattern))
+        if not paths:
+            log.warning("no root matches %s", pattern)
+        for path in paths:
+            path = os.path.abspath(path)
+            if not os.path.isdir(path):
+                log.warning("skipping %s: not a directory", path)
+            elif path not in result:
+                result.append(path)
+    return result
+
+def attachment_name(root):
+    return "auto-patch%s.log.gz" % root.rstrip("/").replace("/", "_")
+
+def root_cache_dir(cache_dir, root):
+    """Return the cache directory of root within cache_dir.
+    """
+    return os.path.join(cache_dir, "roots",
+                        root.strip("/").replace("/", "_") or "_")
+
+def patch_root(root):
+    """Install the needed patches into root.
+
+    This is run in a worker process.  Return the outcome as a dict.
+    """
+    status = RunStatus()
+    exit_code = 0
+    have_patches = False
+    cache_dir = config['zypper'].get('cache_dir')
+    if cache_dir:
+        # The workers must not share the files in the cache directory.
+        # This only changes the configuration of this worker process.
+        config['zypper']['cache_dir'] = root_cache_dir(cache_dir, root)\
+                                        .replace("%", "%%")
+    zypper = get_zypper(xmlout=config['zypper'].getboolean('xmlout'),
+                        root=root)
+    with tempfile.TemporaryFile(mode='w+t') as tmpf:
+        with logging_add_report(config['logging'], tmpf) as messages:
+            log.info("patching %s", root)
+            try:
+                have_patches = patch(stdout=tmpf, status=status,
+                                     zypper=zypper)
+            except ZypperExitException as err:
+                log.error(err)
+                exit_code = err.ExitCode
+            except Exception as err:
+                log.critical("Internal error %s: %s",
+                             type(err).__name__, err, exc_info=err)
+                exit_code = -1
+        status.finish(exit_code)
+        summary = format_summary(status, exit_code=exit_code,
+                                 messages=messages)
+        max_size = config['mailreport'].getint('max_size')
+        if max_size > 0:
+            data, truncated = compress_log(tmpf, max_size)
+            if truncated:
+                summary += ("\nThe attached log has been truncated to "
+                            "about %d bytes.\n" % max_size)
+        else:
+            stream_log(tmpf)
+            data = None
+    return {
+        'root': root,
+        'exit_code': exit_code,
+        'have_patches': have_patches,
+        'installed': sum(status.installed().values()),
+        'outstanding': sum(status.outstanding.values()),
+        'reboot_required': status.reboot_required,
+        'summary': summary,
+        'log': data,
+    }
+
+def format_roots_summary(results):
+    """Format the body of the report for the outcome of all roots.
+    """
+    width = max([ len(r['root']) for r in results ] + [4])
+    lines = [ "%-*s  %4s  %9s  %11s  %s" % (width, "Root", "Exit",
+                                            "Installed", "Outstanding",
+                                            "Reboot") ]
+    for r in results:
+        lines.append("%-*s  %4d  %9d  %11d  %s"
+                     % (width, r['root'], r['exit_code'], r['installed'],
+                        r['outstanding'],
+                        "yes" if r['reboot_required'] else "no"))
+    failed = sum(1 for r in results if r['exit_code'])
+    sections = [ "Roots patched: %d, failed: %d\n"
+                 % (len(results) - failed, failed),
+                 "\n".join(lines) + "\n" ]
+    for r in results:
+        sections.append("=== %s ===\n\n%s" % (r['root'], r['summary']))
+    return "\n".join(sections)
+
+def patch_roots(roots):
+    """Install the needed patches into all the roots in parallel.
+
+    Send one mail report for all roots if patches were needed or if
+    any root failed.  Return the first nonzero exit code of the roots
+    or 0.
+    """
+    import multiprocessing
+    workers = max(min(config['roots'].getint('workers'), len(roots)), 1)
+    log.info("patching %d roots with %d workers", len(roots), workers)
+    results = {}
+    # Each root gets a fresh process, forked from this one, so that
+    # no state is carried over from one root to the next.
+    ctx = multiprocessing.get_context("fork")
+    pool = ctx.Pool(workers, maxtasksperchild=1)
+    try:
+        it = pool.imap_unordered(patch_root, roots)
+        while len(results) < len(roots):
+            try:
+                r = it.next(timeout=(watchdog.interval or None))
+            except multiprocessing.TimeoutError:
+                watchdog.keepalive()
+                continue
+            log.info("%s: exit code %d, %d patches installed",
+                     r['root'], r['exit_code'], r['installed'])
+            results[r['root']] = r
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    results = [ results[root] for root in roots ]
+    exit_code = next((r['exit_code'] for r in results if r['exit_code']), 0)
+    if (config['mailreport'].getboolean('report') and
+        any(r['exit_code'] or r['have_patches'] for r in results)):
+        attachments = [ (attachment_name(r['root']), r['log'])
+                        for r in results if r['log'] is not None ]
+        subject = "%s: %d roots" % (config['mailreport'].get('subject'),
+                                    len(results))
+        send_report(format_roots_summary(results), attachments,
+                    subject=subject)
+    return exit_code
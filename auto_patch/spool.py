@@ -0,0 +1,162 @@
+"""A spool directory for the mail reports.
+
+Rather than sending the report right away at the end of a run, it
+may be written to a spool directory to be delivered in a separate
+step.  So a slow or unavailable mail relay does not delay the run
+and reports survive an outage of the relay.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import random
+from time import time
+
+from .atomic import atomic_write
+from .config import config
+
+
+log = logging.getLogger(__name__)
+
+
+class MailSpool:
+    """A directory of mail messages waiting for delivery.
+
+    Each message is stored in a file NAME.msg together with the state
+    of its delivery in NAME.json.  Both files are written atomically,
+    the state file last, so that a message is only considered once it
+    is complete.  A failed delivery is retried with exponential
+    backoff, starting at wait seconds and capped at max_wait seconds.
+    Messages that could not be delivered within expire seconds are
+    dropped.
+    """
+
+    def __init__(self, directory, wait=300, max_wait=3600, expire=604800):
+        self.directory = directory
+        self.wait = wait
+        self.max_wait = max_wait
+        self.expire = expire
+
+    def _write(self, name, data):
+        path = os.path.join(self.directory, name)
+        with atomic_write(path, mode='wb', fsync=True) as f:
+            f.write(data)
+
+    def _read_state(self, name):
+        with open(os.path.join(self.directory, name + ".json"), "rt") as f:
+            return json.load(f)
+
+    def _write_state(self, name, state):
+        self._write(name + ".json", json.dumps(state).encode("ascii"))
+
+    def _remove(self, name):
+        for ext in (".json", ".msg"):
+            try:
+                os.unlink(os.path.join(self.directory, name + ext))
+            except FileNotFoundError:
+                pass
+
+    def add(self, msg):
+        """Add an email.message.EmailMessage to the spool.
+        Return the name of the spooled message.
+        """
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        now = time()
+        name = "%d-%d" % (int(now * 1000000), os.getpid())
+        self._write(name + ".msg", msg.as_bytes())
+        self._write_state(name, { 'created': now, 'attempts': 0,
+                                  'next_attempt': now })
+        return name
+
+    def messages(self):
+        """Return the names of all complete messages in the spool.
+        """
+        try:
+            entries = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(e[:-5] for e in entries
+                      if e.endswith(".json") and not e.startswith("."))
+
+    def _defer(self, name, state, err, now):
+        state['attempts'] += 1
+        delay = min(self.wait * 2 ** (state['attempts'] - 1), self.max_wait)
+        delay *= 1.0 - 0.25 * random.random()
+        state['next_attempt'] = now + delay
+        log.warning("delivery of %s deferred for %.0f seconds: %s",
+                    name, delay, err)
+        self._write_state(name, state)
+
+    def deliver(self, connect):
+        """Deliver the messages that are due.
+
+        connect is called without arguments to open a connection to
+        the mail relay and must return an smtplib.SMTP object.  One
+        connection is used for all messages.  Return the number of
+        messages delivered.  If another process is already delivering
+        from the spool, return None right away.
+        """
+        import email
+        import email.policy
+        import smtplib
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        lockfd = os.open(os.path.join(self.directory, ".lock"),
+                         os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            try:
+                fcntl.flock(lockfd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                log.debug("another process is delivering from the spool")
+                return None
+            now = time()
+            due = []
+            for name in self.messages():
+                try:
+                    state = self._read_state(name)
+                except (OSError, ValueError) as err:
+                    log.error("invalid spool entry %s: %s", name, err)
+                    continue
+                if now - state['created'] > self.expire:
+                    log.error("dropping report %s: not delivered after "
+                              "%d attempts", name, state['attempts'])
+                    self._remove(name)
+                elif state['next_attempt'] <= now:
+                    due.append((name, state))
+            if not due:
+                return 0
+            delivered = 0
+            try:
+                smtp = connect()
+            except (OSError, smtplib.SMTPException) as err:
+                for name, state in due:
+                    self._defer(name, state, err, now)
+                return 0
+            with smtp:
+                for name, state in due:
+                    path = os.path.join(self.directory, name + ".msg")
+                    try:
+                        with open(path, "rb") as f:
+                            msg = email.message_from_binary_file(
+                                f, policy=email.policy.default)
+                        smtp.send_message(msg)
+                    except (OSError, smtplib.SMTPException) as err:
+                        self._defer(name, state, err, now)
+                    else:
+                        log.debug("report %s delivered", name)
+                        self._remove(name)
+                        delivered += 1
+            return delivered
+        finally:
+            os.close(lockfd)
+
+
+def get_spool():
+    """Return the MailSpool configured or None.
+    """
+    cfg = config['spool']
+    if not cfg.get('directory'):
+        return None
+    return MailSpool(cfg.get('directory'), wait=cfg.getfloat('wait'),
+                     max_wait=cfg.getfloat('max_wait'),
+                     expire=cfg.getfloat('expire'))
@@ -0,0 +1,107 @@
+"""The outcome of a run and its export as metrics.
+"""
+
+import os
+from time import monotonic, time
+
+from .atomic import atomic_write
+
+
+class RunStatus:
+    """Collect the outcome of a run to be exported as metrics and to
+    be recorded in the history.
+    """
+
+    def __init__(self, mode="patch"):
+        self.mode = mode
+        self.start_time = time()
+        self._start = monotonic()
+        self.duration = None
+        self.exit_code = None
+        self.needed = None
+        self.outstanding = {}
+        self.reboot_required = False
+        self.retries = 0
+        self.lock_wait = 0.0
+        self.patches = {}
+        self.installed_patches = []
+        self.passes = []
+        self.deferred = []
+        self.skipped_repos = []
+        self.processes = []
+        self.restarts = []
+        self.zypper_calls = []
+
+    def finish(self, exit_code):
+        self.exit_code = exit_code
+        self.duration = monotonic() - self._start
+
+    def add_patches(self, patches):
+        """Take note of patches listed as needed.
+        """
+        for p in patches:
+            self.patches.setdefault(p.name, p)
+
+    def outstanding_patches(self):
+        """Return the names of the patches seen, but not installed.
+        """
+        installed = set(self.installed_patches)
+        return [ n for n in self.patches if n not in installed ]
+
+    def installed(self):
+        """Return the number of installed patches per category.
+        """
+        needed = self.needed or {}
+        return { c: max(n - self.outstanding.get(c, 0), 0)
+                 for c, n in needed.items() }
+
+    def metrics(self):
+        """Return the metrics in the Prometheus text format.
+        """
+        lines = []
+        label = 'mode="%s"' % self.mode
+        def add(name, helptext, values):
+            lines.append("# HELP auto_patch_%s %s" % (name, helptext))
+            lines.append("# TYPE auto_patch_%s gauge" % name)
+            for labels, value in values:
+                labels = ",".join([label] + labels)
+                lines.append("auto_patch_%s{%s} %s" % (name, labels, value))
+        def by_category(counts):
+            return [ (['category="%s"' % c], n)
+                     for c, n in sorted(counts.items()) ]
+        add("last_run_timestamp_seconds",
+            "Start time of the last run.", [([], "%.3f" % self.start_time)])
+        add("last_run_duration_seconds",
+            "Duration of the last run.", [([], "%.3f" % self.duration)])
+        add("last_run_exit_code",
+            "Exit code of the last run.", [([], self.exit_code)])
+        add("patches_needed",
+            "Patches needed at the start of the last run.",
+            by_category(self.needed or {}))
+        add("patches_installed",
+            "Patches installed in the last run.",
+            by_category(self.installed()))
+        add("security_patches_outstanding",
+            "Security patches still needed after the last run.",
+            [([], self.outstanding.get('security', 0))])
+        add("reboot_required",
+            "Whether a reboot is required after the last run.",
+            [([], int(self.reboot_required))])
+        add("retries",
+            "Number of retries in the last run.", [([], self.retries)])
+        add("lock_wait_seconds",
+            "Time spent waiting for the ZYPP lock in the last run.",
+            [([], "%.3f" % self.lock_wait)])
+        return "\n".join(lines) + "\n"
+
+    def write_metrics(self, directory):
+        """Atomically write the metrics to a file in directory for
+        the textfile collector of the Prometheus node exporter.
+        """
+        if self.mode == "patch":
+            fname = "auto-patch.prom"
+        else:
+            fname = "auto-patch-%s.prom" % self.mode
+        path = os.path.join(directory, fname)
+        with atomic_write(path, perm=0o644) as f:
+            f.write(self.metrics())
@@ -0,0 +1,63 @@
+"""Keepalive notifications for the systemd watchdog.
+
+If the service is run with WatchdogSec= set, systemd passes the
+watchdog interval in the environment and expects the service to send
+keepalive notifications more often than that.  Otherwise, keepalive()
+does nothing.
+"""
+
+import logging
+import os
+from time import monotonic, sleep
+
+
+log = logging.getLogger(__name__)
+
+
+class Watchdog:
+    """Send keepalive notifications to the systemd watchdog, at most
+    once in half of the watchdog interval.
+    """
+
+    def __init__(self):
+        self._interval = None
+        self._last = 0.0
+
+    @property
+    def interval(self):
+        """The interval between two keepalives in seconds, or 0 if the
+        watchdog is not enabled.
+        """
+        if self._interval is None:
+            self._interval = 0.0
+            pid = os.environ.get('WATCHDOG_PID')
+            usec = os.environ.get('WATCHDOG_USEC')
+            if usec and (not pid or pid == str(os.getpid())):
+                try:
+                    self._interval = int(usec) / 2000000
+                except ValueError:
+                    log.warning("invalid WATCHDOG_USEC=%s", usec)
+        return self._interval
+
+    def keepalive(self):
+        if not self.interval:
+            return
+        now = monotonic()
+        if now - self._last < self.interval:
+            return
+        import systemd.daemon
+        systemd.daemon.notify("WATCHDOG=1")
+        self._last = now
+
+watchdog = Watchdog()
+
+def keepalive_sleep(delay):
+    """Sleep for delay seconds, sending keepalives to the watchdog.
+    """
+    end = monotonic() + delay
+    while True:
+        remaining = end - monotonic()
+        if remaining <= 0:
+            break
+        sleep(min(remaining, watchdog.interval or remaining))
+        watchdog.keepalive()
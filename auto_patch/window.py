@@ -0,0 +1,182 @@
+"""The maintenance window and the prediction of durations.
+
+If a maintenance window is configured, steps of the run that are
+predicted not to finish before the end of the window are deferred to
+the next run.  The durations are predicted from those of previous
+runs, kept in a JSON file in the cache directory.  If not all of the
+patches fit, the most urgent ones that do are installed, so that each
+run makes progress.
+"""
+
+import datetime
+import json
+import logging
+import os
+from time import time
+
+from .atomic import atomic_write
+from .config import config
+
+
+log = logging.getLogger(__name__)
+
+
+class Window:
+    """A maintenance window ending at deadline, given in seconds since
+    the epoch.  The last margin seconds of the window are reserved.
+    """
+
+    def __init__(self, deadline, margin=0.0):
+        self.deadline = deadline
+        self.margin = margin
+
+    def remaining(self):
+        """Return the seconds left in the window, excluding the margin.
+        """
+        return self.deadline - self.margin - time()
+
+    def fits(self, estimate):
+        """Return True if a step taking estimate seconds is expected
+        to end within the window.
+        """
+        return estimate <= self.remaining()
+
+    def __str__(self):
+        return datetime.datetime.fromtimestamp(self.deadline)\
+                                .strftime("%Y-%m-%d %H:%M:%S")
+
+
+def parse_time_of_day(value):
+    """Parse a time of day HH:MM into hour and minute.
+    """
+    hour, _, minute = value.strip().partition(":")
+    hour, minute = int(hour), int(minute or 0)
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError("invalid time of day '%s'" % value)
+    return hour, minute
+
+def get_window(start=None):
+    """Return the Window configured or None.
+
+    The window ends at the next occurrence of the time of day set in
+    [window] end after start or after duration seconds since start,
+    whichever comes first.  An invalid [window] end is logged and
+    ignored.
+    """
+    cfg = config['window']
+    if start is None:
+        start = time()
+    deadlines = []
+    if cfg.get('end'):
+        try:
+            hour, minute = parse_time_of_day(cfg.get('end'))
+        except ValueError:
+            log.error("ignoring invalid [window] end '%s', "
+                      "expected HH:MM", cfg.get('end'))
+        else:
+            dt = datetime.datetime.fromtimestamp(start)
+            end = dt.replace(hour=hour, minute=minute,
+                             second=0, microsecond=0)
+            if end <= dt:
+                end += datetime.timedelta(days=1)
+            deadlines.append(end.timestamp())
+    if cfg.getfloat('duration') > 0:
+        deadlines.append(start + cfg.getfloat('duration'))
+    if not deadlines:
+        return None
+    return Window(min(deadlines), margin=cfg.getfloat('margin'))
+
+
+class DurationModel:
+    """Predict the durations of steps from previous runs.
+
+    For each step, the last max_samples observations of its sizes and
+    its duration are kept.  The sizes of the installation are the
+    number of patches and of packages and the bytes to download.  For
+    each size, the time per unit is averaged over the observations,
+    with the weight halved for each older one, so that the prediction
+    follows changes, e.g. of the speed of the mirror, and recovers
+    from a single slow run.  The prediction is the longest of those
+    made from each of the sizes known, so that it errs on the safe
+    side.  Steps without sizes are predicted from their average
+    duration.  The observations are kept in a file in directory.
+    Failure to read or to write that file is not an error.
+    """
+
+    fname = "durations.json"
+    max_samples = 10
+    decay = 0.5
+
+    def __init__(self, directory=None):
+        self.path = os.path.join(directory, self.fname) if directory else None
+        self.samples = {}
+        self._changed = False
+        if self.path:
+            try:
+                with open(self.path, "rt") as f:
+                    data = json.load(f)
+                if isinstance(data, dict):
+                    self.samples = { step: self._convert(step, samples)
+                                     for step, samples in data.items() }
+            except (OSError, ValueError, TypeError):
+                pass
+
+    @staticmethod
+    def _convert(step, samples):
+        """Convert samples from older versions, having the number of
+        patches as single size.
+        """
+        converted = []
+        for sizes, duration in samples:
+            if not isinstance(sizes, dict):
+                sizes = { 'patches': sizes } if step == "install" else {}
+            converted.append([sizes, duration])
+        return converted
+
+    def add(self, step, duration, **sizes):
+        samples = self.samples.setdefault(step, [])
+        samples.append([sizes, duration])
+        del samples[:-self.max_samples]
+        self._changed = True
+
+    def has_samples(self, step):
+        return bool(self.samples.get(step))
+
+    def _average(self, values):
+        """Return the average of values, the latest weighing most.
+        """
+        total = weights = 0.0
+        weight = 1.0
+        for value in reversed(values):
+            total += weight * value
+            weights += weight
+            weight *= self.decay
+        return total / weights if weights else None
+
+    def estimate(self, step, **sizes):
+        """Return the predicted duration of step with sizes in seconds
+        or None if there are no observations.
+        """
+        samples = self.samples.get(step)
+        if not samples:
+            return None
+        if not sizes:
+            return self._average([ d for s, d in samples ])
+        estimates = []
+        for name, size in sizes.items():
+            rate = self._average([ d / s[name] for s, d in samples
+                                   if s.get(name) ])
+            if rate is not None:
+                estimates.append(rate * size)
+        return max(estimates) if estimates else None
+
+    def save(self):
+        if not self.path or not self._changed:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with atomic_write(self.path) as f:
+                json.dump(self.samples, f)
+            self._changed = False
+        except OSError as err:
+            log.debug("cannot write durations: %s", err)
@@ -0,0 +1,676 @@
+"""The workflows to install or to download patches.
+"""
+
+import json
+import logging
+import os
+from time import monotonic
+
+from .atomic import atomic_write
+from .config import config
+from .exception import (ZypperExitException, ZypperPatchesAvailable,
+                        ZypperSecurityPatchesAvailable, ZypperReposSkipped,
+                        ZypperRebootNeeded, ZypperRestartNeeded)
+from .lease import download_lease, get_lease
+from .log import log_timing
+from .restart import restart_from_config
+from .retry import retry, retry_repos
+from .status import RunStatus
+from .window import DurationModel, get_window
+from .zypper import Zypper
+
+
+log = logging.getLogger(__name__)
+
+
+def refresh_pending(zypper):
+    """Return True if the repositories are still to be refreshed.
+    """
+    return config['zypper'].getboolean('refresh') and not zypper.no_refresh
+
+def refresh_repos(zypper, durations=None, status=None, window=None):
+    """Refresh the repositories once at the start of the run, if
+    configured.  The duration is recorded in durations if given.
+
+    If some repositories fail to refresh, only those are retried, see
+    retry_repos().  Those given up on are noted in status.
+    """
+    if refresh_pending(zypper):
+        start = monotonic()
+        with log_timing("refresh"):
+            max_age = config['zypper'].getfloat('refresh_max_age')
+            try:
+                zypper.refresh(max_age=max_age)
+            except ZypperReposSkipped as err:
+                failed = retry_repos(zypper, err, status=status,
+                                     window=window)
+                if status is not None:
+                    status.skipped_repos = failed
+        if durations is not None:
+            durations.add("refresh", monotonic() - start)
+
+def download_only(func, *args, **kwargs):
+    """Call func, a zypper call taking download_only, to download
+    packages only, while holding a download slot.
+
+    zypper exits with ZypperRebootNeeded or ZypperRestartNeeded as it
+    would for the installation.  For the download, this is not an
+    error.  With ZypperRestartNeeded, the download was restricted to
+    the patches for the package manager itself, the remaining
+    packages are downloaded in the installation.
+    """
+    try:
+        with download_lease():
+            func(*args, download_only=True, **kwargs)
+    except (ZypperRebootNeeded, ZypperRestartNeeded):
+        pass
+
+def check_patches(zypper, stdout=None):
+    """Call zypper patch-check, return True if patches are needed.
+    """
+    zypper.summary.reset()
+    zypper.categories.reset()
+    try:
+        zypper.patch_check(stdout=stdout)
+        log.debug("no patches needed")
+        return False
+    except (ZypperPatchesAvailable, ZypperSecurityPatchesAvailable):
+        pass
+    if zypper.summary.summary:
+        log.info(zypper.summary.summary)
+    else:
+        log.info("patches are needed")
+    return True
+
+class PatchPass:
+    """One pass of the installation of patches, restricted to the
+    patches of category and severity if set.
+    """
+    __slots__ = ('category', 'severity')
+
+    def __init__(self, category=None, severity=None):
+        self.category = category
+        self.severity = severity
+
+    @classmethod
+    def parse(cls, spec):
+        """Parse a pass from its specification CATEGORY[:SEVERITY],
+        where CATEGORY may be all for any category.
+        """
+        category, _, severity = spec.strip().partition(":")
+        if category == "all":
+            category = None
+        return cls(category or None, severity or None)
+
+    @property
+    def filtered(self):
+        return bool(self.category or self.severity)
+
+    @property
+    def filter(self):
+        return dict(category=self.category, severity=self.severity)
+
+    def __str__(self):
+        return ":".join(filter(None, (self.category or "all",
+                                      self.severity)))
+
+def get_passes():
+    """Return the list of passes configured.
+    """
+    specs = config['zypper'].get('passes', "").split(",")
+    passes = [ PatchPass.parse(s) for s in specs if s.strip() ]
+    return passes or [PatchPass()]
+
+severity_order = ("critical", "important", "moderate", "low")
+
+def patch_urgency(patch):
+    """Return a sort key putting the most urgent patches first.
+    """
+    try:
+        severity = severity_order.index(patch.severity)
+    except ValueError:
+        severity = len(severity_order)
+    return (not patch.restart, patch.category != "security", severity)
+
+class PatchWorkflow:
+    """The workflow to install patches.
+
+    The workflow is a state machine.  Each state is implemented by a
+    method that returns the next state or None when done.  Results
+    from previous states are reused to skip redundant zypper calls.
+
+    The installation may be restricted to the patches selected by
+    patch_pass.  Unless final is True, the workflow is followed by
+    further passes and ends without checking for processes needing a
+    restart.  have_patches tells whether patches have been needed in
+    previous passes.  checked is the result of the patch-check that
+    verified the previous pass, if any, so that it need not be repeated
+    at the start of this one.  After the workflow, verified holds the
+    result of its own verification for the next pass.
+
+    If a maintenance window is given, the refresh and the installation
+    are deferred if they are predicted by durations not to end within
+    the window.
+    """
+
+    CHECK = "check"
+    LIST = "list"
+    INSTALL = "install"
+    RESTART = "restart-required"
+    VERIFY = "verify"
+    PS = "needs-restarting"
+    RESTART_SERVICES = "restart-services"
+
+    def __init__(self, zypper, stdout=None, status=None, patch_pass=None,
+                 final=True, have_patches=False, window=None,
+                 durations=None, checked=None):
+        self.zypper = zypper
+        self.stdout = stdout
+        self.status = status or RunStatus()
+        self.window = window
+        self.durations = durations or DurationModel()
+        self.patch_pass = patch_pass or PatchPass()
+        self.final = final
+        self.have_patches = have_patches
+        self.all_installed = False
+        self.checked = checked
+        self.verified = None
+        self.needed = None
+        self.patches = None
+        self._states = {
+            self.CHECK: self.check,
+            self.LIST: self.list,
+            self.INSTALL: self.install,
+            self.RESTART: self.restart,
+            self.VERIFY: self.verify,
+            self.PS: self.ps,
+            self.RESTART_SERVICES: self.restart_services,
+        }
+
+    def run(self):
+        """Run the workflow, return True if patches were needed.
+        """
+        if (refresh_pending(self.zypper) and
+            self.deferred("refresh", "refresh of the repositories")):
+            # Go on with the cached metadata.
+            self.zypper.no_refresh = True
+        refresh_repos(self.zypper, durations=self.durations,
+                      status=self.status, window=self.window)
+        if self.checked is None:
+            state = self.CHECK
+        else:
+            # Only use it once, a retry needs to check again.
+            state = self.checked_patches(self.checked)
+            self.checked = None
+        while state:
+            log.debug("workflow state: %s", state)
+            with log_timing(state):
+                state = self._states[state]()
+        return self.have_patches
+
+    def finish(self):
+        return self.PS if self.final else None
+
+    def predict(self, step, **sizes):
+        """Return the predicted duration of step, or None if there is
+        no window or no previous durations to predict it from.
+        """
+        if self.window is None:
+            return None
+        return self.durations.estimate(step, **sizes)
+
+    def defer(self, what, estimate, note=None):
+        """Note the deferral of what in the status.
+        """
+        reason = ("%s: predicted to take %.0f seconds, but only %.0f "
+                  "seconds left in the window ending at %s"
+                  % (what, estimate, max(self.window.remaining(), 0),
+                     self.window))
+        if note:
+            reason += ", %s" % note
+        log.warning("deferring %s", reason)
+        self.status.deferred.append(reason)
+
+    def deferred(self, step, what, **sizes):
+        """Return True if step is predicted not to end within the
+        maintenance window.  The deferral is noted in the status.
+
+        A step is not deferred if there are no previous durations to
+        predict it from.  Otherwise, a large backlog of patches would
+        never get installed on a host without history.
+        """
+        estimate = self.predict(step, **sizes)
+        if estimate is None or self.window.fits(estimate):
+            return False
+        self.defer(what, estimate)
+        return True
+
+    def fitting_patches(self, patches, sizes):
+        """Return the names of the most urgent of patches that are
+        predicted to fit into the window.
+
+        Patches for the package manager go first, as zypper insists,
+        then security patches, then by severity.  The sizes of the
+        installation of all patches are scaled down in proportion.
+        Unless patches have been installed already, the most urgent
+        patch is always included, so that each run makes progress and
+        the prediction learns from it.
+        """
+        candidates = sorted((p for p in patches if not p.interactive),
+                            key=patch_urgency)
+        count = len(patches)
+        names = []
+        progress = not self.status.installed_patches
+        for idx, p in enumerate(candidates, start=1):
+            scaled = { n: s * idx / count for n, s in sizes.items() }
+            estimate = self.predict("install", **scaled)
+            if not (progress and idx == 1 or self.window.fits(estimate)):
+                break
+            names.append(p.name)
+        return names
+
+    def _install(self, names, **kwargs):
+        """Call zypper to install the patches names or, if names is
+        None, all patches of the pass.
+        """
+        if names is None:
+            kwargs.update(self.patch_pass.filter)
+            return self.zypper.patch(stdout=self.stdout, **kwargs)
+        return self.zypper.install_patches(names, stdout=self.stdout,
+                                           **kwargs)
+
+    def install_sizes(self):
+        """Return the number of packages and the bytes to download
+        found by zypper in the last installation, download, or dry
+        run.
+        """
+        sizes = {}
+        if self.zypper.packages.packages is not None:
+            sizes['packages'] = self.zypper.packages.packages
+        if self.zypper.download.to_download is not None:
+            sizes['download'] = self.zypper.download.to_download
+        return sizes
+
+    def dry_run(self, names=None):
+        """Ask zypper what the installation would take, return the
+        sizes of the installation.
+        """
+        self.zypper.download.reset()
+        self.zypper.packages.reset()
+        try:
+            self._install(names, dry_run=True)
+        except (ZypperRebootNeeded, ZypperRestartNeeded):
+            # These are also raised by the installation that follows.
+            pass
+        return self.install_sizes()
+
+    def check(self):
+        return self.checked_patches(check_patches(self.zypper,
+                                                  stdout=self.stdout))
+
+    def checked_patches(self, needed):
+        """Go on after zypper patch-check told whether patches are
+        needed.
+        """
+        if not needed:
+            self.status.outstanding = {}
+            self.all_installed = True
+            # We may get here after a retry or in a later pass if
+            # patches have already been installed before.
+            return self.PS if self.have_patches else None
+        self.have_patches = True
+        if self.patch_pass.filtered:
+            self.needed = None
+        else:
+            self.needed = self.zypper.summary.patches
+        categories = dict(self.zypper.categories.categories)
+        if self.status.needed is None:
+            self.status.needed = categories
+        self.status.outstanding = categories
+        return self.LIST
+
+    def list(self):
+        self.zypper.patch_table.reset()
+        self.patches = self.zypper.list_patches(stdout=self.stdout,
+                                                **self.patch_pass.filter)
+        if not self.zypper.xmlout:
+            self.status.add_patches(self.zypper.patch_table.items)
+            return self.INSTALL
+        self.status.add_patches(self.patches)
+        if self.patch_pass.filtered:
+            if not self.patches:
+                log.info("no patches needed in pass %s", self.patch_pass)
+                return self.finish()
+            self.needed = len(self.patches)
+        if any(p.reboot for p in self.patches):
+            log.info("some needed patches require a reboot")
+        if all(p.interactive for p in self.patches):
+            log.info("only interactive patches needed, skipping installation")
+            return None
+        return self.INSTALL
+
+    def install(self):
+        if self.zypper.xmlout:
+            patches = self.patches
+        else:
+            patches = self.zypper.patch_table.items
+        count = len(patches)
+        what = "installation of %d patches" % count
+        if self.patch_pass.filtered:
+            what += " in pass %s" % self.patch_pass
+        sizes = { 'patches': count }
+        dry_run = (get_lease() is not None or
+                   (self.window is not None and
+                    self.durations.has_samples("install")))
+        if dry_run:
+            sizes.update(self.dry_run())
+        names = None
+        estimate = self.predict("install", **sizes)
+        if estimate is not None and not self.window.fits(estimate):
+            names = self.fitting_patches(patches, sizes)
+            note = None
+            if names:
+                note = ("installing only the %d most urgent of them"
+                        % len(names))
+            self.defer(what, estimate, note=note)
+            if not names:
+                return self.finish() if self.status.installed_patches else None
+        start = monotonic()
+        downloaded = self.download(names, all_cached=(
+            dry_run and self.zypper.download.all_cached))
+        self.zypper.download.reset()
+        self.zypper.packages.reset()
+        self.zypper.install.reset()
+        def done():
+            sizes = self.install_sizes()
+            if 'download' in sizes:
+                sizes['download'] += downloaded
+            self.durations.add("install", monotonic() - start,
+                               patches=len(self.zypper.install.names),
+                               **sizes)
+            self.status.installed_patches.extend(self.zypper.install.names)
+        try:
+            self._install(names)
+        except ZypperRebootNeeded:
+            self.status.reboot_required = True
+        except ZypperRestartNeeded:
+            done()
+            return self.RESTART
+        finally:
+            if self.zypper.reboot_hint.reboot_needed:
+                self.status.reboot_required = True
+        done()
+        log.info("patches successfully installed")
+        if self.zypper.download.all_cached:
+            log.info("all packages were taken from the package cache")
+        installed = self.zypper.install
+        if (self.needed is not None and installed.installed == self.needed
+            and not installed.skipped and not self.patch_pass.filtered):
+            log.debug("all needed patches installed, skip verification")
+            self.status.outstanding = {}
+            self.all_installed = True
+            return self.PS
+        return self.VERIFY
+
+    def download(self, names=None, all_cached=False):
+        """Download the packages of the patches names, or of all
+        patches of the pass if names is None, while holding a download
+        slot.  Return the bytes downloaded.
+
+        This is only done if a lease is configured, so that the slot
+        is held for the download, but not for the installation.  If a
+        dry run found all packages in the package cache, e.g. after a
+        prefetch, no slot is taken.
+        """
+        if get_lease() is None:
+            return 0
+        if all_cached:
+            log.info("all packages are in the package cache, "
+                     "no download slot needed")
+            return 0
+        self.zypper.download.reset()
+        download_only(self._install, names)
+        return self.zypper.download.to_download or 0
+
+    def restart(self):
+        log.info("patch requires restart to check again for more patches")
+        installed = self.zypper.install.installed
+        if self.patches is None or self.needed is None or installed is None:
+            return self.CHECK
+        # We know from the structured list of patches which have been
+        # installed: those affecting the package manager.
+        self.patches = [ p for p in self.patches if not p.restart ]
+        self.needed -= installed
+        if len(self.patches) != self.needed:
+            return self.CHECK
+        if not self.patches:
+            return self.finish()
+        return self.INSTALL
+
+    def verify(self):
+        self.verified = check_patches(self.zypper, stdout=self.stdout)
+        if not self.verified:
+            # Nothing left for later passes either.
+            self.status.outstanding = {}
+            self.all_installed = True
+            return self.PS
+        self.status.outstanding = dict(self.zypper.categories.categories)
+        return self.finish()
+
+    def ps(self):
+        if self.zypper.root:
+            # There are no processes running from another root that
+            # zypper could tell us about.
+            return None
+        try:
+            self.zypper.ps(stdout=self.stdout)
+        except ZypperRebootNeeded:
+            self.status.reboot_required = True
+            log.warning("reboot is required after installing patches")
+            return None
+        finally:
+            self.status.processes = self.zypper.processes
+        if self.zypper.processes and config['restart'].getboolean('services'):
+            return self.RESTART_SERVICES
+        return None
+
+    def restart_services(self):
+        self.status.restarts = restart_from_config(self.zypper.processes)
+        if not self.status.restarts:
+            return None
+        # Check which processes still use deleted files.
+        try:
+            self.zypper.ps(stdout=self.stdout)
+        except ZypperRebootNeeded:
+            self.status.reboot_required = True
+        finally:
+            self.status.processes = self.zypper.processes
+        return None
+
+def get_zypper(**kwargs):
+    """Return a Zypper object set up according to the configuration.
+    """
+    zypper_cfg = config['zypper']
+    timeouts = {}
+    for spec in zypper_cfg.get('timeouts').split(","):
+        if spec.strip():
+            cmd, _, seconds = spec.partition(":")
+            timeouts[cmd.strip()] = float(seconds)
+    return Zypper(path=zypper_cfg.get('path'),
+                  cache_dir=zypper_cfg.get('cache_dir'),
+                  tail_lines=config['mailreport'].getint('tail_lines'),
+                  backend=zypper_cfg.get('backend'),
+                  timeout=zypper_cfg.getfloat('timeout'),
+                  timeouts=timeouts,
+                  kill_timeout=zypper_cfg.getfloat('kill_timeout'),
+                  **kwargs)
+
+def patch(stdout=None, status=None, zypper=None):
+    """Install needed patches, return True if patches were needed.
+
+    A Zypper object to use may be passed in zypper, otherwise a new
+    one is created.
+    """
+    if zypper is None:
+        zypper = get_zypper(xmlout=config['zypper'].getboolean('xmlout'))
+    if status is None:
+        status = RunStatus()
+    status.zypper_calls = zypper.calls
+    window = get_window(status.start_time)
+    if window:
+        log.info("the maintenance window ends at %s", window)
+    durations = DurationModel(config['zypper'].get('cache_dir'))
+    lockfile = zypper.root_path(config['zypper'].get('lockfile'))
+    passes = get_passes()
+    have_patches = False
+    checked = None
+    try:
+        for idx, patch_pass in enumerate(passes, start=1):
+            if len(passes) > 1:
+                log.info("pass %d: %s", idx, patch_pass)
+                if stdout:
+                    stdout.write("\n=== Pass %d: %s ===\n\n"
+                                 % (idx, patch_pass))
+            workflow = PatchWorkflow(zypper, stdout=stdout, status=status,
+                                     patch_pass=patch_pass,
+                                     final=(idx == len(passes)),
+                                     have_patches=have_patches,
+                                     window=window, durations=durations,
+                                     checked=checked)
+            count = len(status.installed_patches)
+            try:
+                # Each pass gets its own budget of retries.
+                have_patches = retry(workflow.run, status=status,
+                                     window=window, lockfile=lockfile)
+            except ZypperExitException as err:
+                status.passes.append((str(patch_pass),
+                                      len(status.installed_patches) - count,
+                                      err))
+                raise
+            status.passes.append((str(patch_pass),
+                                  len(status.installed_patches) - count,
+                                  None))
+            if workflow.all_installed:
+                break
+            checked = workflow.verified
+        return have_patches
+    finally:
+        durations.save()
+        stats = ("zypper has been called %d times, taking %.1f seconds"
+                 % (zypper.call_count, zypper.call_time))
+        log.info(stats)
+        if stdout:
+            stdout.write("\n%s.\n" % stats)
+
+def refresh_stale(zypper):
+    """Refresh the repositories having metadata older than [check]
+    refresh_max_age seconds, if refresh is configured.  A failure to
+    refresh is not an error, the cached metadata are used instead.
+    """
+    max_age = config['check'].getfloat('refresh_max_age')
+    if max_age > 0 and refresh_pending(zypper):
+        with log_timing("refresh"):
+            try:
+                zypper.refresh(max_age=max_age)
+            except ZypperReposSkipped as err:
+                log.warning("%s: %s, using the cached metadata",
+                            err, ", ".join(zypper.skipped_repos.repos))
+    zypper.no_refresh = True
+
+def count_critical(zypper, stdout=None):
+    """Return the number of needed patches of severity critical that
+    are not security patches.
+    """
+    zypper.patch_table.reset()
+    patches = zypper.list_patches(stdout=stdout, severity="critical")
+    if not zypper.xmlout:
+        patches = zypper.patch_table.items
+    return sum(1 for p in patches if p.category != "security")
+
+def check(stdout=None, status=None, refresh=False, zypper=None):
+    """Check for needed patches, return the number of needed security
+    patches and patches of severity critical.
+
+    If refresh is True, the repositories are refreshed as at the start
+    of a run.  Otherwise only those having outdated metadata are, see
+    refresh_stale().  A Zypper object to use may be passed in zypper,
+    otherwise a new one is created.
+    """
+    if zypper is None:
+        zypper = get_zypper()
+    if status is not None:
+        status.zypper_calls = zypper.calls
+    if refresh:
+        refresh_repos(zypper, status=status)
+    else:
+        refresh_stale(zypper)
+    with log_timing("check"):
+        if check_patches(zypper, stdout=stdout):
+            categories = dict(zypper.categories.categories)
+            urgent = zypper.summary.security_patches or 0
+            # Only list the patches if some of them are not security
+            # patches and might be critical.
+            if (zypper.summary.patches or 0) > urgent:
+                urgent += count_critical(zypper, stdout=stdout)
+        else:
+            categories = {}
+            urgent = 0
+    if status is not None:
+        status.needed = categories
+        status.outstanding = dict(categories)
+    return urgent
+
+def check_state_path():
+    cache_dir = config['zypper'].get('cache_dir')
+    if not cache_dir:
+        return None
+    return os.path.join(cache_dir, "check.json")
+
+def read_check_state():
+    """Return the number of security and critical patches found in
+    the previous check or None if not known.
+    """
+    path = check_state_path()
+    if not path:
+        return None
+    try:
+        with open(path, "rt") as f:
+            state = json.load(f)
+        if 'urgent' in state:
+            return state['urgent']
+        # Older versions only counted the security patches.
+        return state['security']
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+def write_check_state(urgent):
+    path = check_state_path()
+    if not path:
+        return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with atomic_write(path) as f:
+            json.dump({ 'urgent': urgent }, f)
+    except OSError as err:
+        log.warning("cannot save the result of the check: %s", err)
+
+def prefetch(stdout=None, status=None):
+    """Download needed patches into the package cache, but do not
+    install them.
+    """
+    zypper = get_zypper()
+    if status is not None:
+        status.zypper_calls = zypper.calls
+
+    def workflow():
+        refresh_repos(zypper, status=status)
+        if not check_patches(zypper, stdout=stdout):
+            return False
+        if status is not None:
+            status.needed = dict(zypper.categories.categories)
+            status.outstanding = dict(status.needed)
+        download_only(zypper.patch, stdout=stdout)
+        log.info("patches successfully downloaded")
+        return True
+
+    return retry(workflow, status=status)
@@ -0,0 +1,385 @@
+"""Call zypper.
+"""
+
+from collections import deque
+import logging
+import os
+import subprocess
+import tempfile
+from time import monotonic, time
+
+from .cache import ProbeCache
+from .exception import (ZypperExitException, ZypperSignal,
+                        ZypperLibraryError, ZypperReposSkipped)
+from .log import log_timing
+from .parser import (PatchSummaryParser, PatchCategoryParser,
+                     RebootHintParser, DownloadSizeParser,
+                     PackageCountParser, InstallSummaryParser,
+                     PatchTableParser, ErrorParser, SkippedRepoParser,
+                     ProcessTableParser, XmlPatchParser, XmlRepoParser,
+                     format_patches)
+from .watchdog import watchdog
+
+
+log = logging.getLogger(__name__)
+output_log = log.getChild("output")
+
+
+class CallRecord:
+    """The record of one zypper call.
+
+    If the call failed, tail holds the last lines of its output,
+    followed by the standard error.
+    """
+    __slots__ = ('start', 'command', 'returncode', 'duration', 'tail')
+
+    def __init__(self, start, command, returncode=None, duration=None,
+                 tail=None):
+        self.start = start
+        self.command = command
+        self.returncode = returncode
+        self.duration = duration
+        self.tail = tail
+
+    def __repr__(self):
+        return "<%s %s (%s)>" % (type(self).__name__,
+                                 self.command, self.returncode)
+
+class Zypper:
+    """Call zypper and parse its output.
+
+    The zypper process is either run by the subprocess backend,
+    reading its output in a plain loop, or by the asyncio backend.
+    The latter supports timeouts: a call taking longer than timeout
+    seconds, or than the time set for the subcommand in timeouts, is
+    terminated with SIGTERM and, if it did not exit within
+    kill_timeout seconds, killed with SIGKILL.  Such a call fails with
+    ZypperSignal.
+
+    If root is set, zypper operates on the system in that directory
+    rather than on the running system.
+    """
+
+    _zypper = "/usr/bin/zypper"
+    _raw_cache_dir = "/var/cache/zypp/raw"
+
+    # Maximum length of a line of output in the asyncio backend.
+    line_limit = 1048576
+
+    def __init__(self, xmlout=False, path=None, cache_dir=None,
+                 tail_lines=20, backend="subprocess", timeout=0,
+                 timeouts=None, kill_timeout=30, root=None):
+        if path:
+            self._zypper = path
+        self.root = root
+        if backend not in ("subprocess", "asyncio"):
+            raise ValueError("invalid backend '%s'" % backend)
+        self.backend = backend
+        self.timeout = timeout
+        self.timeouts = timeouts or {}
+        self.kill_timeout = kill_timeout
+        if cache_dir:
+            self.probe_cache = ProbeCache(cache_dir, self._zypper)
+        else:
+            self.probe_cache = None
+        self.xmlout = xmlout
+        self.tail_lines = tail_lines
+        self.line_parsers = []
+        self.summary = PatchSummaryParser()
+        self.categories = PatchCategoryParser()
+        self.reboot_hint = RebootHintParser()
+        self.download = DownloadSizeParser()
+        self.packages = PackageCountParser()
+        self.install = InstallSummaryParser()
+        self.patch_table = PatchTableParser()
+        self.errors = ErrorParser()
+        self.skipped_repos = SkippedRepoParser()
+        for parser in (self.summary, self.categories, self.reboot_hint,
+                       self.download, self.packages, self.install,
+                       self.patch_table, self.errors, self.skipped_repos):
+            self.add_line_parser(parser)
+        self.reset()
+        log.debug("zypper %s", self.version_string)
+
+    def reset(self):
+        """Forget the calls made so far.
+
+        This allows to reuse the object for another run, keeping the
+        results of the capability probes.
+        """
+        self.no_refresh = False
+        self.processes = []
+        self.call_count = 0
+        self.call_time = 0.0
+        self.calls = []
+
+    def add_line_parser(self, parser):
+        """Register a parser to be fed with the output of zypper.
+        """
+        self.line_parsers.append(parser)
+
+    def call(self, args, stdout=None, parsers=(), capture=True):
+        """Run zypper with args.
+
+        The standard output of zypper is consumed line by line as it
+        is produced.  Each line is written to stdout if given, logged
+        at level DEBUG, and fed to all registered line parsers as well
+        as to the extra parsers passed for this call.  If stdout is
+        None, the output is collected and returned, unless capture is
+        False.  The error messages found in the output of a call that
+        failed are added to the message of the exception raised.
+        """
+        cmd = [self._zypper] + args
+        if self.no_refresh:
+            cmd.insert(1, "--no-refresh")
+        if self.root:
+            cmd[1:1] = ["--root", self.root]
+        log.debug("run: %s", " ".join(cmd))
+        output = [] if capture and not stdout else None
+        parsers = self.line_parsers + list(parsers)
+        subcmd = next((a for a in args if not a.startswith("-")), args[0])
+        self.errors.reset()
+        self.call_count += 1
+        record = CallRecord(time(), subcmd)
+        self.calls.append(record)
+        tail = deque(maxlen=self.tail_lines)
+        def handle_line(line):
+            if stdout:
+                stdout.write(line)
+            elif output is not None:
+                output.append(line)
+            output_log.debug(line.rstrip("\n"))
+            tail.append(line)
+            for parser in parsers:
+                parser.feed(line)
+        start = monotonic()
+        with log_timing("zypper", zypper_cmd=subcmd) as fields, \
+             tempfile.TemporaryFile(mode='w+t') as errf:
+            if self.backend == "asyncio":
+                timeout = self.timeouts.get(subcmd, self.timeout)
+                returncode = self._run_asyncio(cmd, handle_line, errf,
+                                               timeout)
+                if returncode is None:
+                    log.error("zypper %s did not finish within %d seconds "
+                              "and could not be terminated", subcmd, timeout)
+                    returncode = ZypperSignal.ExitCode
+            else:
+                returncode = self._run_subprocess(cmd, handle_line, errf)
+            if returncode < 0:
+                log.error("zypper %s has been killed by signal %d",
+                          subcmd, -returncode)
+                returncode = ZypperSignal.ExitCode
+            fields['zypper_rc'] = record.returncode = returncode
+            errf.seek(0)
+            stderr = errf.read()
+            if returncode:
+                tail.extend(stderr.splitlines(keepends=True))
+                record.tail = list(tail)
+                for line in stderr.splitlines():
+                    self.errors.feed(line)
+        record.duration = monotonic() - start
+        self.call_time += record.duration
+        watchdog.keepalive()
+        if output is not None:
+            output = "".join(output)
+        proc = subprocess.CompletedProcess(cmd, returncode, output, stderr)
+        log.debug("return code from zypper: %d", proc.returncode)
+        try:
+            ZypperExitException.check_returncode(proc)
+        except ZypperExitException as err:
+            if self.errors.messages:
+                err.Message += ": %s" % "; ".join(self.errors.messages)
+            raise
+        return proc.stdout
+
+    def _run_subprocess(self, cmd, handle_line, errf):
+        """Run cmd, feed its output to handle_line() and write its
+        standard error to errf.  Return the exit code.
+        """
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errf,
+                              universal_newlines=True) as proc:
+            for line in proc.stdout:
+                handle_line(line)
+                watchdog.keepalive()
+        return proc.returncode
+
+    def _run_asyncio(self, cmd, handle_line, errf, timeout=0):
+        """Run cmd, feed its output to handle_line() and write its
+        standard error to errf.  Return the exit code or None if cmd
+        could not be terminated after timeout seconds.
+        """
+        from .aioproc import run_process
+        return run_process(cmd, handle_line, errf, timeout=timeout,
+                           kill_timeout=self.kill_timeout,
+                           line_limit=self.line_limit)
+
+    def root_path(self, path):
+        """Return the path of the file path in the target root.
+        """
+        if self.root:
+            return os.path.join(self.root, path.lstrip("/"))
+        return path
+
+    def probe(self, name, func):
+        """Return the result of the capability probe func().
+
+        The result is cached across runs under name if a cache
+        directory has been configured.
+        """
+        if self.probe_cache:
+            return self.probe_cache.get(name, func)
+        else:
+            return func()
+
+    def _probe_version(self):
+        pname, vstr = self.call(["--version"]).strip().split()
+        assert pname == "zypper"
+        return vstr
+
+    @property
+    def version_string(self):
+        try:
+            return self._version_string
+        except AttributeError:
+            self._version_string = self.probe('version', self._probe_version)
+            return self._version_string
+
+    @property
+    def version(self):
+        from packaging.version import Version
+        try:
+            return self._version
+        except AttributeError:
+            self._version = Version(self.version_string)
+            return self._version
+
+    def repos(self):
+        """Return the list of repositories.
+        """
+        parser = XmlRepoParser()
+        args = ["--quiet", "--xmlout", "repos"]
+        self.call(args, parsers=[parser], capture=False)
+        return parser.items
+
+    def metadata_age(self, repo):
+        """Return the age of the cached metadata of repo in seconds or
+        None if there are no cached metadata.
+        """
+        path = os.path.join(self.root_path(self._raw_cache_dir), repo.alias)
+        try:
+            return time() - os.stat(path).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def refresh(self, max_age=0, stdout=None, repos=None):
+        """Refresh the repositories.
+
+        If repos is given, only those are refreshed.  Otherwise, if
+        max_age is positive, only enabled repositories having metadata
+        older than max_age seconds are refreshed.  All subsequent
+        zypper calls will be issued with --no-refresh.  The
+        repositories skipped because they failed to refresh are noted
+        in skipped_repos.
+
+        Unlike the implicit refresh of other commands, zypper refresh
+        exits with ZYPPER_EXIT_ERR_ZYPP if some repositories failed and
+        reports them on standard error.  This is raised as
+        ZypperReposSkipped, so that it is retried like the former.
+        """
+        self.skipped_repos.reset()
+        args = ["--quiet", "--non-interactive", "refresh"]
+        if repos:
+            args.extend(repos)
+        elif max_age > 0:
+            stale = []
+            for repo in self.repos():
+                if not repo.enabled:
+                    continue
+                age = self.metadata_age(repo)
+                if age is None or age > max_age:
+                    stale.append(repo.alias)
+            if not stale:
+                log.debug("metadata of all repositories are up to date")
+                self.no_refresh = True
+                return
+            log.debug("refresh repositories %s", ", ".join(stale))
+            args.extend(stale)
+        try:
+            self.call(args, stdout=stdout, capture=False)
+        except ZypperLibraryError as err:
+            for line in (err.stderr or "").splitlines():
+                self.skipped_repos.feed(line)
+            if not self.skipped_repos.repos:
+                raise
+            raise ZypperReposSkipped(err.cmd, err.stdout,
+                                     err.stderr) from None
+        self.no_refresh = True
+
+    def patch_check(self, stdout=None):
+        args = ["--quiet", "--non-interactive", "patch-check"]
+        return self.call(args, stdout=stdout)
+
+    @staticmethod
+    def _filter_args(category=None, severity=None):
+        args = []
+        if category:
+            args.extend(["--category", category])
+        if severity:
+            args.extend(["--severity", severity])
+        return args
+
+    def list_patches(self, stdout=None, category=None, severity=None):
+        """List needed patches, optionally restricted to category and
+        severity.
+
+        In xmlout mode, the XML output of zypper is parsed and a list
+        of Patch objects is returned.  A table of the patches is
+        written to stdout if given.
+        """
+        args = ["--quiet", "--non-interactive", "list-patches"]
+        args.extend(self._filter_args(category, severity))
+        if not self.xmlout:
+            return self.call(args, stdout=stdout)
+        parser = XmlPatchParser()
+        self.call(["--xmlout"] + args, parsers=[parser], capture=False)
+        if stdout:
+            stdout.write("\n" + format_patches(parser.items) + "\n")
+        return parser.items
+
+    def patch(self, stdout=None, download_only=False, dry_run=False,
+              category=None, severity=None):
+        from packaging.version import Version
+        args = ["--quiet", "--non-interactive", "patch", "--skip-interactive"]
+        if self.version >= Version("1.14.69"):
+            args.append("--skip-not-applicable-patches")
+        if download_only:
+            args.append("--download-only")
+        if dry_run:
+            args.append("--dry-run")
+        args.extend(self._filter_args(category, severity))
+        return self.call(args, stdout=stdout)
+
+    def install_patches(self, names, stdout=None, download_only=False,
+                        dry_run=False):
+        """Install the patches names, rather than all needed patches.
+        """
+        args = ["--quiet", "--non-interactive", "install"]
+        if download_only:
+            args.append("--download-only")
+        if dry_run:
+            args.append("--dry-run")
+        args.extend("patch:%s" % n for n in names)
+        return self.call(args, stdout=stdout)
+
+    def ps(self, stdout=None):
+        """List the processes using deleted files.
+
+        The processes are parsed into a list of Process objects in
+        processes.
+        """
+        parser = ProcessTableParser()
+        args = ["--quiet", "ps", "-s"]
+        try:
+            return self.call(args, stdout=stdout, parsers=[parser])
+        finally:
+            self.processes = parser.items
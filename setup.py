@@ -123,7 +123,7 @@ setup(
     ),
     python_requires = ">=3.6",
     install_requires = ["setuptools", "packaging", "systemd-python"],
-    packages = [],
+    packages = ["auto_patch"],
     py_modules = [],
     scripts = ["scripts/auto-patch.py"],
     cmdclass = dict(cmdclass, sdist=sdist, meta=meta),
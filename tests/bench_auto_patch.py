@@ -0,0 +1,238 @@
+"""Benchmark auto-patch end to end using a stand-in for zypper.
+
+Run auto-patch.py as a separate process for some scenarios from
+zypper-result-data.json, with fake-zypper.py replacing the zypper
+binary, and report wall time, CPU time, and peak RSS.  The CPU time
+used by the zypper stand-in is not included.  Note that the peak RSS
+reported by the kernel is the maximum over auto-patch and its child
+processes, but the stand-in is much smaller than auto-patch.
+
+With --startup, measure the time to start auto-patch instead: the
+time to import the auto_patch package and to run auto-patch --help,
+each compared to starting a bare Python interpreter.
+
+Usage example:
+
+    python3 tests/bench_auto_patch.py --latency 0.5 --volume 10000 \\
+        sec_patches zypp_patches
+    python3 tests/bench_auto_patch.py --startup --repeat 20
+"""
+
+import argparse
+from configparser import ConfigParser
+import json
+import os
+from pathlib import Path
+import subprocess
+import sys
+import tempfile
+import time
+
+
+test_dir = Path(__file__).resolve().parent
+fake_zypper_path = test_dir / "fake-zypper.py"
+
+def get_auto_patch_path():
+    try:
+        return Path(os.environ['BUILD_SCRIPTS_DIR'], "auto-patch.py")
+    except KeyError:
+        return test_dir.parent / "scripts" / "auto-patch.py"
+
+def get_env(**kwargs):
+    """Return the environment for auto-patch.
+    When not running from the build directory, add the source
+    directory to the Python path.
+    """
+    env = dict(os.environ, **kwargs)
+    if 'BUILD_SCRIPTS_DIR' not in env:
+        path = [ str(test_dir.parent) ]
+        if env.get('PYTHONPATH'):
+            path.append(env['PYTHONPATH'])
+        env['PYTHONPATH'] = os.pathsep.join(path)
+    return env
+
+def get_scenarios():
+    with (test_dir / "zypper-result-data.json").open("rt") as f:
+        return json.load(f)
+
+# Some scenarios need a particular configuration or command line
+# arguments, as set in the corresponding tests.
+retry_config = { 'retry': { 'max': "10" } }
+xmlout_config = { 'zypper': { 'xmlout': "on" } }
+scenario_settings = {
+    'locked_start': (retry_config, []),
+    'locked_between': (retry_config, []),
+    'locked_final': (retry_config, []),
+    'locked_complete': (retry_config, []),
+    'no_net_start': (retry_config, []),
+    'no_net_complete': (retry_config, []),
+    'sec_patches_xml': (xmlout_config, []),
+    'interactive_xml': (xmlout_config, []),
+    'zypp_patches_xml': (xmlout_config, []),
+    'refresh_max_age': ({ 'zypper': { 'refresh_max_age': "3600" } }, []),
+    'prefetch_no_patches': (None, ["--prefetch"]),
+    'prefetch_sec_patches': (None, ["--prefetch"]),
+}
+
+lock_holder_code = """
+import os, sys, time
+with open(sys.argv[1], "wt") as f:
+    f.write("%d\\n" % os.getpid())
+time.sleep(float(sys.argv[2]))
+with open(sys.argv[1], "wt"):
+    pass
+"""
+
+class BenchResult:
+    """The outcome of running auto-patch for one scenario.
+    """
+    def __init__(self, scenario, exitcode, wall, cpu, maxrss, zypper_calls):
+        self.scenario = scenario
+        self.exitcode = exitcode
+        self.wall = wall
+        self.cpu = cpu
+        self.maxrss = maxrss
+        self.zypper_calls = zypper_calls
+
+def run_scenario(workdir, scenario, results, latency=0.0, volume=0,
+                 lock_hold=0.0, config=None, args=(), hang=None):
+    """Run auto-patch once with the stand-in zypper replaying results.
+    """
+    workdir = Path(workdir)
+    datafile = workdir / "zypper-data.json"
+    statefile = workdir / "zypper-state"
+    statsfile = workdir / "zypper-stats"
+    lockfile = workdir / "zypp.pid"
+    zypper = workdir / "zypper"
+    cfgfile = workdir / "auto-patch.cfg"
+    for p in (statefile, statsfile, lockfile):
+        if p.exists():
+            p.unlink()
+    with datafile.open("wt") as f:
+        json.dump(results, f)
+    with zypper.open("wt") as f:
+        f.write('#! /bin/sh\nexec "%s" "%s" "$@"\n'
+                % (sys.executable, fake_zypper_path))
+    zypper.chmod(0o755)
+    lockfile.touch()
+    cp = ConfigParser()
+    cp['mailreport'] = { 'report': "off" }
+    cp['zypper'] = { 'path': str(zypper), 'lockfile': str(lockfile),
+                     'cache_dir': str(workdir / "cache") }
+    cp['retry'] = { 'wait': "0.1", 'max_wait': "1" }
+    cp['metrics'] = { 'directory': str(workdir) }
+    for k, v in (config or {}).items():
+        if not cp.has_section(k):
+            cp.add_section(k)
+        cp[k].update(v)
+    with cfgfile.open("wt") as f:
+        cp.write(f)
+    env = get_env(AUTO_PATCH_CFG=str(cfgfile),
+                  FAKE_ZYPPER_DATA=str(datafile),
+                  FAKE_ZYPPER_STATE=str(statefile),
+                  FAKE_ZYPPER_STATS=str(statsfile),
+                  FAKE_ZYPPER_LOCKFILE=str(lockfile),
+                  FAKE_ZYPPER_LATENCY=str(latency),
+                  FAKE_ZYPPER_VOLUME=str(volume))
+    if hang:
+        env['FAKE_ZYPPER_HANG'] = hang
+    holder = None
+    if lock_hold > 0:
+        holder = subprocess.Popen([sys.executable, "-c", lock_holder_code,
+                                   str(lockfile), str(lock_hold)])
+        while lockfile.read_text().strip() != str(holder.pid):
+            time.sleep(0.01)
+    try:
+        start = time.monotonic()
+        cmd = [sys.executable, str(get_auto_patch_path())] + list(args)
+        proc = subprocess.Popen(cmd, cwd=str(workdir), env=env,
+                                stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL)
+        _, status, rusage = os.wait4(proc.pid, 0)
+        wall = time.monotonic() - start
+    finally:
+        if holder:
+            holder.wait()
+    if os.WIFEXITED(status):
+        proc.returncode = os.WEXITSTATUS(status)
+    else:
+        proc.returncode = -os.WTERMSIG(status)
+    zypper_cpu = []
+    if statsfile.exists():
+        with statsfile.open("rt") as f:
+            zypper_cpu = [ float(l) for l in f ]
+    cpu = rusage.ru_utime + rusage.ru_stime - sum(zypper_cpu)
+    maxrss = rusage.ru_maxrss * 1024
+    return BenchResult(scenario, proc.returncode, wall, cpu, maxrss,
+                       len(zypper_cpu))
+
+def time_command(cmd, repeat, env=None):
+    """Return the minimal wall time of running cmd repeat times.
+    """
+    times = []
+    for i in range(repeat):
+        start = time.monotonic()
+        subprocess.run(cmd, env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.monotonic() - start)
+    return min(times)
+
+def bench_startup(repeat):
+    """Measure the startup time of auto-patch.
+    """
+    env = get_env(AUTO_PATCH_CFG=os.devnull)
+    python = [sys.executable]
+    base = time_command(python + ["-c", "pass"], repeat, env=env)
+    print("%-24s %9s %9s" % ("startup", "wall [s]", "extra [s]"))
+    print("%-24s %9.3f" % ("python", base))
+    cmds = [
+        ("import auto_patch.main", python + ["-c", "import auto_patch.main"]),
+        ("auto-patch --help", python + [str(get_auto_patch_path()), "--help"]),
+    ]
+    for name, cmd in cmds:
+        t = time_command(cmd, repeat, env=env)
+        print("%-24s %9.3f %9.3f" % (name, t, t - base))
+
+def main():
+    argparser = argparse.ArgumentParser(description=("Benchmark auto-patch "
+                                                     "with a fake zypper"))
+    argparser.add_argument('--latency', type=float, default=0.0,
+                           help="seconds to sleep in each zypper call")
+    argparser.add_argument('--volume', type=int, default=0,
+                           help="extra lines of output per zypper call")
+    argparser.add_argument('--lock-hold', type=float, default=0.0,
+                           help=("hold the ZYPP lock for this many seconds "
+                                 "at the start"))
+    argparser.add_argument('--repeat', type=int, default=1,
+                           help="number of runs per scenario")
+    argparser.add_argument('--startup', action='store_true',
+                           help="measure the startup time of auto-patch")
+    argparser.add_argument('scenario', nargs='*',
+                           help="scenarios to run, default all")
+    args = argparser.parse_args()
+    if args.startup:
+        bench_startup(args.repeat)
+        return
+    scenarios = get_scenarios()
+    names = args.scenario or sorted(scenarios.keys())
+    print("%-24s %4s %6s %9s %9s %11s"
+          % ("scenario", "exit", "calls", "wall [s]", "cpu [s]", "rss [MiB]"))
+    for name in names:
+        config, cmdargs = scenario_settings.get(name, (None, []))
+        runs = []
+        for i in range(args.repeat):
+            with tempfile.TemporaryDirectory(prefix="auto-patch-bench-") as d:
+                runs.append(run_scenario(d, name, scenarios[name],
+                                         latency=args.latency,
+                                         volume=args.volume,
+                                         lock_hold=args.lock_hold,
+                                         config=config, args=cmdargs))
+        wall = sum(r.wall for r in runs) / len(runs)
+        cpu = sum(r.cpu for r in runs) / len(runs)
+        maxrss = max(r.maxrss for r in runs)
+        print("%-24s %4d %6d %9.3f %9.3f %11.1f"
+              % (name, runs[-1].exitcode, runs[-1].zypper_calls,
+                 wall, cpu, maxrss / 1048576))
+
+if __name__ == "__main__":
+    main()
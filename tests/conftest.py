@@ -1,6 +1,8 @@
 import argparse
 from configparser import ConfigParser
 import contextlib
+import gzip
+import io
 import json
 from multiprocessing import Process
 import os
@@ -21,34 +23,65 @@ def get_zypper_argument_parser():
     parser.add_argument('--version', action='store_true')
     parser.add_argument('--quiet', action='store_true')
     parser.add_argument('--non-interactive', action='store_true')
+    parser.add_argument('--no-refresh', action='store_true')
+    parser.add_argument('--xmlout', action='store_true')
     parser.add_argument('subcmd', nargs='?')
+    parser.add_argument('repos', nargs='*')
     parser.add_argument('--skip-interactive', action='store_true')
     parser.add_argument('--skip-not-applicable-patches', action='store_true')
+    parser.add_argument('--download-only', action='store_true')
+    parser.add_argument('--dry-run', action='store_true')
+    parser.add_argument('--category')
+    parser.add_argument('--severity')
+    parser.add_argument('--root')
+    parser.add_argument('-s', '--short', action='count')
     return parser
 
 zypper_arg_parser = get_zypper_argument_parser()
 
-class mock_subprocess_run:
-    """A mock replacement for subprocess.run.
-    It fakes all invocations of the zypper binary.
+class mock_subprocess_popen:
+    """A mock replacement for subprocess.Popen.
+    It fakes all invocations of the zypper binary, other commands are
+    run by the real subprocess.Popen.
     """
     def __init__(self, results):
         self.results_iter = iter(results)
+        self.popen = subprocess.Popen
 
-    def __call__(self, cmd, stdout=None, **kwargs):
+    def __call__(self, cmd, stdout=None, stderr=None, **kwargs):
+        if Path(cmd[0]).name != "zypper":
+            return self.popen(cmd, stdout=stdout, stderr=stderr, **kwargs)
         zypp_res = next(self.results_iter)
-        assert Path(cmd[0]).name == "zypper"
         args = zypper_arg_parser.parse_args(args=cmd[1:])
         assert (args.version or args.subcmd) and (args.subcmd == zypp_res.cmd)
+        for flag in zypp_res.flags:
+            assert flag in cmd
+        return MockPopen(cmd, zypp_res, stdout, stderr)
+
+class MockPopen(contextlib.AbstractContextManager):
+    """A fake process object as returned by mock_subprocess_popen.
+    """
+    def __init__(self, cmd, zypp_res, stdout, stderr):
+        self.args = cmd
+        self.returncode = None
+        self._zypp_res = zypp_res
         if stdout == subprocess.PIPE:
-            proc = subprocess.CompletedProcess(cmd, zypp_res.returncode,
-                                               stdout=zypp_res.stdout,
-                                               stderr=zypp_res.stderr)
+            self.stdout = io.StringIO(zypp_res.stdout)
         else:
             stdout.write(zypp_res.stdout)
-            proc = subprocess.CompletedProcess(cmd, zypp_res.returncode,
-                                               stderr=zypp_res.stderr)
-        return proc
+            self.stdout = None
+        if stderr == subprocess.PIPE:
+            self.stderr = io.StringIO(zypp_res.stderr)
+        else:
+            stderr.write(zypp_res.stderr)
+            self.stderr = None
+
+    def __exit__(self, *args):
+        self.wait()
+
+    def wait(self, timeout=None):
+        self.returncode = self._zypp_res.returncode
+        return self.returncode
 
 class mock_smtp(contextlib.AbstractContextManager):
     """A mock replacement for smtplib.SMTP.
@@ -65,26 +98,51 @@ class mock_smtp(contextlib.AbstractContextManager):
             pickle.dump(self.host, f)
             pickle.dump(msg, f)
 
-def invoke_auto_patch(zypper_results):
+def invoke_auto_patch(zypper_results, args):
     """Patch the current Python intepreter and execute auto-patch.py.
     This function is supposed to be the target of a Process.
     """
     import subprocess
+    import sys
+    sys.argv = [str(auto_patch_path)] + list(args)
     import smtplib
-    subprocess.run = mock_subprocess_run(zypper_results)
+    subprocess.Popen = mock_subprocess_popen(zypper_results)
     smtplib.SMTP = mock_smtp
+    # The mock replacement of subprocess.Popen only works with the
+    # subprocess backend.
+    from auto_patch.config import config
+    config['zypper']['backend'] = "subprocess"
+    # The tests using the default configuration file must not touch
+    # the real cache either.  A cache_dir from _create_config() still
+    # takes precedence.
+    config['zypper']['cache_dir'] = str(Path("cache").resolve())
     with auto_patch_path.open("rt") as script:
         exec(script.read(), dict(__name__="__main__"))
 
+def get_report_body(msg):
+    """Return the body of the mail report.
+    """
+    return msg.get_body(preferencelist=('plain',)).get_content()
+
+def get_report_log(msg):
+    """Return the full log attached to the mail report.
+    """
+    for part in msg.iter_attachments():
+        if part.get_filename() == "auto-patch.log.gz":
+            return gzip.decompress(part.get_content()).decode("utf-8")
+    raise LookupError("no log attached to the report")
+
 class ZypperResult:
     """Represent the result of one mock zypper call in AutoPatchCaller.
     """
-    def __init__(self, cmd, returncode=0, stdout="", stderr="", capture=True):
+    def __init__(self, cmd, returncode=0, stdout="", stderr="", capture=True,
+                 flags=()):
         self.cmd = cmd
         self.returncode = returncode
         self.stdout = stdout
         self.stderr = stderr
         self.capture = capture
+        self.flags = flags
 
 class AutoPatchCaller:
     """Execute the auto-patch.py script in a prepared Python interpreter.
@@ -111,10 +169,14 @@ class AutoPatchCaller:
         return cls(zypper_results, config)
 
     def _create_config(self, config):
-        d = { 'mailreport': {}, 'retry': {}, 'logging': {} }
+        # Keep the cache of the tests in the current directory, which
+        # is a per-test tmpdir, rather than in /var/cache/auto-patch.
+        d = { 'mailreport': {}, 'zypper': { 'cache_dir': str(Path("cache")
+                                                            .resolve()) },
+              'retry': {}, 'logging': {} }
         if config is not None:
             for k in config.keys():
-                d[k].update(config[k])
+                d.setdefault(k, {}).update(config[k])
         cp = ConfigParser()
         for k, v in d.items():
             cp[k] = v
@@ -125,17 +187,30 @@ class AutoPatchCaller:
         self._create_config(config)
         self.zypper_results = zypper_results
 
-    def run(self, exitcode=0):
-        p = Process(target=invoke_auto_patch, args=(self.zypper_results,))
+    def run(self, exitcode=0, args=()):
+        p = Process(target=invoke_auto_patch,
+                    args=(self.zypper_results, args))
         p.start()
         p.join()
         assert p.exitcode == exitcode
 
-    def check_report(self, extra_msg=None):
+    @staticmethod
+    def get_report():
+        """Return the mailhost and the message of the report sent.
+        """
         with open("report.pickle", "rb") as f:
             host = pickle.load(f)
             msg = pickle.load(f)
-        body = msg.get_content()
+        return host, msg
+
+    def check_report(self, extra_msg=None):
+        """Check the report sent.
+
+        The full log attached to the report must contain the output
+        of all zypper calls and extra_msg if given.
+        """
+        host, msg = self.get_report()
+        body = get_report_log(msg)
         idx = 0
         for res in self.zypper_results:
             if not res.capture:
@@ -0,0 +1,122 @@
+#! python
+"""A stand-in for zypper replaying prepared results.
+
+This script is used in place of the zypper binary to run auto-patch
+end to end without touching the system.  It is controlled by
+environment variables:
+
+FAKE_ZYPPER_DATA
+    JSON file containing a list of results in the format of
+    zypper-result-data.json.  Each call consumes the next result.
+
+FAKE_ZYPPER_STATE
+    File to keep track of the results already consumed.
+
+FAKE_ZYPPER_LATENCY
+    Seconds to sleep in each call, default 0.
+
+FAKE_ZYPPER_VOLUME
+    Number of extra lines of output to emit in each call before the
+    actual output, default 0.  Not applied to calls with --xmlout.
+
+FAKE_ZYPPER_LOCKFILE
+    If set, behave like the ZYPP lock: fail with exit code 7 without
+    consuming a result if another live process is recorded in this
+    file, otherwise record our own pid for the duration of the call.
+
+FAKE_ZYPPER_STATS
+    If set, append the CPU time used by each call to this file.
+
+FAKE_ZYPPER_HANG
+    If set to a subcommand, hang in the call of that subcommand,
+    ignoring SIGTERM, rather than returning the result.
+"""
+
+import json
+import os
+import resource
+import signal
+import sys
+import time
+
+
+lock_msg = ("System management is locked by the application "
+            "with pid %d (zypper).\n"
+            "Close this application before trying again.\n")
+
+def lock_holder(lockfile):
+    try:
+        with open(lockfile, "rt") as f:
+            pid = int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return None
+    except PermissionError:
+        pass
+    return pid
+
+def next_result(datafile, statefile):
+    with open(datafile, "rt") as f:
+        results = json.load(f)
+    try:
+        with open(statefile, "rt") as f:
+            idx = int(f.read().strip())
+    except FileNotFoundError:
+        idx = 0
+    with open(statefile, "wt") as f:
+        f.write("%d\n" % (idx + 1))
+    try:
+        return results[idx]
+    except IndexError:
+        return None
+
+def record_stats(statsfile):
+    ru = resource.getrusage(resource.RUSAGE_SELF)
+    with open(statsfile, "at") as f:
+        f.write("%f\n" % (ru.ru_utime + ru.ru_stime))
+
+def main(args):
+    env = os.environ
+    subcmd = next((a for a in args if not a.startswith("-")), None)
+    lockfile = env.get('FAKE_ZYPPER_LOCKFILE')
+    if lockfile and subcmd:
+        pid = lock_holder(lockfile)
+        if pid is not None and pid != os.getpid():
+            sys.stderr.write(lock_msg % pid)
+            return 7
+        with open(lockfile, "wt") as f:
+            f.write("%d\n" % os.getpid())
+    try:
+        res = next_result(env['FAKE_ZYPPER_DATA'], env['FAKE_ZYPPER_STATE'])
+        if res is None:
+            sys.stderr.write("fake-zypper: unexpected call %s\n" % subcmd)
+            return 2
+        if res.get('cmd') != subcmd:
+            sys.stderr.write("fake-zypper: expected %s, got %s\n"
+                             % (res.get('cmd'), subcmd))
+            return 2
+        time.sleep(float(env.get('FAKE_ZYPPER_LATENCY', 0)))
+        if subcmd and subcmd == env.get('FAKE_ZYPPER_HANG'):
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+            sys.stdout.write("Hanging in %s\n" % subcmd)
+            sys.stdout.flush()
+            time.sleep(3600)
+        if subcmd and "--xmlout" not in args:
+            for i in range(int(env.get('FAKE_ZYPPER_VOLUME', 0))):
+                sys.stdout.write("Retrieving: package-%d-1.0-1.1.x86_64.rpm "
+                                 "................[done]\n" % i)
+        sys.stdout.write(res.get('stdout', ""))
+        sys.stderr.write(res.get('stderr', ""))
+        return res.get('returncode', 0)
+    finally:
+        if lockfile and subcmd:
+            with open(lockfile, "wt"):
+                pass
+        if env.get('FAKE_ZYPPER_STATS'):
+            record_stats(env['FAKE_ZYPPER_STATS'])
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,46 @@
+"""Test caching the version of zypper across runs.
+"""
+
+import json
+from pathlib import Path
+import pytest
+from conftest import AutoPatchCaller
+
+
+def get_config(tmpdir):
+    zypper = Path(str(tmpdir), "zypper")
+    zypper.write_text("#! /bin/sh\n")
+    cache_dir = Path(str(tmpdir), "cache")
+    cfg = { 'zypper': { 'path': str(zypper), 'cache_dir': str(cache_dir) } }
+    return zypper, cache_dir, cfg
+
+def test_version_cached(tmpdir):
+    """The version of zypper is only probed in the first run.
+    """
+    with tmpdir.as_cwd():
+        zypper, cache_dir, cfg = get_config(tmpdir)
+        caller = AutoPatchCaller.get_caller("sec_patches", config=cfg)
+        caller.run()
+        caller.check_report()
+        with (cache_dir / "probes.json").open("rt") as f:
+            probes = json.load(f)
+        assert probes[str(zypper)]['probes'] == { 'version': "1.14.50" }
+        results = caller.zypper_results
+        assert results[0].cmd is None
+        caller = AutoPatchCaller(results[1:], config=cfg)
+        caller.run()
+        caller.check_report()
+
+def test_version_cache_invalid(tmpdir):
+    """The cached version is discarded if the zypper binary changes.
+    """
+    with tmpdir.as_cwd():
+        zypper, cache_dir, cfg = get_config(tmpdir)
+        caller = AutoPatchCaller.get_caller("no_patches", config=cfg)
+        caller.run()
+        zypper.write_text("#! /bin/sh\n# updated\n")
+        caller = AutoPatchCaller.get_caller("no_patches", config=cfg)
+        caller.run()
+        # assert that no mail report has been sent:
+        with pytest.raises(FileNotFoundError):
+            caller.check_report()
@@ -0,0 +1,103 @@
+"""Test the cheap check for needed security patches.
+"""
+
+import json
+from pathlib import Path
+import pytest
+from conftest import AutoPatchCaller, ZypperResult
+from test_02_metrics import read_metrics
+
+
+def check_results(critical=False):
+    """Return the zypper results for a check finding the patches from
+    the sec_patches case.  The recommended patch is critical if
+    critical is True.
+
+    There are no cached metadata in the test environment, so the
+    outdated repositories of the refresh_max_age case are refreshed
+    first.
+    """
+    sec_patches = AutoPatchCaller.get_caller("sec_patches").zypper_results
+    refresh = AutoPatchCaller.get_caller("refresh_max_age").zypper_results
+    patch_check = sec_patches[2]
+    if critical:
+        list_stdout = sec_patches[3].stdout.replace(
+            "| recommended | moderate  |", "| recommended | critical  |")
+    else:
+        list_stdout = "No updates found.\n"
+    return [ sec_patches[0], refresh[1], refresh[2],
+             ZypperResult(patch_check.cmd,
+                          returncode=patch_check.returncode,
+                          stdout=patch_check.stdout,
+                          flags=["--no-refresh"]),
+             ZypperResult("list-patches", stdout=list_stdout,
+                          flags=["--no-refresh", "--severity", "critical"]) ]
+
+def test_check_no_change(tmpdir):
+    """The check records the patches needed, but does not act unless
+    the number of security patches increases.
+    """
+    with tmpdir.as_cwd():
+        cfg = {
+            'zypper': { 'cache_dir': str(tmpdir / "cache") },
+            'metrics': { 'directory': str(tmpdir) },
+            'check': { 'action': "none" },
+        }
+        AutoPatchCaller(check_results(), config=cfg).run(args=["--check"])
+        metrics = read_metrics(Path(str(tmpdir), "auto-patch-check.prom"))
+        assert metrics['auto_patch_security_patches_outstanding'
+                       '{mode="check"}'] == 2
+        cfg['check']['action'] = "patch"
+        AutoPatchCaller(check_results(), config=cfg).run(args=["--check"])
+        with pytest.raises(FileNotFoundError):
+            AutoPatchCaller.get_report()
+
+def test_check_patch(tmpdir):
+    """New security patches trigger a full run.
+    """
+    with tmpdir.as_cwd():
+        cfg = { 'zypper': { 'cache_dir': str(tmpdir / "cache") } }
+        sec_patches = AutoPatchCaller.get_caller("sec_patches")
+        caller = AutoPatchCaller(check_results() + sec_patches.zypper_results,
+                                 config=cfg)
+        caller.run(args=["--check"])
+        sec_patches.check_report()
+
+def test_check_patch_failed(tmpdir):
+    """If the full run triggered fails, the next check triggers it
+    again.
+    """
+    with tmpdir.as_cwd():
+        cfg = { 'zypper': { 'cache_dir': str(tmpdir / "cache") } }
+        sec_patches = AutoPatchCaller.get_caller("sec_patches")
+        failed = ZypperResult("patch", returncode=8,
+                              stdout=sec_patches.zypper_results[4].stdout)
+        results = (check_results() + sec_patches.zypper_results[:4]
+                   + [ failed ])
+        AutoPatchCaller(results, config=cfg).run(exitcode=8,
+                                                 args=["--check"])
+        state = tmpdir / "cache" / "check.json"
+        assert not state.check()
+        (tmpdir / "report.pickle").remove()
+        caller = AutoPatchCaller(check_results() + sec_patches.zypper_results,
+                                 config=cfg)
+        caller.run(args=["--check"])
+        sec_patches.check_report()
+        assert json.loads(state.read_text("ascii")) == { 'urgent': 2 }
+
+def test_check_critical(tmpdir):
+    """Critical patches are counted along with the security patches.
+    """
+    with tmpdir.as_cwd():
+        cache_dir = tmpdir / "cache"
+        cache_dir.mkdir()
+        state = cache_dir / "check.json"
+        # The state written by an older version.
+        state.write_text(json.dumps({ 'security': 2 }), "ascii")
+        cfg = {
+            'zypper': { 'cache_dir': str(cache_dir) },
+            'check': { 'action': "none" },
+        }
+        AutoPatchCaller(check_results(critical=True),
+                        config=cfg).run(args=["--check"])
+        assert json.loads(state.read_text("ascii")) == { 'urgent': 3 }
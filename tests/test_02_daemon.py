@@ -0,0 +1,96 @@
+"""Test serving commands in daemon mode.
+"""
+
+import json
+from pathlib import Path
+import socket
+import threading
+import time
+from conftest import AutoPatchCaller, ZypperResult
+from test_02_check import check_results
+
+
+def connect(path, timeout=10):
+    """Connect to the daemon, waiting for it to come up.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(path)
+            return sock
+        except OSError:
+            sock.close()
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+def test_daemon_commands(tmpdir):
+    """Check and patch in one daemon, then let it exit when idle.
+    """
+    with tmpdir.as_cwd():
+        path = str(tmpdir / "daemon.sock")
+        cfg = { 'daemon': { 'socket': path, 'idle_timeout': "1" } }
+        sec_patches = AutoPatchCaller.get_caller("sec_patches").zypper_results
+        # The version is only probed once, the check is followed by a
+        # full run.
+        results = check_results() + sec_patches[1:]
+        caller = AutoPatchCaller(results, config=cfg)
+        thread = threading.Thread(target=caller.run,
+                                  kwargs=dict(args=["--daemon"]))
+        thread.start()
+        try:
+            with connect(path) as sock, sock.makefile("rwb") as f:
+                def command(cmd):
+                    f.write(cmd.encode("ascii") + b"\n")
+                    f.flush()
+                    return json.loads(f.readline().decode("utf-8"))
+                res = command("check")
+                assert res['exit_code'] == 101
+                assert res['patches'] == 3
+                assert res['security_patches'] == 2
+                res = command("patch")
+                assert res['exit_code'] == 0
+                assert len(res['installed']) == 3
+                assert res['outstanding'] == []
+                res = command("status")
+                assert res['requests'] == 3
+                assert res['zypper_version'] == "1.14.50"
+                assert res['last_run']['exit_code'] == 0
+                assert "error" in command("frobnicate")
+        finally:
+            thread.join(timeout=30)
+        assert not thread.is_alive()
+        assert not Path(path).exists()
+        host, msg = AutoPatchCaller.get_report()
+        assert msg['Subject'].startswith("auto-patch")
+
+def test_daemon_error(tmpdir):
+    """A failing command gets an error in reply, the daemon goes on
+    serving.
+    """
+    with tmpdir.as_cwd():
+        path = str(tmpdir / "daemon.sock")
+        cfg = { 'daemon': { 'socket': path, 'idle_timeout': "1" } }
+        sec_patches = AutoPatchCaller.get_caller("sec_patches").zypper_results
+        failed = ZypperResult("patch-check", returncode=4,
+                              stderr="System management is broken.\n")
+        results = check_results()[:3] + [ failed ]
+        caller = AutoPatchCaller(results, config=cfg)
+        thread = threading.Thread(target=caller.run,
+                                  kwargs=dict(args=["--daemon"]))
+        thread.start()
+        try:
+            with connect(path) as sock, sock.makefile("rwb") as f:
+                def command(cmd):
+                    f.write(cmd.encode("ascii") + b"\n")
+                    f.flush()
+                    return json.loads(f.readline().decode("utf-8"))
+                res = command("check")
+                assert res['exit_code'] == 4
+                assert "error" in res
+                res = command("status")
+                assert res['requests'] == 2
+        finally:
+            thread.join(timeout=30)
+        assert not thread.is_alive()
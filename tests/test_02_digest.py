@@ -0,0 +1,102 @@
+"""Test sending the results to a collector mailing a digest.
+"""
+
+import threading
+import pytest
+from conftest import AutoPatchCaller
+from auto_patch.digest import DigestCollector, SMTPPool, make_server
+
+
+class FakeSMTP:
+    """A stand-in for smtplib.SMTP collecting the messages sent.
+    """
+    def __init__(self):
+        self.sent = []
+
+    def send_message(self, msg):
+        self.sent.append(msg)
+
+    def quit(self):
+        pass
+
+@pytest.fixture
+def collector(tmpdir):
+    address = "unix:%s" % (tmpdir / "digest.sock")
+    collector = DigestCollector()
+    server = make_server(address, collector)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    collector.address = address
+    yield collector
+    server.shutdown()
+    server.server_close()
+
+def result(hostname, installed=(), outstanding=(), exit_code=0):
+    def patches(names):
+        return [ { 'name': n, 'category': "security",
+                   'severity': "important", 'summary': "fix %s" % n }
+                 for n in names ]
+    return {
+        'hostname': hostname,
+        'mode': "patch",
+        'start': 0.0,
+        'exit_code': exit_code,
+        'reboot_required': False,
+        'installed': patches(installed),
+        'outstanding': patches(outstanding),
+        'summary': "auto-patch failed with exit code %d.\n" % exit_code,
+    }
+
+def test_digest_collect(tmpdir, collector):
+    """The result is sent to the collector rather than mailed.
+    """
+    with tmpdir.as_cwd():
+        cfg = { 'digest': { 'collector': collector.address } }
+        caller = AutoPatchCaller.get_caller("sec_patches", config=cfg)
+        caller.run()
+        with pytest.raises(FileNotFoundError):
+            caller.check_report()
+        results = collector.take()
+        assert len(results) == 1
+        r = results[0]
+        assert r['exit_code'] == 0
+        assert sorted(p['name'] for p in r['installed']) == [
+            "openSUSE-2020-1743", "openSUSE-2020-1744", "openSUSE-2020-1745",
+        ]
+        assert r['outstanding'] == []
+        assert "Patches installed: 3" in r['summary']
+
+def test_digest_unreachable(tmpdir):
+    """The report is mailed if the collector is not reachable.
+    """
+    with tmpdir.as_cwd():
+        address = "unix:%s" % (tmpdir / "nonexistent.sock")
+        cfg = { 'digest': { 'collector': address } }
+        caller = AutoPatchCaller.get_caller("sec_patches", config=cfg)
+        caller.run()
+        caller.check_report()
+
+def test_digest_format():
+    """Hosts having the same patches are grouped in the digest, which
+    is sent over the pooled connection.
+    """
+    collector = DigestCollector()
+    collector.add(result("a.example.org", installed=["p-1", "p-2"]))
+    collector.add(result("b.example.org", installed=["p-2", "p-1"]))
+    collector.add(result("c.example.org", outstanding=["p-3"],
+                         exit_code=107))
+    text = DigestCollector.format(collector.results)
+    assert text.startswith("Results of auto-patch from 3 hosts.")
+    assert "c.example.org: exit code 107" in text
+    idx = text.index("Group 1, 2 hosts:\n  a.example.org\n  b.example.org\n")
+    assert text.index("Group 2, 1 hosts:\n  c.example.org\n") > idx
+    smtp = FakeSMTP()
+    connects = []
+    def connect():
+        connects.append(1)
+        return smtp
+    pool = SMTPPool(connect)
+    pool.send_message("digest 1")
+    pool.send_message("digest 2")
+    assert smtp.sent == ["digest 1", "digest 2"]
+    assert len(connects) == 1
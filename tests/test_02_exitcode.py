@@ -6,7 +6,7 @@ zypper call yields an error result.
 """
 
 import pytest
-from conftest import AutoPatchCaller
+from conftest import AutoPatchCaller, ZypperResult, get_report_body
 
 
 def test_error_syntax(tmpdir):
@@ -46,3 +46,20 @@ def test_error_scripterr(tmpdir):
         caller = AutoPatchCaller.get_caller("err_scripterr")
         caller.run(exitcode=107)
         caller.check_report(extra_msg="ERROR:")
+
+
+def test_error_messages(tmpdir):
+    """The error messages of zypper are included in the report.
+    """
+    with tmpdir.as_cwd():
+        results = AutoPatchCaller.get_caller("sec_patches").zypper_results
+        failed = ZypperResult("patch", returncode=8,
+                              stdout=results[4].stdout,
+                              stderr=("Problem: nothing provides "
+                                      "'libfoo.so.1' needed by bar-1.0\n"))
+        caller = AutoPatchCaller(results[:4] + [ failed ])
+        caller.run(exitcode=8)
+        _, msg = caller.check_report()
+        assert ("Error during installation or removal of packages: "
+                "nothing provides 'libfoo.so.1' needed by bar-1.0"
+                in get_report_body(msg))
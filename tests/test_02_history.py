@@ -0,0 +1,66 @@
+"""Test recording the runs in the history database.
+"""
+
+import sqlite3
+from conftest import AutoPatchCaller, get_report_body
+
+
+def get_report():
+    _, msg = AutoPatchCaller.get_report()
+    return get_report_body(msg)
+
+def test_history_record(tmpdir):
+    """A run gets recorded with its zypper calls and patches.
+    """
+    with tmpdir.as_cwd():
+        db = str(tmpdir / "history.db")
+        cfg = { 'history': { 'database': db } }
+        caller = AutoPatchCaller.get_caller("sec_patches", config=cfg)
+        caller.run()
+        caller.check_report()
+        conn = sqlite3.connect(db)
+        runs = conn.execute("SELECT id, mode, exit_code FROM run").fetchall()
+        assert len(runs) == 1
+        run_id, mode, exit_code = runs[0]
+        assert (mode, exit_code) == ("patch", 0)
+        calls = conn.execute("SELECT command, returncode FROM zypper_call "
+                             "WHERE run_id = ?", (run_id,)).fetchall()
+        assert calls == [("--version", 0), ("refresh", 0),
+                         ("patch-check", 101), ("list-patches", 0),
+                         ("patch", 0), ("ps", 0)]
+        patches = conn.execute("SELECT name, category, state FROM patch "
+                               "WHERE run_id = ? ORDER BY name",
+                               (run_id,)).fetchall()
+        assert patches == [
+            ("openSUSE-2020-1743", "security", "installed"),
+            ("openSUSE-2020-1744", "security", "installed"),
+            ("openSUSE-2020-1745", "recommended", "installed"),
+        ]
+
+def test_history_changes_only(tmpdir):
+    """The report only lists the changes since the previous run.
+
+    One patch can not be installed due to a conflict.  It is reported
+    as new in the first run and as still outstanding in the second.
+    """
+    with tmpdir.as_cwd():
+        cfg = {
+            'mailreport': { 'changes_only': "on" },
+            'history': { 'database': str(tmpdir / "history.db") },
+        }
+        caller = AutoPatchCaller.get_caller("patch_conflict", config=cfg)
+        caller.run()
+        body = get_report()
+        assert body.startswith("Installed patches:")
+        idx = body.index("New patches:")
+        assert body.find("openSUSE-SLE-15.6-2026-1065") < idx
+        assert body.find("openSUSE-SLE-15.6-2026-1084") > idx
+        assert "Patches still outstanding" not in body
+        assert "A reboot is required." in body
+        assert "Category    | Patches" not in body
+        caller = AutoPatchCaller.get_caller("patch_conflict", config=cfg)
+        caller.run()
+        body = get_report()
+        assert "New patches:" not in body
+        idx = body.index("Patches still outstanding:")
+        assert body.find("openSUSE-SLE-15.6-2026-1084") > idx
@@ -0,0 +1,156 @@
+"""Test the splay of the start and the download slots.
+"""
+
+import os
+import threading
+from conftest import AutoPatchCaller, ZypperResult
+from auto_patch.lease import (DirectoryLease, LeaseSlots, ServiceLease,
+                              make_lease_server, splay_delay)
+
+
+def test_splay():
+    """The splay is stable for a host and spreads the hosts evenly.
+    """
+    window = 7200
+    assert splay_delay("host.example.com", window) == \
+        splay_delay("host.example.com", window)
+    delays = [ splay_delay("host%03d.example.com" % i, window)
+               for i in range(1000) ]
+    assert all(0 <= d < window for d in delays)
+    counts = [0] * 4
+    for d in delays:
+        counts[int(d // (window / 4))] += 1
+    assert all(200 < c < 300 for c in counts)
+
+def test_directory_lease(tmpdir):
+    """Only the given number of slots are handed out, stale slots
+    expire.
+    """
+    directory = str(tmpdir / "leases")
+    first = DirectoryLease(directory, 2, 3600, "host1")
+    second = DirectoryLease(directory, 2, 3600, "host2")
+    third = DirectoryLease(directory, 2, 3600, "host3")
+    assert first.acquire(0) == 0
+    assert second.acquire(0) == 1
+    assert third.acquire(0) is None
+    first.release()
+    assert third.acquire(0) == 0
+    # The slot of host2 has been left behind a long time ago.
+    os.utime(second.path, (0, 0))
+    fourth = DirectoryLease(directory, 2, 3600, "host4")
+    assert fourth.acquire(0) == 1
+    with open(fourth.path, "rt") as f:
+        assert f.read().startswith("host4 ")
+    assert sorted(os.listdir(directory)) == ["slot-0", "slot-1"]
+
+def test_directory_lease_expire_race(tmpdir, monkeypatch):
+    """A slot taken by another host right after the stale one has been
+    seen is not removed.
+    """
+    directory = str(tmpdir / "leases")
+    first = DirectoryLease(directory, 1, 3600, "host1")
+    assert first.acquire(0) == 0
+    os.utime(first.path, (0, 0))
+    rename = os.rename
+    def racing_rename(src, dst):
+        # Another host expires the stale slot and a third one takes
+        # it before this host gets to rename it.
+        os.unlink(src)
+        with open(src, "wt") as f:
+            f.write("host3\n")
+        monkeypatch.setattr(os, "rename", rename)
+        rename(src, dst)
+    monkeypatch.setattr(os, "rename", racing_rename)
+    second = DirectoryLease(directory, 1, 3600, "host2")
+    assert second.acquire(0) is None
+    with open(first.path, "rt") as f:
+        assert f.read() == "host3\n"
+    assert os.listdir(directory) == ["slot-0"]
+
+def test_service_lease(tmpdir):
+    """The lease service hands out a slot per connection until the
+    connection is closed.
+    """
+    address = "unix:%s" % (tmpdir / "lease.sock")
+    server = make_lease_server(address, 1)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        first = ServiceLease(address, "host1")
+        second = ServiceLease(address, "host2")
+        assert first.acquire(5) == 0
+        assert second.acquire(0.5) is None
+        first.release()
+        assert second.acquire(5) == 0
+        second.release()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_service_lease_ttl(tmpdir):
+    """The lease service takes back a slot after the ttl, even if the
+    client does not close the connection.
+    """
+    address = "unix:%s" % (tmpdir / "lease.sock")
+    server = make_lease_server(address, 1, ttl=0.5)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        first = ServiceLease(address, "host1")
+        second = ServiceLease(address, "host2")
+        assert first.acquire(5) == 0
+        assert second.acquire(5) == 0
+        first.release()
+        second.release()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_lease_slots_abort():
+    """Waiting for a slot is given up once aborted.
+    """
+    slots = LeaseSlots(1)
+    assert slots.acquire() == 0
+    assert slots.acquire(aborted=lambda: True) is None
+    slots.release(0)
+    assert slots.acquire(aborted=lambda: True) == 0
+
+def lease_results(cached):
+    """The calls of the sec_patches scenario with a lease configured.
+    The dry run finds cached of the 2.2 MiB to download in the cache.
+    """
+    sec_patches = AutoPatchCaller.get_caller("sec_patches")
+    results = sec_patches.zypper_results
+    patch = results[4]
+    dry_run = patch.stdout.replace("Already cached: 0 B.",
+                                   "Already cached: %s." % cached)
+    calls = [ ZypperResult("patch", stdout=dry_run, flags=["--dry-run"]) ]
+    if cached != "2.2 MiB":
+        calls.append(ZypperResult("patch", stdout=patch.stdout,
+                                  flags=["--download-only"]))
+    return results[:4] + calls + results[4:]
+
+def test_lease_download(tmpdir):
+    """The slot is only held for a separate download before the
+    installation.
+    """
+    with tmpdir.as_cwd():
+        leases = tmpdir / "leases"
+        cfg = { 'lease': { 'directory': str(leases), 'slots': "1" } }
+        caller = AutoPatchCaller(lease_results("0 B"), config=cfg)
+        caller.run()
+        caller.check_report()
+        # The slot has been taken and released again.
+        assert leases.check(dir=1)
+        assert leases.listdir() == []
+
+def test_lease_all_cached(tmpdir):
+    """No slot is taken if all packages are in the package cache.
+    """
+    with tmpdir.as_cwd():
+        leases = tmpdir / "leases"
+        cfg = { 'lease': { 'directory': str(leases), 'slots': "1" } }
+        caller = AutoPatchCaller(lease_results("2.2 MiB"), config=cfg)
+        caller.run()
+        caller.check_report()
+        assert not leases.check()
@@ -0,0 +1,66 @@
+"""Test writing metrics for the Prometheus node exporter.
+"""
+
+from pathlib import Path
+from conftest import AutoPatchCaller
+
+
+def read_metrics(path):
+    """Read a file in the Prometheus text format.
+    Return a dict mapping metric names including labels to values.
+    """
+    metrics = {}
+    with path.open("rt") as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            name, value = line.split()
+            metrics[name] = float(value)
+    return metrics
+
+def test_metrics_sec_patches(tmpdir):
+    """Some security patches available and installed.
+    """
+    with tmpdir.as_cwd():
+        cfg = { 'metrics': { 'directory': str(tmpdir) } }
+        caller = AutoPatchCaller.get_caller("sec_patches", config=cfg)
+        caller.run()
+        metrics = read_metrics(Path(str(tmpdir), "auto-patch.prom"))
+        assert metrics['auto_patch_last_run_exit_code{mode="patch"}'] == 0
+        key = 'auto_patch_patches_needed{mode="patch",category="%s"}'
+        assert metrics[key % "security"] == 2
+        assert metrics[key % "recommended"] == 1
+        key = 'auto_patch_patches_installed{mode="patch",category="%s"}'
+        assert metrics[key % "security"] == 2
+        assert metrics[key % "recommended"] == 1
+        key = 'auto_patch_security_patches_outstanding{mode="patch"}'
+        assert metrics[key] == 0
+        assert metrics['auto_patch_reboot_required{mode="patch"}'] == 0
+        assert metrics['auto_patch_retries{mode="patch"}'] == 0
+
+def test_metrics_patch_conflict(tmpdir):
+    """Some patches can not be applied and are still outstanding.
+    """
+    with tmpdir.as_cwd():
+        cfg = { 'metrics': { 'directory': str(tmpdir) } }
+        caller = AutoPatchCaller.get_caller("patch_conflict", config=cfg)
+        caller.run()
+        metrics = read_metrics(Path(str(tmpdir), "auto-patch.prom"))
+        key = 'auto_patch_patches_installed{mode="patch",category="%s"}'
+        assert metrics[key % "security"] == 2
+        assert metrics[key % "recommended"] == 1
+        key = 'auto_patch_security_patches_outstanding{mode="patch"}'
+        assert metrics[key] == 1
+        assert metrics['auto_patch_reboot_required{mode="patch"}'] == 1
+
+def test_metrics_locked_final(tmpdir):
+    """auto-patch eventually gives up waiting for a lock.
+    """
+    with tmpdir.as_cwd():
+        cfg = { 'retry': { 'max': "10", 'wait': "0" },
+                'metrics': { 'directory': str(tmpdir) } }
+        caller = AutoPatchCaller.get_caller("locked_final", config=cfg)
+        caller.run(exitcode=7)
+        metrics = read_metrics(Path(str(tmpdir), "auto-patch.prom"))
+        assert metrics['auto_patch_last_run_exit_code{mode="patch"}'] == 7
+        assert metrics['auto_patch_retries{mode="patch"}'] == 9
@@ -0,0 +1,95 @@
+"""Test installing the patches in several passes.
+"""
+
+from conftest import AutoPatchCaller, ZypperResult, get_report_body
+
+
+patches = {
+    "openSUSE-2020-1743": ("security", "moderate",
+                           "Security update for gnutls"),
+    "openSUSE-2020-1744": ("security", "important",
+                           "Security update for freetype2"),
+    "openSUSE-2020-1745": ("recommended", "moderate",
+                           "Recommended update for yast2-network"),
+}
+
+def list_patches(names, flags=()):
+    lines = [ "", "Repository | Name | Category | Severity | Interactive "
+              "| Status | Since | Summary", "-----+-----+-----" ]
+    for n in names:
+        category, severity, summary = patches[n]
+        lines.append("Main Update Repository | %s | %s | %s | --- "
+                     "| needed | - | %s" % (n, category, severity, summary))
+    stdout = "\n".join(lines) + "\n\n"
+    return ZypperResult("list-patches", stdout=stdout, flags=flags)
+
+def patch(names, flags=()):
+    stdout = ("\nThe following %d NEW patches are going to be installed:\n"
+              "  %s\n\n" % (len(names), " ".join(names)))
+    return ZypperResult("patch", stdout=stdout, flags=flags)
+
+def patch_check(security, recommended):
+    rc = 101 if security else 100 if recommended else 0
+    stdout = "\nCategory    | Patches\n------------+--------\n"
+    if security:
+        stdout += "security    | %d\n" % security
+    if recommended:
+        stdout += "recommended | %d\n" % recommended
+    stdout += ("\n%d patches needed (%d security patches)\n"
+               % (security + recommended, security))
+    return ZypperResult("patch-check", returncode=rc, stdout=stdout)
+
+def test_passes(tmpdir):
+    """Security patches are installed in a first pass, the remaining
+    patches in a second.  The check verifying the first pass is reused
+    at the start of the second.
+    """
+    with tmpdir.as_cwd():
+        sec = ["openSUSE-2020-1743", "openSUSE-2020-1744"]
+        rec = ["openSUSE-2020-1745"]
+        sec_flags = ["--category", "security"]
+        results = [
+            ZypperResult(None, stdout="zypper 1.14.50", capture=False),
+            ZypperResult("refresh", capture=False),
+            patch_check(2, 1),
+            list_patches(sec, flags=sec_flags),
+            patch(sec, flags=sec_flags),
+            patch_check(0, 1),
+            list_patches(rec),
+            patch(rec),
+            ZypperResult("ps"),
+        ]
+        cfg = { 'zypper': { 'passes': "security, all" } }
+        caller = AutoPatchCaller(results, config=cfg)
+        caller.run()
+        _, msg = caller.check_report()
+        body = get_report_body(msg)
+        assert ("Passes:\n"
+                "  1. security: 2 patches installed\n"
+                "  2. all: 1 patches installed\n") in body
+        assert "Patches installed: 3" in body
+
+def test_passes_done_early(tmpdir):
+    """Later passes are skipped if no patches are needed any more
+    after verifying the first one.
+    """
+    with tmpdir.as_cwd():
+        sec = ["openSUSE-2020-1743", "openSUSE-2020-1744"]
+        sec_flags = ["--category", "security"]
+        results = [
+            ZypperResult(None, stdout="zypper 1.14.50", capture=False),
+            ZypperResult("refresh", capture=False),
+            patch_check(2, 0),
+            list_patches(sec, flags=sec_flags),
+            patch(sec, flags=sec_flags),
+            patch_check(0, 0),
+            ZypperResult("ps"),
+        ]
+        cfg = { 'zypper': { 'passes': "security, all" } }
+        caller = AutoPatchCaller(results, config=cfg)
+        caller.run()
+        _, msg = caller.check_report()
+        body = get_report_body(msg)
+        assert "Passes:" not in body
+        assert "Patches installed: 2" in body
+        assert "Patches still outstanding: 0" in body
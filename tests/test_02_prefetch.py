@@ -0,0 +1,55 @@
+"""Test downloading patches in advance.
+"""
+
+import pytest
+from conftest import AutoPatchCaller, ZypperResult
+
+
+def test_prefetch_no_patches(tmpdir):
+    """No patches available, nothing to download.
+    """
+    with tmpdir.as_cwd():
+        caller = AutoPatchCaller.get_caller("prefetch_no_patches")
+        caller.run(args=["--prefetch"])
+        # assert that no mail report has been sent:
+        with pytest.raises(FileNotFoundError):
+            caller.check_report()
+
+
+def test_prefetch_sec_patches(tmpdir):
+    """Some security patches available, download them.
+
+    The patches are not installed yet, so no report is sent.
+    """
+    with tmpdir.as_cwd():
+        caller = AutoPatchCaller.get_caller("prefetch_sec_patches")
+        caller.run(args=["--prefetch"])
+        # assert that no mail report has been sent:
+        with pytest.raises(FileNotFoundError):
+            caller.check_report()
+
+
+def test_prefetch_reboot(tmpdir):
+    """zypper tells that the patches downloaded will need a reboot,
+    this is not an error for the prefetch.
+    """
+    with tmpdir.as_cwd():
+        results = AutoPatchCaller.get_caller("prefetch_sec_patches")\
+                                 .zypper_results
+        download = results[3]
+        results[3] = ZypperResult(download.cmd, returncode=102,
+                                  stdout=download.stdout,
+                                  flags=download.flags)
+        caller = AutoPatchCaller(results)
+        caller.run(args=["--prefetch"])
+        with pytest.raises(FileNotFoundError):
+            caller.check_report()
+
+
+def test_install_cached(tmpdir):
+    """Install patches that have been downloaded in advance.
+    """
+    with tmpdir.as_cwd():
+        caller = AutoPatchCaller.get_caller("sec_patches_cached")
+        caller.run()
+        caller.check_report()
@@ -0,0 +1,21 @@
+"""Test refreshing the repositories at the start of the run.
+"""
+
+import pytest
+from conftest import AutoPatchCaller
+
+
+def test_refresh_max_age(tmpdir):
+    """Only refresh repositories having outdated metadata.
+
+    There are no cached metadata in the test environment, so all
+    enabled repositories should be refreshed.  The subsequent zypper
+    call should be made with --no-refresh.
+    """
+    with tmpdir.as_cwd():
+        cfg = { 'zypper': { 'refresh_max_age': "3600" } }
+        caller = AutoPatchCaller.get_caller("refresh_max_age", config=cfg)
+        caller.run()
+        # assert that no mail report has been sent:
+        with pytest.raises(FileNotFoundError):
+            caller.check_report()
@@ -0,0 +1,59 @@
+"""Test the content of the mail report.
+"""
+
+from conftest import AutoPatchCaller, get_report_body, get_report_log
+
+
+def test_report_summary(tmpdir):
+    """The body contains a summary, the full log is attached.
+    """
+    with tmpdir.as_cwd():
+        caller = AutoPatchCaller.get_caller("sec_patches")
+        caller.run()
+        _, msg = caller.check_report()
+        body = get_report_body(msg)
+        assert "Patches needed: 3 (recommended: 1, security: 2)" in body
+        assert "Patches installed: 3" in body
+        assert "zypper has been called 6 times" in body
+        assert "The following 15 packages are going to be upgraded" not in body
+        assert "auto-patch.log.gz" in body
+
+def test_report_failed_call(tmpdir):
+    """The body contains the last lines of the failed zypper call.
+    """
+    with tmpdir.as_cwd():
+        cfg = { 'mailreport': { 'tail_lines': "5" } }
+        caller = AutoPatchCaller.get_caller("err_scripterr", config=cfg)
+        caller.run(exitcode=107)
+        _, msg = caller.check_report(extra_msg="ERROR:")
+        body = get_report_body(msg)
+        assert "auto-patch failed with exit code 107." in body
+        assert "ERROR: Some packages install script returned an error" in body
+        assert "zypper patch failed with exit code 107" in body
+        assert "  Backend:  classic_rpmtrans" in body
+        assert "python3-pip python3-pytest" not in body
+
+def test_report_max_size(tmpdir):
+    """The attached log is truncated to the configured size.
+    """
+    with tmpdir.as_cwd():
+        cfg = { 'mailreport': { 'max_size': "10" } }
+        caller = AutoPatchCaller.get_caller("sec_patches", config=cfg)
+        caller.run()
+        _, msg = AutoPatchCaller.get_report()
+        body = get_report_body(msg)
+        assert "truncated" in body
+        log = get_report_log(msg)
+        assert "[truncated]" in log
+        assert "zypper has been called" not in log
+
+def test_report_no_attachment(tmpdir):
+    """No log is attached if max_size is zero.
+    """
+    with tmpdir.as_cwd():
+        cfg = { 'mailreport': { 'max_size': "0" } }
+        caller = AutoPatchCaller.get_caller("sec_patches", config=cfg)
+        caller.run()
+        _, msg = AutoPatchCaller.get_report()
+        assert not list(msg.iter_attachments())
+        assert "Patches installed: 3" in get_report_body(msg)
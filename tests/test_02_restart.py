@@ -0,0 +1,109 @@
+"""Test restarting the services still using deleted files.
+"""
+
+import stat
+from conftest import AutoPatchCaller, ZypperResult, get_report_body
+from auto_patch.parser import ProcessTableParser
+from auto_patch.restart import restart_services, select_services
+
+
+def parse_ps(tmpdir, case):
+    with tmpdir.as_cwd():
+        caller = AutoPatchCaller.get_caller(case)
+    ps = [ r for r in caller.zypper_results if r.cmd == "ps" ][-1]
+    parser = ProcessTableParser()
+    for line in ps.stdout.splitlines(keepends=True):
+        parser.feed(line)
+    return parser.items
+
+def test_parse_ps(tmpdir):
+    processes = parse_ps(tmpdir, "patch_psproc")
+    assert [ p.pid for p in processes ] == [871, 1364, 4503, 4506, 6748,
+                                            10185, 10852]
+    assert processes[1].service == "polkit"
+    assert processes[1].files == ["/usr/lib64/libstdc++.so.6.0.28",
+                                  "/lib64/libgcc_s.so.1"]
+
+def test_select_services(tmpdir):
+    processes = parse_ps(tmpdir, "patch_psproc")
+    assert select_services(processes, deny=["dbus*"]) == [
+        r"qemu-ga@virtio\x2dports-org.qemu.guest_agent.0", "polkit",
+        "postfix"]
+    assert select_services(processes, allow=["po*"],
+                           deny=["polkit"]) == ["postfix"]
+
+def test_restart_services(tmpdir):
+    """The services are restarted by systemctl, a failure is reported
+    for the service concerned.
+    """
+    systemctl = tmpdir / "systemctl"
+    log = tmpdir / "restarts.log"
+    systemctl.write_text("#! /bin/sh\n"
+                         "echo \"$@\" >> %s\n"
+                         "case $2 in polkit.service) "
+                         "echo 'Job failed.'; exit 1;; esac\n" % log,
+                         encoding="ascii")
+    systemctl.chmod(stat.S_IRWXU)
+    results = restart_services(["polkit", "postfix", "sshd"],
+                               systemctl=str(systemctl), batch_size=2,
+                               timeout=10)
+    assert results == [("polkit", "exit code 1: Job failed."),
+                       ("postfix", None), ("sshd", None)]
+    restarts = log.read_text(encoding="ascii").splitlines()
+    assert sorted(restarts) == ["restart polkit.service",
+                                "restart postfix.service",
+                                "restart sshd.service"]
+
+def test_report_processes(tmpdir):
+    """The processes still using deleted files are listed in the
+    report.
+    """
+    with tmpdir.as_cwd():
+        caller = AutoPatchCaller.get_caller("patch_psproc")
+        caller.run()
+        _, msg = caller.check_report()
+        body = get_report_body(msg)
+        assert ("Processes still using deleted files: 7\n"
+                "Their services: dbus, polkit, postfix, qemu-ga@") in body
+
+def test_restart_workflow(tmpdir):
+    """With [restart] services on, the services of the processes still
+    using deleted files are restarted after the installation and
+    zypper ps is called again.
+    """
+    with tmpdir.as_cwd():
+        systemctl = tmpdir / "systemctl"
+        log = tmpdir / "restarts.log"
+        systemctl.write_text("#! /bin/sh\n"
+                             "echo \"$@\" >> %s\n"
+                             "case $2 in polkit.service) "
+                             "echo 'Job failed.'; exit 1;; esac\n" % log,
+                             encoding="ascii")
+        systemctl.chmod(stat.S_IRWXU)
+        cfg = { 'restart': { 'services': "on", 'allow': "polkit, postfix",
+                             'systemctl': str(systemctl) } }
+        psproc = AutoPatchCaller.get_caller("patch_psproc")
+        ps = psproc.zypper_results[-1]
+        # The postfix processes are gone after the restart.
+        records = []
+        for line in ps.stdout.splitlines(keepends=True):
+            if line[:1].isdigit() or not records:
+                records.append([])
+            records[-1].append(line)
+        stdout = "".join("".join(r) for r in records
+                         if "| postfix " not in r[0])
+        results = psproc.zypper_results + [
+            ZypperResult("ps", stdout=stdout, flags=["-s"]),
+        ]
+        caller = AutoPatchCaller(results, config=cfg)
+        caller.run()
+        _, msg = caller.check_report()
+        body = get_report_body(msg)
+        assert ("Services restarted:\n"
+                "  polkit: failed, exit code 1: Job failed.\n"
+                "  postfix: ok\n") in body
+        assert ("Processes still using deleted files: 3\n"
+                "Their services: dbus, polkit, qemu-ga@") in body
+        restarts = log.read_text(encoding="ascii").splitlines()
+        assert sorted(restarts) == ["restart polkit.service",
+                                    "restart postfix.service"]
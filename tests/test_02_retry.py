@@ -4,8 +4,11 @@ The auto-patch script should retry if the ZYPP library is locked by
 another process or in case of failure to refresh a repository.
 """
 
+import threading
+from time import monotonic
 import pytest
-from conftest import AutoPatchCaller
+from conftest import AutoPatchCaller, ZypperResult, get_report_body
+from auto_patch.retry import LockWaiter
 
 
 no_wait = { 'retry': { 'max': "10", 'wait': "0" } }
@@ -52,6 +55,25 @@ def test_locked_complete(tmpdir):
             caller.check_report()
 
 
+def test_lock_waiter_no_holder(tmpdir):
+    """If no process holding the lock is visible, the wait for the lock
+    lasts until the lock file changes.
+    """
+    lockfile = tmpdir / "zypp.pid"
+    for content in ("", "999999999\n"):
+        lockfile.write_text(content, encoding="ascii")
+        timer = threading.Timer(1.0, lockfile.remove)
+        timer.start()
+        start = monotonic()
+        LockWaiter(str(lockfile)).wait(30)
+        assert 1.0 <= monotonic() - start < 5
+        timer.join()
+    # Without a lock file to watch, the full time is waited.
+    start = monotonic()
+    LockWaiter(str(lockfile)).wait(1.0)
+    assert monotonic() - start >= 1.0
+
+
 def test_no_network_at_start(tmpdir):
     """Network failure when auto-patch is started.
     """
@@ -72,3 +94,79 @@ def test_no_network_complete(tmpdir):
         # assert that no mail report has been sent:
         with pytest.raises(FileNotFoundError):
             caller.check_report()
+
+
+def test_locked_deadline(tmpdir):
+    """A persistent lock blocks auto-patch completely, auto-patch
+    gives up when the deadline is exceeded, even though the maximum
+    number of tries has not yet been reached.
+    """
+    cfg = { 'retry': { 'max': "30", 'wait': "0.1", 'deadline': "0.5" } }
+    with tmpdir.as_cwd():
+        caller = AutoPatchCaller.get_caller("locked_complete", config=cfg)
+        caller.run(exitcode=7)
+        # assert that no mail report has been sent:
+        with pytest.raises(FileNotFoundError):
+            caller.check_report()
+
+
+def repos_skipped(names):
+    stderr = "".join("Repository '%s' is invalid.\n"
+                     "Skipping repository '%s' because of the "
+                     "above error.\n" % (n, n) for n in names)
+    stderr += ("Some of the repositories have not been refreshed "
+               "because of an error.\n")
+    return ZypperResult("refresh", returncode=4, stderr=stderr,
+                        capture=False)
+
+def test_refresh_failed_repo(tmpdir):
+    """One repository fails to refresh at the start.  Only that
+    repository is refreshed again.
+    """
+    with tmpdir.as_cwd():
+        sec_patches = AutoPatchCaller.get_caller("sec_patches")
+        repo = "Update repository of openSUSE Backports"
+        results = ([ sec_patches.zypper_results[0],
+                     repos_skipped([repo]),
+                     repos_skipped([repo]),
+                     ZypperResult("refresh", capture=False,
+                                  flags=[repo]) ]
+                   + sec_patches.zypper_results[2:])
+        caller = AutoPatchCaller(results, config=no_wait)
+        caller.run()
+        caller.check_report()
+
+
+def test_refresh_skip_failed_repo(tmpdir):
+    """One repository persistently fails to refresh.  The run goes on
+    without it, the report lists it.
+    """
+    cfg = { 'retry': { 'max': "3", 'wait': "0",
+                       'skip_failed_repos': "on" } }
+    with tmpdir.as_cwd():
+        sec_patches = AutoPatchCaller.get_caller("sec_patches")
+        repo = "Update repository of openSUSE Backports"
+        results = ([ sec_patches.zypper_results[0] ]
+                   + [ repos_skipped([repo]) ] * 3
+                   + sec_patches.zypper_results[2:])
+        caller = AutoPatchCaller(results, config=cfg)
+        caller.run()
+        _, msg = caller.check_report()
+        body = get_report_body(msg)
+        assert ("Repositories failing to refresh, patches from these may "
+                "be missing:\n  %s\n" % repo) in body
+
+
+def test_refresh_library_error(tmpdir):
+    """The refresh fails with a problem in the ZYPP library, but no
+    repository has been skipped.  This is not retried.
+    """
+    with tmpdir.as_cwd():
+        sec_patches = AutoPatchCaller.get_caller("sec_patches")
+        stderr = ("Unexpected exception.\n"
+                  "Problem retrieving files from 'Main Repository'.\n")
+        results = [ sec_patches.zypper_results[0],
+                    ZypperResult("refresh", returncode=4, stderr=stderr,
+                                 capture=False) ]
+        caller = AutoPatchCaller(results, config=no_wait)
+        caller.run(exitcode=4)
@@ -0,0 +1,48 @@
+"""Test the rollout to a fleet of hosts in waves.
+"""
+
+import sys
+from auto_patch.rollout import LocalTransport, Rollout, plan_waves
+
+
+# A stand-in for auto-patch on the target, exiting with the exit code
+# of ZypperCommitError on targets named fail*.
+fake_command = [sys.executable, "-c",
+                "import sys; "
+                "print('patching', sys.argv[1]); "
+                "sys.exit(8 if sys.argv[1].startswith('fail') else 0)",
+                "{target}"]
+
+def test_plan_waves():
+    targets = [ "host%02d" % i for i in range(21) ]
+    waves = plan_waves(targets, canary=1, waves=[10, 50, 100])
+    assert [ len(w) for w in waves ] == [1, 2, 8, 10]
+    assert sum(waves, []) == targets
+    assert plan_waves(targets[:1], canary=2, waves=[50]) == [targets[:1]]
+
+def test_rollout_complete():
+    targets = [ "host%02d" % i for i in range(10) ]
+    waves = plan_waves(targets, canary=1, waves=[50])
+    rollout = Rollout(LocalTransport(fake_command), concurrency=4)
+    assert rollout.run(waves)
+    assert sorted(r.target for r in rollout.results) == targets
+    assert rollout.results[0].output == b"patching host00\n"
+    assert "Rollout completed: 10 of 10 targets" in rollout.format(waves)
+
+def test_rollout_stop():
+    """A failure in the second wave stops the rollout before the
+    third.
+    """
+    targets = ["host00", "host01", "fail02", "host03"] + \
+              [ "host%02d" % i for i in range(4, 10) ]
+    waves = plan_waves(targets, canary=1, waves=[30])
+    rollout = Rollout(LocalTransport(fake_command), concurrency=4,
+                      max_failure_rate=0.2)
+    assert not rollout.run(waves)
+    assert len(rollout.results) == 4
+    summary = rollout.format(waves)
+    assert "Rollout stopped: 4 of 10 targets run in 2 of 3 waves." in summary
+    assert "  fail02 (wave 2): exit code 8 (ZypperCommitError)" in summary
+    assert "fail02 failed, last lines of output:\n\n  patching fail02\n" \
+        in summary
+    assert "Targets not run:\n  host04\n" in summary
@@ -0,0 +1,50 @@
+"""Test patching several system roots in parallel.
+"""
+
+import gzip
+from conftest import AutoPatchCaller, ZypperResult, get_report_body
+
+
+def root_results():
+    """Return the zypper results of the sec_patches case, each call
+    being made with --root.
+    """
+    sec_patches = AutoPatchCaller.get_caller("sec_patches").zypper_results
+    # zypper ps is not called for other roots.
+    return [ ZypperResult(r.cmd, returncode=r.returncode, stdout=r.stdout,
+                          stderr=r.stderr, capture=r.capture,
+                          flags=list(r.flags) + ["--root"])
+             for r in sec_patches if r.cmd != "ps" ]
+
+def test_roots(tmpdir):
+    """Each root gets patched in a worker process, one report with the
+    outcome of all roots is sent.
+    """
+    with tmpdir.as_cwd():
+        roots = [ tmpdir / "image1", tmpdir / "image2" ]
+        for root in roots:
+            root.mkdir()
+        cfg = { 'roots': { 'roots': str(tmpdir / "image*"),
+                           'workers': "2" } }
+        caller = AutoPatchCaller(root_results(), config=cfg)
+        caller.run(args=["--roots"])
+        _, msg = caller.get_report()
+        assert msg['Subject'].endswith(": 2 roots")
+        body = get_report_body(msg)
+        assert "Roots patched: 2, failed: 0\n" in body
+        for root in roots:
+            assert "=== %s ===\n" % root in body
+        attachments = { part.get_filename(): part.get_content()
+                        for part in msg.iter_attachments() }
+        assert len(attachments) == 2
+        for root in roots:
+            name = "auto-patch%s.log.gz" % str(root).replace("/", "_")
+            log = gzip.decompress(attachments[name]).decode("utf-8")
+            for res in caller.zypper_results:
+                if res.capture:
+                    assert res.stdout in log
+        # Each root keeps the durations of its runs separately.
+        for root in roots:
+            name = str(root).strip("/").replace("/", "_")
+            assert (tmpdir / "cache" / "roots" / name
+                    / "durations.json").check()
@@ -0,0 +1,76 @@
+"""Test queuing the reports in a spool directory.
+"""
+
+from email.message import EmailMessage
+from pathlib import Path
+import pytest
+from conftest import AutoPatchCaller
+from auto_patch.spool import MailSpool
+
+
+class FakeSMTP:
+    """A stand-in for smtplib.SMTP collecting the messages sent.
+    """
+    def __init__(self):
+        self.sent = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def send_message(self, msg):
+        self.sent.append(msg)
+
+def refuse():
+    raise ConnectionRefusedError("Connection refused")
+
+def test_spool_deliver(tmpdir):
+    """The report is queued at the end of the run and delivered in a
+    separate call of auto-patch --deliver-mail.
+    """
+    with tmpdir.as_cwd():
+        spool_dir = Path(str(tmpdir), "spool")
+        cfg = { 'spool': { 'directory': str(spool_dir) } }
+        caller = AutoPatchCaller.get_caller("sec_patches", config=cfg)
+        caller.run()
+        with pytest.raises(FileNotFoundError):
+            caller.check_report()
+        assert len(list(spool_dir.glob("*.msg"))) == 1
+        AutoPatchCaller([], config=cfg).run(args=["--deliver-mail"])
+        caller.check_report()
+        assert not list(spool_dir.glob("*.msg"))
+        assert not list(spool_dir.glob("*.json"))
+
+def test_spool_backoff(tmpdir):
+    """Delivery is deferred while the relay is unavailable.
+    """
+    spool = MailSpool(str(tmpdir), wait=300)
+    msg = EmailMessage()
+    msg['Subject'] = "test"
+    msg.set_content("test report\n")
+    name = spool.add(msg)
+    assert spool.messages() == [name]
+    assert spool.deliver(refuse) == 0
+    assert spool.messages() == [name]
+    # The message is not due yet, so no connection should be made.
+    assert spool.deliver(refuse) == 0
+    spool.wait = 0
+    smtp = FakeSMTP()
+    spool._write_state(name, dict(spool._read_state(name), next_attempt=0))
+    assert spool.deliver(lambda: smtp) == 1
+    assert [ m['Subject'] for m in smtp.sent ] == ["test"]
+    assert spool.messages() == []
+
+def test_spool_expire(tmpdir):
+    """Messages are dropped after expiry.
+    """
+    spool = MailSpool(str(tmpdir), expire=0)
+    msg = EmailMessage()
+    msg.set_content("test report\n")
+    spool.add(msg)
+    smtp = FakeSMTP()
+    assert spool.deliver(lambda: smtp) == 0
+    assert not smtp.sent
+    assert spool.messages() == []
@@ -0,0 +1,81 @@
+"""Test that starting auto-patch is cheap.
+
+Importing the package must neither import the heavy modules that are
+only needed in some runs nor resolve the hostname.  The tests run in
+a separate interpreter, so that the modules imported by the test
+framework do not interfere.
+"""
+
+import json
+import subprocess
+import sys
+
+
+lazy_modules = ["smtplib", "email.message", "packaging.version",
+                "systemd.journal", "xml.etree.ElementTree", "ctypes",
+                "asyncio"]
+
+no_lookup = """
+import getpass, socket
+def fail(*args):
+    raise AssertionError("unexpected lookup")
+socket.getfqdn = fail
+getpass.getuser = fail
+"""
+
+def run_python(code):
+    proc = subprocess.run([sys.executable, "-c", no_lookup + code],
+                          stdout=subprocess.PIPE, check=True,
+                          universal_newlines=True)
+    return json.loads(proc.stdout)
+
+def test_import_lazy():
+    """Importing auto_patch.main must not import the lazy modules.
+    """
+    code = """
+import json, sys
+import auto_patch.main
+print(json.dumps(sorted(sys.modules.keys())))
+"""
+    modules = run_python(code)
+    assert "auto_patch.main" in modules
+    for m in lazy_modules:
+        assert m not in modules
+
+def test_config_lazy_hostname(tmpdir):
+    """The hostname is not looked up if it is set in the configuration.
+    """
+    cfg = tmpdir / "auto-patch.cfg"
+    cfg.write_text("[mailreport]\n"
+                   "hostname = host.example.com\n"
+                   "user = admin\n", encoding="ascii")
+    code = """
+import json
+from auto_patch.config import config, read_config
+read_config([%r])
+print(json.dumps([config['mailreport'].get(o)
+                  for o in ('mailfrom', 'mailto', 'subject')]))
+""" % str(cfg)
+    values = run_python(code)
+    assert values == ["admin@host.example.com", "root@host.example.com",
+                      "auto-patch host.example.com"]
+
+def test_config_lazy_default():
+    """The hostname is looked up when first needed.
+    """
+    code = """
+import json, socket
+lookups = []
+def getfqdn():
+    lookups.append(1)
+    return "host.example.org"
+socket.getfqdn = getfqdn
+from auto_patch.config import config, read_config
+read_config([])
+assert not lookups
+values = [config['mailreport'].get(o) for o in ('mailto', 'subject')]
+print(json.dumps([values, len(lookups)]))
+"""
+    values, lookups = run_python(code)
+    assert values == ["root@host.example.org", "auto-patch host.example.org"]
+    assert lookups == 1
@@ -0,0 +1,42 @@
+"""Test the keepalive notifications to the systemd watchdog.
+"""
+
+import io
+import pytest
+from auto_patch.aioproc import run_process
+from auto_patch.retry import LockWaiter
+from auto_patch.watchdog import watchdog
+
+
+@pytest.fixture
+def keepalives(monkeypatch):
+    """Count the keepalives sent with a watchdog interval of 0.1
+    seconds.
+    """
+    sent = []
+    monkeypatch.setattr(watchdog, "_interval", 0.1)
+    monkeypatch.setattr(watchdog, "keepalive", lambda: sent.append(1))
+    return sent
+
+def test_keepalive_process(keepalives):
+    """Keepalives are sent while a silent process runs with a timeout.
+    """
+    lines = []
+    assert run_process(["sleep", "1"], lines.append, io.StringIO(),
+                       timeout=10) == 0
+    assert len(keepalives) >= 5
+
+def test_keepalive_silent_process(keepalives):
+    """Without a timeout, a silent process gets no keepalives.
+    """
+    lines = []
+    assert run_process(["sleep", "1"], lines.append, io.StringIO()) == 0
+    assert not keepalives
+
+def test_keepalive_lock_wait(tmpdir, keepalives):
+    """Keepalives are sent while waiting for the lock.
+    """
+    lockfile = tmpdir / "zypp.pid"
+    lockfile.write_text("", encoding="ascii")
+    LockWaiter(str(lockfile)).wait(1.0)
+    assert len(keepalives) >= 5
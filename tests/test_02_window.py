@@ -0,0 +1,161 @@
+"""Test deferring steps that do not fit into the maintenance window.
+"""
+
+import datetime
+import json
+import pytest
+from conftest import AutoPatchCaller, ZypperResult, get_report_body
+from auto_patch.window import DurationModel, Window
+
+
+def window_results(installed):
+    """The calls of the sec_patches scenario with a dry run before the
+    installation of only the patches installed.
+    """
+    results = AutoPatchCaller.get_caller("sec_patches").zypper_results
+    patch = results[4]
+    stdout = ("The following %d NEW patches are going to be installed:\n"
+              "  %s\n\n" % (len(installed), " ".join(installed)))
+    flags = [ "patch:%s" % n for n in installed ]
+    # All of the patches installed are security patches.
+    check = results[2]
+    security = 2 - len(installed)
+    check_stdout = (check.stdout
+                    .replace("security    | 2", "security    | %d" % security)
+                    .replace("3 patches needed (2 security patches)",
+                             "%d patches needed (%d security patches)"
+                             % (security + 1, security)))
+    return results[:4] + [
+        ZypperResult("patch", stdout=patch.stdout, flags=["--dry-run"]),
+        ZypperResult("install", stdout=stdout, flags=flags),
+        ZypperResult("patch-check", returncode=check.returncode,
+                     stdout=check_stdout),
+        results[5],
+    ]
+
+def run_window(tmpdir, samples, duration, installed):
+    """Run the sec_patches scenario with the durations samples from
+    previous runs and a window of duration seconds.  Return the body
+    of the report.
+    """
+    cache_dir = tmpdir / "cache"
+    cache_dir.mkdir()
+    (cache_dir / "durations.json").write_text(
+        json.dumps({ 'install': samples }), encoding="ascii")
+    cfg = {
+        'zypper': { 'cache_dir': str(cache_dir) },
+        'window': { 'duration': str(duration), 'margin': "0" },
+    }
+    caller = AutoPatchCaller(window_results(installed), config=cfg)
+    caller.run()
+    _, msg = caller.check_report()
+    return get_report_body(msg)
+
+def test_window_partial_install(tmpdir):
+    """The installation of all patches is predicted to take too long,
+    only the most urgent patches that fit get installed.
+    """
+    with tmpdir.as_cwd():
+        installed = ["openSUSE-2020-1744", "openSUSE-2020-1743"]
+        body = run_window(tmpdir, [[{ 'patches': 1 }, 300.0]], 700,
+                          installed)
+        assert ("Deferred to the next run, not fitting into the "
+                "maintenance window:\n"
+                "  installation of 3 patches: predicted to take 900 "
+                "seconds") in body
+        assert "installing only the 2 most urgent of them" in body
+        assert "Patches installed: 2" in body
+
+def test_window_progress(tmpdir):
+    """Even if no patch is predicted to fit, the most urgent one gets
+    installed, so that the run makes progress.  Samples from older
+    versions are still understood.
+    """
+    with tmpdir.as_cwd():
+        body = run_window(tmpdir, [[1, 3600.0]], 600,
+                          ["openSUSE-2020-1744"])
+        assert ("  installation of 3 patches: predicted to take 10800 "
+                "seconds") in body
+        assert "installing only the 1 most urgent of them" in body
+        assert "Patches installed: 1" in body
+        durations = DurationModel(str(tmpdir / "cache"))
+        sizes, _ = durations.samples['install'][-1]
+        assert sizes['patches'] == 1
+        assert len(durations.samples['refresh']) == 1
+
+def test_window_invalid_end(tmpdir):
+    """An invalid end of the window is ignored.
+    """
+    with tmpdir.as_cwd():
+        cfg = { 'window': { 'end': "25:99" } }
+        caller = AutoPatchCaller.get_caller("sec_patches", config=cfg)
+        caller.run()
+        _, msg = caller.check_report()
+        assert "Deferred to the next run" not in get_report_body(msg)
+
+def test_window_first_run(tmpdir):
+    """Without previous runs, the installation is not deferred, even
+    though the window is short.
+    """
+    with tmpdir.as_cwd():
+        cfg = { 'window': { 'duration': "60", 'margin': "0" } }
+        caller = AutoPatchCaller.get_caller("sec_patches", config=cfg)
+        caller.run()
+        _, msg = caller.check_report()
+        body = get_report_body(msg)
+        assert "Deferred to the next run" not in body
+
+def test_window_learn(tmpdir):
+    """The durations of the installation are learned from the runs.
+    """
+    with tmpdir.as_cwd():
+        cache_dir = str(tmpdir / "cache")
+        cfg = {
+            'zypper': { 'cache_dir': cache_dir },
+            'window': { 'duration': "600" },
+        }
+        caller = AutoPatchCaller.get_caller("sec_patches", config=cfg)
+        caller.run()
+        caller.check_report()
+        durations = DurationModel(cache_dir)
+        [(sizes, _)] = durations.samples['install']
+        assert sizes['patches'] == 3
+        assert sizes['packages'] == 15
+        assert sizes['download'] == int(2.2 * 1024 * 1024)
+        assert durations.estimate("install", patches=6) < 60
+
+def test_duration_model(tmpdir):
+    """The rates are averaged with more weight for the latest samples,
+    the slowest prediction of all sizes is taken, only the last
+    samples are kept.
+    """
+    durations = DurationModel(str(tmpdir))
+    assert durations.estimate("install") is None
+    durations.add("install", 10.0, patches=5, packages=10)
+    durations.add("install", 30.0, patches=10, packages=10)
+    assert durations.estimate("install", patches=3) == pytest.approx(8.0)
+    assert durations.estimate("install", packages=3) == pytest.approx(7.0)
+    assert durations.estimate("install", patches=3, packages=3) \
+        == pytest.approx(8.0)
+    for i in range(DurationModel.max_samples):
+        durations.add("install", 1.0, patches=1)
+    durations.save()
+    durations = DurationModel(str(tmpdir))
+    assert durations.estimate("install", patches=4, packages=100) == 4.0
+
+def test_duration_model_convert(tmpdir):
+    """Samples from older versions are converted.
+    """
+    (tmpdir / DurationModel.fname).write_text(
+        json.dumps({ 'install': [[2, 10.0]], 'refresh': [[1, 5.0]] }),
+        encoding="ascii")
+    durations = DurationModel(str(tmpdir))
+    assert durations.estimate("install", patches=4) == 20.0
+    assert durations.estimate("refresh") == 5.0
+
+def test_window_remaining():
+    now = datetime.datetime.now().timestamp()
+    window = Window(now + 1000, margin=100)
+    assert 890 < window.remaining() <= 900
+    assert window.fits(800)
+    assert not window.fits(950)
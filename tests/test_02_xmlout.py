@@ -0,0 +1,51 @@
+"""Test retrieving the list of patches from zypper in XML format.
+"""
+
+from conftest import AutoPatchCaller, get_report_body, get_report_log
+
+
+xmlout = { 'zypper': { 'xmlout': "on" } }
+
+def test_sec_patches_xml(tmpdir):
+    """Some security patches available, listed in XML format.
+
+    The report should contain a table of the patches rather than the
+    XML output of zypper.
+    """
+    with tmpdir.as_cwd():
+        caller = AutoPatchCaller.get_caller("sec_patches_xml", config=xmlout)
+        caller.run()
+        _, msg = caller.check_report()
+        body = get_report_log(msg)
+        assert "<update" not in body
+        for name in ("openSUSE-2020-1743", "openSUSE-2020-1744",
+                     "openSUSE-2020-1745"):
+            assert name in body
+        assert "Security update for freetype2" in body
+
+
+def test_interactive_only_xml(tmpdir):
+    """Only an interactive patch is needed.
+
+    auto-patch should not even try to install it.  Note that the mock
+    zypper would fail the test if the zypper patch command was called.
+    """
+    with tmpdir.as_cwd():
+        caller = AutoPatchCaller.get_caller("interactive_xml", config=xmlout)
+        caller.run()
+        _, msg = caller.check_report()
+        assert "openSUSE-2020-1801" in get_report_log(msg)
+
+
+def test_zypp_patches_xml(tmpdir):
+    """A patch affects the package manager itself, restart required.
+
+    The patches remaining after the restart are known from the
+    structured list, so there is no need to check and list them again.
+    """
+    with tmpdir.as_cwd():
+        caller = AutoPatchCaller.get_caller("zypp_patches_xml", config=xmlout)
+        caller.run()
+        _, msg = caller.check_report()
+        assert "zypper has been called 7 times" in get_report_log(msg)
+        assert "zypper has been called 7 times" in get_report_body(msg)
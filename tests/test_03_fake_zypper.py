@@ -0,0 +1,58 @@
+"""Run auto-patch.py end to end with a stand-in for zypper.
+
+In contrast to the other tests, auto-patch is run as a separate
+process here, calling the stand-in fake-zypper.py as a subprocess.
+The outcome is checked by means of the metrics file.
+"""
+
+from pathlib import Path
+import pytest
+from bench_auto_patch import get_scenarios, run_scenario, scenario_settings
+from test_02_metrics import read_metrics
+
+
+@pytest.mark.parametrize("scenario,exitcode", [
+    ("sec_patches", 0),
+    ("zypp_patches_xml", 0),
+    ("err_scripterr", 107),
+])
+def test_fake_zypper(tmpdir, scenario, exitcode):
+    """Run some standard scenarios with a large volume of output.
+    """
+    config, args = scenario_settings.get(scenario, (None, []))
+    res = run_scenario(str(tmpdir), scenario, get_scenarios()[scenario],
+                       volume=1000, config=config, args=args)
+    assert res.exitcode == exitcode
+    metrics = read_metrics(Path(str(tmpdir), "auto-patch.prom"))
+    assert metrics['auto_patch_last_run_exit_code{mode="patch"}'] == exitcode
+
+def test_fake_zypper_timeout(tmpdir):
+    """zypper hangs in the patch call, ignoring SIGTERM.
+
+    The call should be killed after the timeout and auto-patch should
+    fail with the exit code for ZypperSignal.
+    """
+    config = { 'zypper': { 'timeouts': "patch:1", 'kill_timeout': "1" } }
+    res = run_scenario(str(tmpdir), "sec_patches",
+                       get_scenarios()["sec_patches"],
+                       config=config, hang="patch")
+    assert res.exitcode == 105
+    assert res.wall < 15
+    metrics = read_metrics(Path(str(tmpdir), "auto-patch.prom"))
+    assert metrics['auto_patch_last_run_exit_code{mode="patch"}'] == 105
+
+def test_fake_zypper_lock(tmpdir):
+    """Another process holds the ZYPP lock at the start.
+
+    auto-patch should notice when the lock is released and try again
+    immediately, rather than waiting for the configured delay.
+    """
+    config = { 'retry': { 'wait': "30", 'max_wait': "30" } }
+    res = run_scenario(str(tmpdir), "sec_patches",
+                       get_scenarios()["sec_patches"],
+                       lock_hold=1.0, config=config)
+    assert res.exitcode == 0
+    assert res.wall < 15
+    metrics = read_metrics(Path(str(tmpdir), "auto-patch.prom"))
+    assert metrics['auto_patch_retries{mode="patch"}'] >= 1
+    assert metrics['auto_patch_lock_wait_seconds{mode="patch"}'] > 0